@@ -0,0 +1,53 @@
+"""
+Article counts per category and per tag for the feed's sidebar.
+
+``Category.article_count`` and ``Tag.article_count`` are adjusted by signals as
+articles are created, moved between categories, tagged, untagged and deleted,
+one UPDATE per change, so the sidebar reads two small tables and never groups
+the articles. Writes that send no signal (``QuerySet.update``, ``bulk_create``,
+raw SQL) leave them behind; ``recount_blog_facets`` recomputes them.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Article, Category, Tag
+
+SIDEBAR_SIZE = 20
+
+
+def shift_count(queryset: QuerySet, delta: int):
+    if delta:
+        # A count left behind too low must not fail the delete with the CHECK >= 0.
+        queryset.update(article_count=Greatest(F("article_count") + delta, 0))
+
+
+def shift_categories(category_ids, delta: int):
+    shift_count(Category.objects.filter(pk__in=list(category_ids)), delta)
+
+
+def shift_tags(tag_ids, delta: int):
+    shift_count(Tag.objects.filter(pk__in=list(tag_ids)), delta)
+
+
+def recount_facets() -> int:
+    """
+    Recompute every count from the articles; returns the number of counts that were wrong.
+    """
+    drifted = 0
+    for model, links, column in (
+        (Category, Article.objects, "category"),
+        (Tag, Article.tags.through.objects, "tag"),
+    ):
+        counts = links.filter(**{column: OuterRef("pk")}).order_by().values(column).annotate(count=Count("pk"))
+        actual = Coalesce(Subquery(counts.values("count"), output_field=IntegerField()), 0)
+        drifted += model.objects.annotate(actual=actual).exclude(article_count=F("actual")).count()
+        model.objects.update(article_count=actual)
+    return drifted
+
+
+def sidebar_categories() -> QuerySet:
+    return Category.objects.filter(article_count__gt=0).order_by("-article_count", "name")[:SIDEBAR_SIZE]
+
+
+def sidebar_tags() -> QuerySet:
+    return Tag.objects.filter(article_count__gt=0).order_by("-article_count", "name")[:SIDEBAR_SIZE]
@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from blogapp.facets import recount_facets
+
+
+class Command(BaseCommand):
+    """
+    Recompute the article counts of categories and tags, e.g. after bulk or raw SQL writes.
+    """
+
+    def handle(self, *args, **options):
+        drifted = recount_facets()
+        self.stdout.write(self.style.SUCCESS(f"Recounted the facets, {drifted} counts were wrong"))
@@ -0,0 +1,36 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from blogapp.models import Article
+from blogapp.rendering import RENDERED_FIELDS, RENDERER_VERSION, render_article
+
+
+class Command(BaseCommand):
+    """
+    Render the article bodies and excerpts that are missing or come from an older renderer.
+
+    Needed after ``RENDERER_VERSION`` goes up, after changing the compression
+    settings with ``--all``, and after writes that bypass ``Article.save``.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Render every article again")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        articles = Article.objects.only("pk", "content").order_by("pk")
+        if not options["all"]:
+            articles = articles.exclude(render_version=RENDERER_VERSION)
+        started = perf_counter()
+        rendered, batch = 0, []
+        for article in articles.iterator(chunk_size=options["batch_size"]):
+            render_article(article)
+            batch.append(article)
+            if len(batch) == options["batch_size"]:
+                Article.objects.bulk_update(batch, RENDERED_FIELDS)
+                rendered += len(batch)
+                batch = []
+        Article.objects.bulk_update(batch, RENDERED_FIELDS)
+        rendered += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} articles in {perf_counter() - started:.1f} s"))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:26
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_articles(apps, schema_editor):
+    # A frozen copy of blogapp.facets.recount_facets.
+    Article = apps.get_model("blogapp", "Article")
+    database = schema_editor.connection.alias
+    for model, links, column in (
+        (apps.get_model("blogapp", "Category"), Article.objects, "category"),
+        (apps.get_model("blogapp", "Tag"), Article.tags.through.objects, "tag"),
+    ):
+        counts = links.filter(**{column: OuterRef("pk")}).order_by().values(column).annotate(count=Count("pk"))
+        model.objects.using(database).update(
+            article_count=Coalesce(Subquery(counts.values("count"), output_field=IntegerField()), 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0002_alter_article_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='article_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='article_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['category', 'id'], name='blog_article_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['author', 'id'], name='blog_article_author_idx'),
+        ),
+        # The feed by tag: the auto-created through table only indexes (article, tag) and tag.
+        migrations.RunSQL(
+            "CREATE INDEX blog_article_tags_tag_idx ON blogapp_article_tags (tag_id, article_id)",
+            "DROP INDEX blog_article_tags_tag_idx",
+        ),
+        migrations.RunPython(count_articles, migrations.RunPython.noop),
+    ]
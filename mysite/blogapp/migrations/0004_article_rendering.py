@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:27
+
+import zlib
+
+from django.db import migrations, models
+from django.utils.html import linebreaks, urlize
+from django.utils.text import Truncator
+
+
+def render_articles(apps, schema_editor):
+    # A frozen copy of blogapp.rendering with its default settings.
+    Article = apps.get_model("blogapp", "Article")
+    database = schema_editor.connection.alias
+    articles = Article.objects.using(database).only("pk", "content")
+    batch = []
+    for article in articles.iterator(chunk_size=500):
+        html = linebreaks(urlize(article.content, nofollow=True, autoescape=True)).encode()
+        article.body_codec = "zlib" if len(html) >= 1024 else ""
+        article.body = zlib.compress(html, 6) if article.body_codec else html
+        article.excerpt = Truncator(" ".join(article.content.split())).words(50)
+        article.render_version = 1
+        batch.append(article)
+        if len(batch) == 500:
+            Article.objects.using(database).bulk_update(batch, ["body", "body_codec", "excerpt", "render_version"])
+            batch = []
+    Article.objects.using(database).bulk_update(batch, ["body", "body_codec", "excerpt", "render_version"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0003_article_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='body',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='body_codec',
+            field=models.CharField(blank=True, default='', editable=False, max_length=8),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(render_articles, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,8 @@
 from django.db import models
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from .rendering import RENDERED_FIELDS, decompress, render_article
 
 
 class Author(models.Model):
@@ -8,16 +12,46 @@ class Author(models.Model):
 
 class Category(models.Model):
     name = models.CharField(max_length=40)
+    # Kept in step with the articles by signals, see signals.py.
+    article_count = models.PositiveIntegerField(default=0, editable=False)
 
 
 class Tag(models.Model):
     name = models.CharField(max_length=20)
+    # Kept in step with Article.tags by signals, see signals.py.
+    article_count = models.PositiveIntegerField(default=0, editable=False)
 
 
 class Article(models.Model):
+    class Meta:
+        indexes = [
+            # The article feed by category or author, newest, i.e. highest id, first.
+            models.Index(fields=["category", "id"], name="blog_article_category_idx"),
+            models.Index(fields=["author", "id"], name="blog_article_author_idx"),
+        ]
     title = models.CharField(max_length=200)
     content = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag, )
+    # Rendered from ``content`` on save, see rendering.py.
+    body = models.BinaryField(default=b"", editable=False)
+    body_codec = models.CharField(max_length=8, blank=True, default="", editable=False)
+    excerpt = models.TextField(blank=True, default="", editable=False)
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "content" in update_fields:
+            render_article(self)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *RENDERED_FIELDS}
+        super().save(*args, **kwargs)
+
+    @property
+    def body_html(self) -> str:
+        return mark_safe(decompress(bytes(self.body), self.body_codec).decode())
+
+    def get_absolute_url(self):
+        return reverse("blogapp:article_details", kwargs={"pk": self.pk})
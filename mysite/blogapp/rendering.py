@@ -0,0 +1,85 @@
+"""
+Pre-rendered article bodies.
+
+When an article is saved its ``content`` is rendered once into
+
+- ``body``: the HTML of the whole article, compressed with zlib or zstd once
+  it reaches ``COMPRESS_MIN_SIZE`` bytes, with the codec in ``body_codec``;
+- ``excerpt``: its first words as plain text, for lists and feeds.
+
+Pages and feeds read these columns and defer ``content``: a feed costs no
+rendering at all and a detail page one decompression. ``RENDERER_VERSION``
+goes up whenever the output changes; ``render_articles`` re-renders the
+articles rendered by an older version or saved without signals.
+"""
+import logging
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.html import linebreaks, urlize
+from django.utils.text import Truncator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+RENDERER_VERSION = 1
+RENDERED_FIELDS = ["body", "body_codec", "excerpt", "render_version"]
+UNCOMPRESSED = ""
+
+
+def render_html(content: str) -> str:
+    # What ``{{ content|urlize|linebreaks }}`` would render on every request.
+    return linebreaks(urlize(content, nofollow=True, autoescape=True))
+
+
+def render_excerpt(content: str) -> str:
+    return Truncator(" ".join(content.split())).words(settings.BLOG_RENDERING["EXCERPT_WORDS"])
+
+
+def pick_codec(size: int) -> str:
+    config = settings.BLOG_RENDERING
+    if size < config["COMPRESS_MIN_SIZE"] or config["COMPRESSION"] == "none":
+        return UNCOMPRESSED
+    if config["COMPRESSION"] == "zstd" and zstandard is None:
+        log.warning("BLOG_RENDERING asks for zstd but zstandard is not installed, using zlib")
+        return "zlib"
+    return config["COMPRESSION"]
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    level = settings.BLOG_RENDERING["LEVEL"]
+    if codec == UNCOMPRESSED:
+        return data
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ImproperlyConfigured(f"Unknown article body codec {codec!r}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == UNCOMPRESSED:
+        return data
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImproperlyConfigured("Article bodies are stored with zstd; install zstandard to read them")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ImproperlyConfigured(f"Unknown article body codec {codec!r}")
+
+
+def render_article(article):
+    """
+    Fill the rendered fields of ``article`` from its ``content``; does not save.
+    """
+    html = render_html(article.content).encode()
+    article.body_codec = pick_codec(len(html))
+    article.body = compress(html, article.body_codec)
+    article.excerpt = render_excerpt(article.content)
+    article.render_version = RENDERER_VERSION
@@ -0,0 +1,60 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .facets import shift_categories, shift_tags
+from .models import Article
+
+
+@receiver(pre_save, sender=Article)
+def remember_category(sender, instance: Article, **kwargs):
+    instance._previous_category_id = None
+    if instance.pk is not None:
+        instance._previous_category_id = (
+            Article.objects.filter(pk=instance.pk).values_list("category_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Article)
+def article_saved(sender, instance: Article, created: bool, **kwargs):
+    previous = getattr(instance, "_previous_category_id", None)
+    if created or previous is None:
+        shift_categories([instance.category_id], 1)
+    elif previous != instance.category_id:
+        shift_categories([previous], -1)
+        shift_categories([instance.category_id], 1)
+
+
+@receiver(pre_delete, sender=Article)
+def remember_tags(sender, instance: Article, **kwargs):
+    # The links are deleted with the article without an m2m_changed.
+    instance._deleted_tag_ids = list(Article.tags.through.objects.filter(article=instance).values_list("tag_id", flat=True))
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted(sender, instance: Article, **kwargs):
+    shift_categories([instance.category_id], -1)
+    shift_tags(getattr(instance, "_deleted_tag_ids", []), -1)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if action in ("pre_remove", "pre_clear"):
+        # ``remove()`` reports the ids it was given, linked or not, and ``clear()`` none:
+        # remember the links about to go.
+        links = Article.tags.through.objects.filter(**{"tag" if reverse else "article": instance})
+        if action == "pre_remove":
+            links = links.filter(**{"article__in" if reverse else "tag__in": pk_set})
+        instance._unlinked_ids = list(links.values_list("article_id" if reverse else "tag_id", flat=True))
+        return
+    if action == "post_add":
+        # Only the links that were actually created.
+        changed, delta = pk_set, 1
+    elif action in ("post_remove", "post_clear"):
+        changed, delta = getattr(instance, "_unlinked_ids", []), -1
+    else:
+        return
+    if reverse:
+        # Tagged or untagged from the tag side: one tag, many articles.
+        shift_tags([instance.pk], delta * len(changed))
+    else:
+        shift_tags(changed, delta)
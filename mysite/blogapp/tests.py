@@ -1,3 +1,145 @@
-from django.test import TestCase
+import re
+from io import StringIO
+from unittest import skipIf
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from blogapp import rendering
+from blogapp.models import Article, Author, Category, Tag
+
+
+class ArticleFacetsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.author = Author.objects.create(name="Author", bio="")
+        self.news, self.howto = Category.objects.create(name="News"), Category.objects.create(name="How-to")
+        self.django, self.python = Tag.objects.create(name="django"), Tag.objects.create(name="python")
+        self.article = Article.objects.create(title="First", content="", author=self.author, category=self.news)
+        self.article.tags.add(self.django, self.python)
+
+    def counts(self) -> tuple:
+        return (
+            dict(Category.objects.values_list("name", "article_count")),
+            dict(Tag.objects.values_list("name", "article_count")),
+        )
+
+    def test_counts_follow_articles(self):
+        self.assertEqual(self.counts(), ({"News": 1, "How-to": 0}, {"django": 1, "python": 1}))
+        other = Article.objects.create(title="Second", content="", author=self.author, category=self.news)
+        self.python.article_set.add(other)
+        self.article.tags.remove(self.python, self.python)
+        self.article.tags.remove(Tag.objects.create(name="unlinked"))
+        other.category = self.howto
+        other.save()
+        self.assertEqual(self.counts(), ({"News": 1, "How-to": 1}, {"django": 1, "python": 1, "unlinked": 0}))
+        self.article.tags.clear()
+        other.delete()
+        self.assertEqual(self.counts(), ({"News": 1, "How-to": 0}, {"django": 0, "python": 0, "unlinked": 0}))
+
+    def test_counts_drifted_low_do_not_block_deletes(self):
+        Category.objects.update(article_count=0)
+        Tag.objects.update(article_count=0)
+        self.article.delete()
+        self.assertEqual(self.counts(), ({"News": 0, "How-to": 0}, {"django": 0, "python": 0}))
+
+    def test_recount_fixes_drift(self):
+        Tag.objects.update(article_count=7)
+        out = StringIO()
+        call_command("recount_blog_facets", stdout=out)
+        self.assertIn("2 counts were wrong", out.getvalue())
+        self.assertEqual(self.counts()[1], {"django": 1, "python": 1})
+
+
+class ArticleListViewTestCase(TestCase):
+    full_scan = re.compile(r"\bSCAN (?!.*\bUSING\b.*\bINDEX\b)|USE TEMP B-TREE")
+
+    def setUp(self) -> None:
+        self.author = Author.objects.create(name="Author", bio="")
+        self.news = Category.objects.create(name="News")
+        self.tag = Tag.objects.create(name="django")
+        for index in range(45):
+            article = Article.objects.create(title=f"Article {index}", content="", author=self.author, category=self.news)
+            if index % 3 == 0:
+                article.tags.add(self.tag)
+
+    def walk(self, params: dict) -> list:
+        titles, url = [], reverse("blogapp:articles_list")
+        response = self.client.get(url, params)
+        while True:
+            titles += [article.title for article in response.context["articles"]]
+            if not response.context["next_url"]:
+                return titles
+            response = self.client.get(url + response.context["next_url"])
+
+    def test_pages_cover_feed_once(self):
+        titles = self.walk({})
+        self.assertEqual(titles, [f"Article {index}" for index in reversed(range(45))])
+        self.assertEqual(len(self.walk({"tag": self.tag.pk, "category": self.news.pk})), 15)
+
+    def test_page_queries(self):
+        # The page, its tags and the two sidebar facets; no COUNT, no GROUP BY.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("blogapp:articles_list"), {"author": self.author.pk})
+        self.assertEqual([tag.article_count for tag in response.context["tags"]], [15])
+
+    def test_filters_use_indexes(self):
+        queries = {
+            "feed": Article.objects.filter(pk__lt=30).order_by("-pk")[:21],
+            "category": Article.objects.filter(category=self.news, pk__lt=30).order_by("-pk")[:21],
+            "author": Article.objects.filter(author=self.author, pk__lt=30).order_by("-pk")[:21],
+            "tag": Article.tags.through.objects.filter(
+                tag=self.tag, article__category=self.news, article_id__lt=30,
+            ).order_by("-article_id").values("article_id")[:21],
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIsNone(self.full_scan.search(plan), f"{name} is not indexed:\n{plan}")
+
+
+class ArticleRenderingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.author = Author.objects.create(name="Author", bio="")
+        self.category = Category.objects.create(name="News")
+        self.content = "First <b>paragraph</b> with https://example.com\n\n" + "word " * 500
+
+    def create(self, content: str) -> Article:
+        return Article.objects.create(title="Article", content=content, author=self.author, category=self.category)
+
+    def test_save_renders_compressed_body_and_excerpt(self):
+        article = Article.objects.get(pk=self.create(self.content).pk)
+        self.assertEqual(article.body_codec, "zlib")
+        self.assertLess(len(article.body), len(article.body_html))
+        self.assertIn("<p>First &lt;b&gt;paragraph&lt;/b&gt; with <a href=\"https://example.com\"", article.body_html)
+        self.assertEqual(len(article.excerpt.split()), 50)
+        article.content = "Short"
+        article.save(update_fields=["content"])
+        article.refresh_from_db()
+        self.assertEqual((article.body_codec, article.body_html), ("", "<p>Short</p>"))
+
+    @override_settings(BLOG_RENDERING={"COMPRESSION": "zstd", "COMPRESS_MIN_SIZE": 0, "LEVEL": 3, "EXCERPT_WORDS": 5})
+    @skipIf(rendering.zstandard is not None, "zstandard is installed")
+    def test_zstd_falls_back_to_zlib(self):
+        with self.assertLogs("blogapp.rendering", "WARNING"):
+            article = self.create("Short")
+        self.assertEqual(article.body_codec, "zlib")
+
+    def test_detail_and_feed_serve_rendered_fields(self):
+        article = self.create(self.content)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(article.get_absolute_url())
+        self.assertContains(response, "<p>First &lt;b&gt;paragraph&lt;/b&gt;")
+        self.assertFalse(any('"content"' in query["sql"] for query in queries))
+        response = self.client.get(reverse("blogapp:articles_feed"))
+        self.assertContains(response, "First &lt;b&gt;paragraph&lt;/b&gt; with https://example.com word")
+
+    def test_render_articles_fills_unrendered(self):
+        article = self.create(self.content)
+        Article.objects.filter(pk=article.pk).update(content="Changed", render_version=0)
+        out = StringIO()
+        call_command("render_articles", stdout=out)
+        self.assertIn("Rendered 1 articles", out.getvalue())
+        self.assertEqual(Article.objects.get(pk=article.pk).body_html, "<p>Changed</p>")
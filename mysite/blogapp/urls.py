@@ -2,6 +2,8 @@ from django.urls import path, include
 
 from .views import (
     ArticleListView,
+    ArticleDetailView,
+    LatestArticlesFeed,
 )
 
 app_name = 'blogapp'
@@ -9,4 +11,6 @@ app_name = 'blogapp'
 
 urlpatterns = [
     path("articles/", ArticleListView.as_view(), name="articles_list"),
+    path("articles/<int:pk>/", ArticleDetailView.as_view(), name="article_details"),
+    path("articles/latest/feed/", LatestArticlesFeed(), name="articles_feed"),
 ]
@@ -1,16 +1,126 @@
+from typing import Optional
+from urllib.parse import urlencode
+
+from django.db.models import QuerySet, Subquery
+from django.http import Http404
 from django.shortcuts import render
-from django.views.generic import ListView
+from django.contrib.syndication.views import Feed
+from django.urls import reverse_lazy
+from django.views.generic import DetailView, ListView
 
+from blogapp.facets import sidebar_categories, sidebar_tags
 from blogapp.models import Article
 
 
 class ArticleListView(ListView):
+    """
+    The article feed, newest first, optionally by ``?category=``, ``?tag=`` and ``?author=`` ids.
+
+    ``pub_date`` is set on creation, so newest first is highest id first:
+    ``?after=<id>`` seeks to the next page through the ``(filter, id)`` index
+    behind each filter, so a page costs the same at any depth and no count is
+    made. The sidebar reads the stored article counts, see facets.py.
+    """
     model = Article
     queryset = (
         Article.objects
         .select_related('author', 'category')
         .prefetch_related('tags')
-        .defer('content')
+        .defer('content', 'body')
     )
     template_name = "blogapp//article_list.html"
     context_object_name = "articles"
+    page_size = 20
+    filters = ("category", "tag", "author")
+
+    def get_filters(self) -> dict:
+        filters = {}
+        for name in self.filters:
+            value = self.request.GET.get(name)
+            if value:
+                if not value.isdigit():
+                    raise Http404(f"Invalid {name}")
+                filters[name] = int(value)
+        return filters
+
+    def tag_links(self, tag_id: int, after: Optional[int]) -> QuerySet:
+        """
+        The ids of the page's articles with the tag, newest first, walking the ``(tag, article)`` index.
+
+        Ordering the articles themselves by id would sort every article of the tag.
+        """
+        links = Article.tags.through.objects.filter(tag_id=tag_id)
+        if "category" in self.active_filters:
+            links = links.filter(article__category_id=self.active_filters["category"])
+        if "author" in self.active_filters:
+            links = links.filter(article__author_id=self.active_filters["author"])
+        if after:
+            links = links.filter(article_id__lt=after)
+        return links.order_by("-article_id").values("article_id")[:self.page_size + 1]
+
+    def get_queryset(self) -> list:
+        articles = super().get_queryset()
+        self.active_filters = self.get_filters()
+        after = self.request.GET.get("after")
+        if after and not after.isdigit():
+            raise Http404("Invalid cursor")
+        after = int(after) if after else None
+        if "tag" in self.active_filters:
+            articles = articles.filter(pk__in=Subquery(self.tag_links(self.active_filters["tag"], after)))
+        else:
+            if "category" in self.active_filters:
+                articles = articles.filter(category_id=self.active_filters["category"])
+            if "author" in self.active_filters:
+                articles = articles.filter(author_id=self.active_filters["author"])
+            if after:
+                articles = articles.filter(pk__lt=after)
+        page = list(articles.order_by("-pk")[:self.page_size + 1])
+        self.next_cursor = page[self.page_size - 1].pk if len(page) > self.page_size else None
+        return page[:self.page_size]
+
+    def query_with(self, **changes) -> str:
+        params = {**self.active_filters, **changes}
+        return "?" + urlencode({name: value for name, value in params.items() if value is not None})
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        categories, tags = list(sidebar_categories()), list(sidebar_tags())
+        for category in categories:
+            category.filter_url = self.query_with(category=category.pk)
+        for tag in tags:
+            tag.filter_url = self.query_with(tag=tag.pk)
+        context["categories"] = categories
+        context["tags"] = tags
+        context["filtered"] = bool(self.active_filters)
+        context["next_url"] = self.query_with(after=self.next_cursor) if self.next_cursor else None
+        return context
+
+
+class ArticleDetailView(DetailView):
+    """
+    An article from its pre-rendered body: one decompression, no rendering.
+    """
+    queryset = Article.objects.select_related("author", "category").prefetch_related("tags").defer("content")
+    template_name = "blogapp/article_details.html"
+    context_object_name = "article"
+
+
+class LatestArticlesFeed(Feed):
+    title = "Blog articles (latest)"
+    description = "New articles of the blog"
+    link = reverse_lazy("blogapp:articles_list")
+
+    def items(self):
+        return Article.objects.select_related("author").defer("content", "body").order_by("-pk")[:20]
+
+    def item_title(self, item: Article):
+        return item.title
+
+    def item_description(self, item: Article):
+        return item.excerpt
+
+    def item_author_name(self, item: Article):
+        return item.author.name
+
+    def item_pubdate(self, item: Article):
+        return item.pub_date
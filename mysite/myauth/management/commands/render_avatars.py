@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from myauth.models import Profile
+from myauth.renditions import rendition_urls, render_avatar
+
+
+class Command(BaseCommand):
+    """
+    Render the avatar thumbnails that are missing, e.g. for avatars uploaded before renditions existed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Render existing thumbnails again")
+        parser.add_argument("--workers", type=int, default=max(1, settings.MYAUTH_AVATAR_RENDITIONS["WORKERS"]))
+
+    def render(self, avatar_name: str):
+        try:
+            render_avatar(avatar_name)
+        except Exception as error:
+            return avatar_name, error
+        return avatar_name, None
+
+    def handle(self, *args, **options):
+        names = Profile.objects.exclude(avatar="").exclude(avatar__isnull=True).values_list("avatar", flat=True)
+        sizes = settings.MYAUTH_AVATAR_RENDITIONS["SIZES"]
+        todo = [
+            name for name in names.iterator()
+            if options["force"] or any(rendition_urls(name, size) is None for size in sizes)
+        ]
+        started = perf_counter()
+        failed = 0
+        with ThreadPoolExecutor(options["workers"]) as pool:
+            for name, error in pool.map(self.render, todo):
+                if error is not None:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"{name}: {error}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {len(todo) - failed} of {len(todo)} avatars in {perf_counter() - started:.1f} s"
+        ))
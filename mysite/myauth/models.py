@@ -2,11 +2,10 @@ from django.contrib.auth.models import User
 from django.db import models
 
 
-def profile_avatar_path(instanse: "Profile", filename: str) -> str:
-    print(instanse)
-    return "users/user_{name}_{pk}/avatar/{filename}".format(
-        name=instanse.user.username,
-        pk=instanse.pk,
+def profile_avatar_path(instance: "Profile", filename: str) -> str:
+    # user_id, not user: no query per save, and unlike the profile pk it is set before the first save.
+    return "users/user_{user_id}/avatar/{filename}".format(
+        user_id=instance.user_id,
         filename=filename,
     )
 
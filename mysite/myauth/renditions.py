@@ -0,0 +1,148 @@
+"""
+Avatar renditions.
+
+Pages show avatars as small square thumbnails instead of the uploaded
+originals, which can weigh megabytes:
+
+- once a new avatar is committed, a pool of worker threads renders every size
+  of ``MYAUTH_AVATAR_RENDITIONS["SIZES"]`` as WebP and JPEG, outside of the
+  request; Pillow releases the GIL while decoding and resampling;
+- renditions live on disk under ``ROOT``, named after the avatar file and the
+  pixel size, so a new avatar or a new size never serves a stale thumbnail;
+- until its JPEG, written last, exists a rendition is pending and pages fall
+  back to the original, scaled down by the browser.
+
+``render_avatars`` renders the avatars uploaded before renditions existed.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+# Written in this order: the JPEG existing means the rendition is complete.
+FORMATS = ("webp", "jpeg")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending: set = set()
+
+
+def config() -> dict:
+    return settings.MYAUTH_AVATAR_RENDITIONS
+
+
+def rendition_name(avatar_name: str, pixels: int, fmt: str) -> str:
+    digest = hashlib.sha1(avatar_name.encode()).hexdigest()
+    return f"{digest[:2]}/{digest}-{pixels}.{fmt}"
+
+
+def rendition_path(avatar_name: str, pixels: int, fmt: str) -> Path:
+    return Path(config()["ROOT"]) / rendition_name(avatar_name, pixels, fmt)
+
+
+def rendition_urls(avatar_name: str, size: str) -> Optional[dict]:
+    """
+    ``{"webp": url, "jpeg": url}`` of a rendered avatar size, ``None`` while it is pending.
+    """
+    pixels = config()["SIZES"][size]
+    if not rendition_path(avatar_name, pixels, "jpeg").exists():
+        return None
+    return {fmt: config()["URL"] + rendition_name(avatar_name, pixels, fmt) for fmt in FORMATS}
+
+
+def save_atomically(image: Image.Image, path: Path, fmt: str, **options):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as file:
+        try:
+            image.save(file, format=fmt, **options)
+        except Exception:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def render_avatar(avatar_name: str, storage=default_storage):
+    """
+    Render every size of the avatar stored as ``avatar_name``.
+    """
+    sizes = sorted(config()["SIZES"].values(), reverse=True)
+    quality = config()["QUALITY"]
+    with storage.open(avatar_name, "rb") as file:
+        image = Image.open(file)
+        # Lets the JPEG decoder skip detail the largest size never shows.
+        image.draft("RGB", (sizes[0] * 2, sizes[0] * 2))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    # Image.has_transparency_data needs Pillow 10.1; the lock file pins 10.0.
+    transparent = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    image = image.convert("RGBA" if transparent else "RGB")
+    # Crop and scale the original once; the smaller sizes resize the largest.
+    largest = ImageOps.fit(image, (sizes[0], sizes[0]), Image.Resampling.LANCZOS)
+    for pixels in sizes:
+        thumbnail = largest if pixels == sizes[0] else largest.resize((pixels, pixels), Image.Resampling.LANCZOS)
+        save_atomically(thumbnail, rendition_path(avatar_name, pixels, "webp"), "WEBP", quality=quality, method=4)
+        if thumbnail.mode == "RGBA":
+            background = Image.new("RGB", thumbnail.size, "white")
+            background.paste(thumbnail, mask=thumbnail.getchannel("A"))
+            thumbnail = background
+        save_atomically(
+            thumbnail, rendition_path(avatar_name, pixels, "jpeg"), "JPEG",
+            quality=quality, optimize=True, progressive=True,
+        )
+
+
+def delete_renditions(avatar_name: str):
+    for pixels in config()["SIZES"].values():
+        for fmt in FORMATS:
+            rendition_path(avatar_name, pixels, fmt).unlink(missing_ok=True)
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(config()["WORKERS"], thread_name_prefix="avatar-renditions")
+        return _executor
+
+
+def run_safely(task, avatar_name: str):
+    try:
+        task(avatar_name)
+    except Exception:
+        # The page keeps falling back to the original.
+        log.exception("Avatar rendition task %s failed for %s", task.__name__, avatar_name)
+    finally:
+        _pending.discard((task.__name__, avatar_name))
+
+
+def submit(task, avatar_name: str):
+    if not config()["WORKERS"]:
+        run_safely(task, avatar_name)
+        return
+    key = (task.__name__, avatar_name)
+    if key in _pending:
+        return
+    _pending.add(key)
+    executor().submit(run_safely, task, avatar_name)
+
+
+def schedule_renditions(avatar_name: str):
+    """
+    Render ``avatar_name`` in the pool once the current transaction commits.
+    """
+    transaction.on_commit(lambda: submit(render_avatar, avatar_name))
+
+
+def schedule_deletion(avatar_name: str):
+    transaction.on_commit(lambda: submit(delete_renditions, avatar_name))
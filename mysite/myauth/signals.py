@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Profile
+from .renditions import schedule_deletion, schedule_renditions
+
+
+@receiver(pre_save, sender=Profile)
+def remember_avatar(sender, instance: Profile, **kwargs):
+    instance._previous_avatar = None
+    if instance.pk is not None:
+        instance._previous_avatar = Profile.objects.filter(pk=instance.pk).values_list("avatar", flat=True).first()
+
+
+@receiver(post_save, sender=Profile)
+def avatar_changed(sender, instance: Profile, **kwargs):
+    previous = getattr(instance, "_previous_avatar", None) or ""
+    current = instance.avatar.name or ""
+    if previous == current:
+        return
+    if previous:
+        schedule_deletion(previous)
+    if current:
+        schedule_renditions(current)
+
+
+@receiver(post_delete, sender=Profile)
+def avatar_deleted(sender, instance: Profile, **kwargs):
+    if instance.avatar:
+        schedule_deletion(instance.avatar.name)
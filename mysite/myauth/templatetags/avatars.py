@@ -0,0 +1,29 @@
+from django import template
+
+from myauth.models import Profile
+from myauth.renditions import config, rendition_urls
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar_url(profile: Profile, size: str = "medium", fmt: str = "jpeg") -> str:
+    """
+    The URL of a rendition of the avatar, of the original while it is pending, "" without an avatar.
+    """
+    if not profile.avatar:
+        return ""
+    urls = rendition_urls(profile.avatar.name, size)
+    return urls[fmt] if urls else profile.avatar.url
+
+
+@register.inclusion_tag("myauth/avatar.html")
+def avatar(profile: Profile, size: str = "medium") -> dict:
+    """
+    A square ``<picture>`` of the avatar, WebP with a JPEG fallback.
+    """
+    return {
+        "profile": profile,
+        "pixels": config()["SIZES"][size],
+        "urls": rendition_urls(profile.avatar.name, size) if profile.avatar else None,
+    }
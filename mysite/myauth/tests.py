@@ -1,3 +1,115 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from myauth.models import Profile
+from myauth.renditions import rendition_path
+
+
+def image_file(name: str = "avatar.png", size: tuple = (600, 400)) -> SimpleUploadedFile:
+    buffer = BytesIO()
+    Image.new("RGBA", size, (200, 40, 40, 255)).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class AvatarRenditionsTestCase(TestCase):
+    def setUp(self) -> None:
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media,
+            MYAUTH_AVATAR_RENDITIONS={
+                "ROOT": Path(media) / "renditions",
+                "URL": "/media/renditions/",
+                "SIZES": {"small": 48, "medium": 160, "large": 320},
+                "QUALITY": 80,
+                "WORKERS": 0,
+            },
+        ))
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.profile = Profile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def test_upload_renders_thumbnails_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("myauth:about_me"), {"avatar": image_file()})
+        self.profile.refresh_from_db()
+        for pixels in (48, 160, 320):
+            with Image.open(rendition_path(self.profile.avatar.name, pixels, "jpeg")) as image:
+                self.assertEqual(image.size, (pixels, pixels))
+            self.assertTrue(rendition_path(self.profile.avatar.name, pixels, "webp").exists())
+        response = self.client.get(reverse("myauth:user_details", kwargs={"pk": self.profile.pk}))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertNotContains(response, self.profile.avatar.url)
+
+    def test_pending_thumbnails_fall_back_to_original(self):
+        # The callbacks never run: the renditions stay pending.
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse("myauth:about_me"), {"avatar": image_file()})
+        self.assertEqual(len(callbacks), 1)
+        self.profile.refresh_from_db()
+        response = self.client.get(reverse("myauth:users_list"))
+        self.assertContains(response, f'<img src="{self.profile.avatar.url}" width="48" height="48"')
+
+    def test_replaced_avatar_drops_old_thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("myauth:about_me"), {"avatar": image_file("first.png")})
+        self.profile.refresh_from_db()
+        first = self.profile.avatar.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("myauth:about_me"), {"avatar": image_file("second.png")})
+        self.assertFalse(rendition_path(first, 48, "jpeg").exists())
+
+    def test_render_avatars_backfills(self):
+        # Saved without signals, like avatars uploaded before renditions existed.
+        self.profile.avatar.save("old.png", image_file(), save=False)
+        Profile.objects.filter(pk=self.profile.pk).update(avatar=self.profile.avatar.name)
+        out = StringIO()
+        call_command("render_avatars", stdout=out)
+        self.assertIn("Rendered 1 of 1 avatars", out.getvalue())
+        self.assertTrue(rendition_path(self.profile.avatar.name, 160, "jpeg").exists())
+
+
+class UserDirectoryTestCase(TestCase):
+    def setUp(self) -> None:
+        users = User.objects.bulk_create(User(username=f"user{index:03}") for index in range(120))
+        Profile.objects.bulk_create(Profile(user=user) for user in users)
+        self.url = reverse("myauth:users_list")
+
+    def usernames(self, response) -> list:
+        return [profile.user.username for profile in response.context["profiles"]]
+
+    def test_page_is_one_joined_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(self.usernames(response)[0], "user000")
+        self.assertEqual(len(self.usernames(response)), 50)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"after": response.context["next_after"]})
+        self.assertEqual(self.usernames(response)[0], "user050")
+
+    def test_keyset_pages_walk_both_ways(self):
+        response = self.client.get(self.url, {"after": "user099"})
+        self.assertEqual(self.usernames(response), [f"user{index}" for index in range(100, 120)])
+        self.assertIsNone(response.context["next_after"])
+        response = self.client.get(self.url, {"before": response.context["previous_before"]})
+        self.assertEqual(self.usernames(response)[0], "user050")
+        self.assertEqual(response.context["previous_before"], "user050")
+
+    def test_prefix_search(self):
+        response = self.client.get(self.url, {"q": "user11"})
+        self.assertEqual(self.usernames(response), [f"user11{index}" for index in range(10)])
+
+    def test_directory_query_uses_username_index(self):
+        plan = Profile.objects.select_related("user").filter(
+            user__username__gte="user1", user__username__lt="user2",
+        ).order_by("user__username")[:51].explain()
+        self.assertNotRegex(plan, r"\bSCAN (?!.*\bUSING\b.*\bINDEX\b)|USE TEMP B-TREE")
@@ -4,6 +4,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LogoutView
 from django.core.files.storage import FileSystemStorage
+from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse_lazy, reverse
@@ -50,15 +51,58 @@ class AboutMeView(TemplateView):
         return render(request, self.template_name, self.get_context_data(**kwargs))
 
 
+def prefix_end(prefix: str) -> str:
+    """
+    The smallest string above every string starting with ``prefix``.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
 class UserListView(ListView):
-    model = Profile
+    """
+    The user directory, by username, with keyset pagination and prefix search.
+
+    ``?after=<username>`` and ``?before=<username>`` seek straight to the next
+    and previous page through the unique index on ``auth_user.username``, so a
+    page costs one joined query however deep it is and no count is made.
+    ``?q=`` keeps the usernames starting with it, as a range on that index.
+    """
     template_name = "myauth/users-list.html"
     context_object_name = "profiles"
+    page_size = 50
+
+    def get_directory(self) -> QuerySet:
+        profiles = Profile.objects.select_related("user")
+        self.prefix = self.request.GET.get("q", "").strip()
+        if self.prefix:
+            profiles = profiles.filter(user__username__gte=self.prefix, user__username__lt=prefix_end(self.prefix))
+        return profiles
+
+    def get_queryset(self) -> list:
+        profiles = self.get_directory()
+        after, before = self.request.GET.get("after"), self.request.GET.get("before")
+        if before:
+            page = list(profiles.filter(user__username__lt=before).order_by("-user__username")[:self.page_size + 1])
+            self.has_previous, self.has_next = len(page) > self.page_size, True
+            return page[:self.page_size][::-1]
+        if after:
+            profiles = profiles.filter(user__username__gt=after)
+        page = list(profiles.order_by("user__username")[:self.page_size + 1])
+        self.has_previous, self.has_next = bool(after), len(page) > self.page_size
+        return page[:self.page_size]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        profiles = context["profiles"]
+        context["q"] = self.prefix
+        context["next_after"] = profiles[-1].user.username if profiles and self.has_next else None
+        context["previous_before"] = profiles[0].user.username if profiles and self.has_previous else None
+        return context
 
 
 class UserDetailView(DetailView):
     template_name = "myauth/user-details.html"
-    model = Profile
+    queryset = Profile.objects.select_related("user")
     context_object_name = "profile"
 
 
@@ -58,7 +58,6 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sitemaps',
 
-    'debug_toolbar',
     'rest_framework',
     'django_filters',
     'drf_spectacular',
@@ -69,22 +68,30 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shopapp.middlewares.PerformanceMiddleware',
+    'shopapp.middlewares.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shopapp.middlewares.ThrottlingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+if DEBUG:
+    # The toolbar middleware is sync only and would force every async view
+    # back onto a thread, so it is only enabled for local development.
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'shopapp.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -109,16 +116,95 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DATABASE_DIR / 'db.sqlite3',
         # 'NAME': '/mnt/c/Users/Alexa/db.sqlite3',
+        # Keep connections between requests, checking them before reuse. Only
+        # for WSGI: under ASGI every sync_to_async thread would keep a connection
+        # of its own, each with the page cache and mmap of SHOP_SQLITE_PRAGMAS,
+        # so mysite/asgi.py defaults DJANGO_CONN_MAX_AGE to 0.
+        'CONN_MAX_AGE': int(os.getenv("DJANGO_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': os.getenv("DJANGO_CONN_HEALTH_CHECKS", "1") == "1",
+    }
+}
+
+# Read-only replicas, e.g. DJANGO_DB_REPLICAS=/data/replica1.sqlite3,/data/replica2.sqlite3.
+# Plain paths are opened read-only; "file:" URIs are used as given.
+DATABASE_REPLICAS = [path for path in os.getenv("DJANGO_DB_REPLICAS", "").split(",") if path]
+for number, path in enumerate(DATABASE_REPLICAS, start=1):
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        'NAME': path if path.startswith("file:") else f"file:{path}?mode=ro",
+        'OPTIONS': {"uri": True},
+        'TEST': {"MIRROR": "default"},
     }
+
+DATABASE_ROUTERS = ["shopapp.replicas.ReplicaRouter"]
+
+# Isolates the tests from state shared between processes, see mysite/testing.py.
+TEST_RUNNER = "mysite.testing.TestRunner"
+
+# See shopapp.replicas: how long a client reads from the primary after a write,
+# how far behind a replica may be and how often replicas are checked. The pin
+# never ends before MAX_LAG_SECONDS, or a client could miss its own write.
+SHOP_REPLICAS = {
+    "ALIASES": [alias for alias in DATABASES if alias != "default"],
+    "PIN_SECONDS": int(os.getenv("DJANGO_DB_REPLICA_PIN_SECONDS", 10)),
+    "MAX_LAG_SECONDS": float(os.getenv("DJANGO_DB_REPLICA_MAX_LAG", 10)),
+    "CHECK_INTERVAL": float(os.getenv("DJANGO_DB_REPLICA_CHECK_INTERVAL", 5)),
+    "COOKIE_NAME": "db_pin",
+}
+
+# Applied to every new SQLite connection by shopapp.sqlite, in this order.
+SHOP_SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    # Negative sizes are in KiB: 64 MiB of page cache per connection.
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64 * 1024)),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
 }
 
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "BACKEND": "shopapp.instrumentation.InstrumentedFileBasedCache",
         "LOCATION": "/var/tmp/django_cache",
     }
 }
 
+# Per-user order exports are keyed on a generation counter bumped by signals,
+# so they can live in the cache for a long time without going stale.
+SHOP_EXPORT_CACHE_TIMEOUT = int(os.getenv("SHOP_EXPORT_CACHE_TIMEOUT", 6 * 60 * 60))
+
+# Per-request metrics from PerformanceMiddleware: a Server-Timing header and a
+# JSON line in the "shopapp.performance" log. The log line is off by default,
+# as it adds an INFO line to every request; SHOP_PERFORMANCE_LOG=1 turns it on.
+SHOP_INSTRUMENTATION = {
+    "SERVER_TIMING": os.getenv("SHOP_SERVER_TIMING", "1") == "1",
+    "LOG": os.getenv("SHOP_PERFORMANCE_LOG", "0") == "1",
+}
+
+# Token bucket limits: ``rate`` requests per second with bursts of up to ``burst``.
+# Buckets are shared by all worker processes: "shared_memory" keeps them in a
+# fixed-size memory-mapped table on this host, "cache" in the CACHE_ALIAS cache.
+SHOP_THROTTLING = {
+    "BACKEND": os.getenv("SHOP_THROTTLING_BACKEND", "shared_memory"),
+    "CACHE_ALIAS": os.getenv("SHOP_THROTTLING_CACHE", "default"),
+    "SHARED_MEMORY_PATH": os.getenv("SHOP_THROTTLING_SHARED_MEMORY_PATH"),
+    "SHARED_MEMORY_SLOTS": int(os.getenv("SHOP_THROTTLING_SHARED_MEMORY_SLOTS", 65536)),
+    # Never the proxy's address: behind a local reverse proxy every client has it.
+    "EXEMPT_IPS": [ip for ip in os.getenv("SHOP_THROTTLING_EXEMPT_IPS", "").split(",") if ip],
+    "ANONYMOUS": {
+        "rate": float(os.getenv("SHOP_THROTTLING_ANONYMOUS_RATE", 20)),
+        "burst": int(os.getenv("SHOP_THROTTLING_ANONYMOUS_BURST", 40)),
+    },
+    "AUTHENTICATED": {
+        "rate": float(os.getenv("SHOP_THROTTLING_AUTHENTICATED_RATE", 50)),
+        "burst": int(os.getenv("SHOP_THROTTLING_AUTHENTICATED_BURST", 100)),
+    },
+    "ROUTES": {
+        "shopapp:order_export": {"rate": 0.5, "burst": 10},
+        "shopapp:user_orders_export": {"rate": 1, "burst": 10},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -141,7 +227,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
-LANGUAGE_CODE = 'en-us'
+LANGUAGE_CODE = 'en'
 
 TIME_ZONE = 'UTC'
 
@@ -166,6 +252,58 @@ STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
+
+# Background jobs, see shopapp/jobs.py: run_workers claims due jobs from the
+# database; a job whose worker stops renewing its LEASE_SECONDS lease is run
+# again. Failed attempts are retried after RETRY_DELAY * 2 ** (attempt - 1)
+# seconds. Inputs and results are files under ROOT, outside MEDIA_ROOT since
+# exports are not public. CSV imports over INLINE_IMPORT_MAX_SIZE bytes are
+# queued instead of run in the request. purge_jobs deletes finished jobs and
+# their files RESULT_TTL seconds after they finished.
+SHOP_JOBS = {
+    "ROOT": Path(os.getenv("SHOP_JOBS_ROOT", BASE_DIR / "jobs")),
+    "LEASE_SECONDS": int(os.getenv("SHOP_JOBS_LEASE_SECONDS", 300)),
+    "RETRY_DELAY": float(os.getenv("SHOP_JOBS_RETRY_DELAY", 30)),
+    "POLL_SECONDS": float(os.getenv("SHOP_JOBS_POLL_SECONDS", 1)),
+    "INLINE_IMPORT_MAX_SIZE": int(os.getenv("SHOP_JOBS_INLINE_IMPORT_MAX_SIZE", 1024 * 1024)),
+    "RESULT_TTL": int(os.getenv("SHOP_JOBS_RESULT_TTL", 7 * 24 * 3600)),
+}
+
+# Article bodies are rendered to HTML on save, see blogapp/rendering.py, and
+# stored compressed with COMPRESSION ("zlib", "zstd" when the zstandard package
+# is installed, or "none") once they reach COMPRESS_MIN_SIZE bytes.
+BLOG_RENDERING = {
+    "COMPRESSION": os.getenv("BLOG_COMPRESSION", "zlib"),
+    "COMPRESS_MIN_SIZE": int(os.getenv("BLOG_COMPRESS_MIN_SIZE", 1024)),
+    "LEVEL": int(os.getenv("BLOG_COMPRESSION_LEVEL", 6)),
+    "EXCERPT_WORDS": 50,
+}
+
+# Avatar thumbnails, see myauth/renditions.py: every size in SIZES is rendered
+# as a square WebP and JPEG by a pool of WORKERS threads once the upload is
+# committed; WORKERS = 0 renders them inline.
+MYAUTH_AVATAR_RENDITIONS = {
+    "ROOT": Path(os.getenv("MYAUTH_RENDITIONS_ROOT", MEDIA_ROOT / "renditions")),
+    "URL": os.getenv("MYAUTH_RENDITIONS_URL", MEDIA_URL + "renditions/"),
+    "SIZES": {"small": 48, "medium": 160, "large": 320},
+    "QUALITY": int(os.getenv("MYAUTH_RENDITIONS_QUALITY", 80)),
+    "WORKERS": int(os.getenv("MYAUTH_RENDITIONS_WORKERS", 2)),
+}
+
+# Uploads are hashed as they stream to disk and stored once per content under
+# ROOT, see shopapp/uploads.py. MAX_SIZE bounds a whole file of a signed-in
+# user, ANONYMOUS_MAX_SIZE one sent to the form without logging in: blobs are
+# kept forever. CHUNK_SIZE bounds one request of a resumable upload;
+# SESSION_TTL is how long an unfinished resumable upload is kept before
+# purge_upload_sessions deletes it.
+SHOP_UPLOADS = {
+    "ROOT": Path(os.getenv("SHOP_UPLOADS_ROOT", MEDIA_ROOT / "blobs")),
+    "URL": os.getenv("SHOP_UPLOADS_URL", MEDIA_URL + "blobs/"),
+    "MAX_SIZE": int(os.getenv("SHOP_UPLOADS_MAX_SIZE", 512 * 1024 * 1024)),
+    "ANONYMOUS_MAX_SIZE": int(os.getenv("SHOP_UPLOADS_ANONYMOUS_MAX_SIZE", 1024 * 1024)),
+    "CHUNK_SIZE": int(os.getenv("SHOP_UPLOADS_CHUNK_SIZE", 8 * 1024 * 1024)),
+    "SESSION_TTL": int(os.getenv("SHOP_UPLOADS_SESSION_TTL", 24 * 60 * 60)),
+}
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -230,11 +368,29 @@ logging.config.dictConfig({
 
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
+
+from shopapp.sampling import parse_route_rates, traces_sampler
+
+# Which requests are traced, see shopapp.sampling. Rates are per path prefix,
+# without the language prefix; errors are always reported whatever the rates.
+SHOP_TRACE_SAMPLING = {
+    "DEFAULT_RATE": float(os.getenv("SENTRY_TRACES_DEFAULT_RATE", 0.05)),
+    "ROUTES": parse_route_rates(os.getenv(
+        "SENTRY_TRACES_ROUTE_RATES",
+        "/shop/api/=0.001,/api/schema=0.001,/static/=0,/media/=0,"
+        "/sitemap.xml=0.001,/shop/products/latest/feed/=0.001",
+    )),
+    "SLOW_REQUEST_SECONDS": float(os.getenv("SENTRY_TRACES_SLOW_REQUEST_SECONDS", 1.0)),
+    "BOOST_SECONDS": float(os.getenv("SENTRY_TRACES_BOOST_SECONDS", 60)),
+    "TRACES_PER_SECOND": float(os.getenv("SENTRY_TRACES_PER_SECOND", 2)),
+    "BURST": int(os.getenv("SENTRY_TRACES_BURST", 20)),
+}
+
 sentry_sdk.init(
     dsn="https://73f948b568f851ecf0205b5ccb8504a6@o4505753084952576.ingest.sentry.io/4505753089015808",
     integrations=[DjangoIntegration()],
     send_default_pii=True,
-    traces_sample_rate=1.0,
-    profiles_sample_rate=1.0,
+    traces_sampler=traces_sampler,
+    # A share of the traced transactions, not of all requests.
+    profiles_sample_rate=float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", 0.1)),
 )
-
@@ -0,0 +1,37 @@
+"""
+The test runner of the project, see TEST_RUNNER.
+
+- the shared_memory throttling backend keeps its buckets in a file under
+  /dev/shm by default, which outlives a test run: the requests of earlier runs,
+  or of a server running next to them, would count against the tests. Each run
+  gets a bucket file of its own instead;
+- the per-request lines of the ``shopapp.performance`` log stay off, even with
+  SHOP_PERFORMANCE_LOG=1, so they do not bury the test output. Tests of the
+  log switch it on themselves.
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.scratch = tempfile.mkdtemp(prefix="mysite-tests-")
+        self.isolated = override_settings(
+            SHOP_THROTTLING={
+                **settings.SHOP_THROTTLING,
+                "SHARED_MEMORY_PATH": os.path.join(self.scratch, "throttling"),
+            },
+            SHOP_INSTRUMENTATION={**settings.SHOP_INSTRUMENTATION, "LOG": False},
+        )
+        self.isolated.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated.disable()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -20,8 +20,10 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.sitemaps.views import sitemap
 from django.urls import path, include
+from django.views.decorators.http import condition
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from shopapp.conditional import catalogue_etag, catalogue_last_modified
 from .sitemaps import sitemaps
 
 
@@ -34,7 +36,12 @@ urlpatterns = [
     path('api/schema/swagger', SpectacularSwaggerView.as_view(url_name='schema'), name="swagger"),
     path('accounts/', include('myauth.urls')),
     path('sentry-debug/', trigger_error),
-    path("sitemap.xml", sitemap, {"sitemaps": sitemaps}, name="django.contrib.sitemaps.views.sitemap")
+    path(
+        "sitemap.xml",
+        condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)(sitemap),
+        {"sitemaps": sitemaps},
+        name="django.contrib.sitemaps.views.sitemap",
+    ),
 ]
 
 urlpatterns += i18n_patterns(
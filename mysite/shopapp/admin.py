@@ -1,15 +1,21 @@
-from csv import DictReader
+import uuid
 from io import TextIOWrapper
 
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
-from django.urls import path
+from django.urls import path, reverse
+from django.utils import timezone
 
-from shopapp.models import Product, Order
+from shopapp.models import Job, Product, Order
 from .forms import CSVImportFrom
+from .importers import OrderCSVImporter
+from .jobs import job_path, submit as submit_job
+from .search import fts_available, search_products
+from .signals import bump_catalogue
 
 
 class OrderInline(admin.TabularInline):
@@ -18,12 +24,14 @@ class OrderInline(admin.TabularInline):
 
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    queryset.update(archived=True, updated_at=timezone.now())
+    bump_catalogue()
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    queryset.update(archived=False, updated_at=timezone.now())
+    bump_catalogue()
 
 
 @admin.register(Product)
@@ -53,6 +61,11 @@ class ProductAdmin(admin.ModelAdmin):
         })
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not fts_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return search_products(queryset, search_term.split()), False
+
 
 class ProductInline(admin.TabularInline):
     model = Order.products.through
@@ -64,7 +77,9 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         ProductInline,
     ]
-    list_display = "pk", "delivery_address", "promocode", "created_at", "user"
+    list_display = "pk", "delivery_address", "promocode", "created_at", "user", "items_count", "total", "discounted_total"
+    readonly_fields = "items_count", "total", "discounted_total"
+    import_errors_shown = 20
 
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == 'GET':
@@ -79,22 +94,43 @@ class OrderAdmin(admin.ModelAdmin):
                 "form": form,
             }
             return render(request, "admin/csv_form.html", context, status=400)
+        upload = form.files["csv_file"]
+        if upload.size > settings.SHOP_JOBS["INLINE_IMPORT_MAX_SIZE"]:
+            return self.queue_import(request, upload)
         csv_file = TextIOWrapper(
-            form.files["csv_file"].file,
-            encoding=request.encoding,
+            upload.file,
+            encoding=request.encoding or "utf-8",
+            newline="",
+        )
+        report = OrderCSVImporter(user=request.user).run(csv_file)
+        self.message_user(request, f"Data from CSV was imported. {report.summary()}")
+        for line, error in report.errors[:self.import_errors_shown]:
+            self.message_user(request, f"Line {line}: {error}", level=messages.WARNING)
+        if len(report.errors) > self.import_errors_shown:
+            self.message_user(
+                request,
+                f"{len(report.errors) - self.import_errors_shown} more rows were rejected",
+                level=messages.WARNING,
+            )
+        return redirect("..")
+
+    def queue_import(self, request: HttpRequest, upload) -> HttpResponse:
+        """
+        Hand a large CSV to a background job instead of importing it in the request.
+        """
+        name = f"inputs/{uuid.uuid4().hex}.csv"
+        with job_path(name).open("wb") as file:
+            for chunk in upload.chunks():
+                file.write(chunk)
+        job = submit_job(
+            "import_orders_csv",
+            {"input": name, "user_id": request.user.pk, "encoding": request.encoding or "utf-8"},
+            request.user,
+        )
+        self.message_user(
+            request,
+            f"The CSV is imported in the background as job {job.pk}: {reverse('shopapp:job', kwargs={'pk': job.pk})}",
         )
-        reader = DictReader(csv_file)
-        orders = []
-        for row in reader:
-            instance = Order.objects.create(delivery_address=row['delivery_address'],
-                                            promocode=row['promocode'],
-                                            user=request.user,
-                                            )
-            products = Product.objects.filter(id__in=[int(i) for i in row['products'].split(' ')])
-            instance.user = request.user
-            instance.products.set(products)
-
-        self.message_user(request, "Data from CSV was imported")
         return redirect("..")
 
     def get_urls(self):
@@ -107,3 +143,10 @@ class OrderAdmin(admin.ModelAdmin):
             )
         ]
         return new_urls + urls
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = "pk", "kind", "status", "attempts", "progress_done", "progress_total", "created_by", "created_at", "finished_at"
+    list_filter = "status", "kind"
+    readonly_fields = [field.name for field in Job._meta.fields]
@@ -0,0 +1,106 @@
+"""
+Conditional GET for the product pages, the feed, the sitemap and the product API.
+
+ETags and ``Last-Modified`` come from metadata, never from a rendered response:
+
+- a single product is validated by its ``updated_at``, one indexed lookup;
+- responses listing the catalogue are validated by the catalogue version and
+  by the time ``bump_catalogue`` last moved it, both from the cache, so
+  deletions and archiving change ``Last-Modified`` too.
+
+Both are checked by Django's ``condition`` before the view runs, so a 304 costs
+no template or serializer. ETags also cover what else makes two responses of
+one URL differ: the query string, the language, the user and ``Accept``.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Product
+from .signals import CATALOGUE_CHANGED_KEY, CATALOGUE_NAMESPACE
+from .versioning import get_version
+
+
+def variant_etag(request, *parts) -> str:
+    """
+    An ETag of ``parts`` that also differs between the variants of one URL.
+    """
+    user = getattr(request, "user", None)
+    variant = (
+        *parts,
+        request.get_full_path(),
+        translation.get_language(),
+        user.pk if user is not None else None,
+        request.META.get("HTTP_ACCEPT", ""),
+    )
+    return hashlib.md5(repr(variant).encode()).hexdigest()
+
+
+def product_updated_at(request, pk) -> Optional[datetime]:
+    # ``condition`` asks for the ETag and the Last-Modified separately; query once.
+    if getattr(request, "_product_updated_at", (None, None))[0] != pk:
+        updated_at = Product.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+        request._product_updated_at = (pk, updated_at)
+    return request._product_updated_at[1]
+
+
+def product_etag(request, pk, **kwargs) -> Optional[str]:
+    updated_at = product_updated_at(request, pk)
+    return variant_etag(request, pk, updated_at.timestamp()) if updated_at else None
+
+
+def product_last_modified(request, pk, **kwargs) -> Optional[datetime]:
+    return product_updated_at(request, pk)
+
+
+def catalogue_etag(request, *args, **kwargs) -> str:
+    return variant_etag(request, get_version(CATALOGUE_NAMESPACE))
+
+
+def catalogue_last_modified(request, *args, **kwargs) -> Optional[datetime]:
+    changed_at = cache.get(CATALOGUE_CHANGED_KEY)
+    if changed_at is None:
+        # Never bumped, or evicted: start from now, which can only cause a needless 200.
+        changed_at = timezone.now()
+        if not cache.add(CATALOGUE_CHANGED_KEY, changed_at, timeout=None):
+            changed_at = cache.get(CATALOGUE_CHANGED_KEY, changed_at)
+    return changed_at
+
+
+def acondition(etag_func=None, last_modified_func=None):
+    """
+    ``django.views.decorators.http.condition`` for async views; the validators stay sync.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = await sync_to_async(etag_func)(request, *args, **kwargs) if etag_func else None
+            etag = quote_etag(etag) if etag is not None else None
+            last_modified = None
+            if last_modified_func:
+                modified_at = await sync_to_async(last_modified_func)(request, *args, **kwargs)
+                if modified_at:
+                    if not timezone.is_aware(modified_at):
+                        modified_at = timezone.make_aware(modified_at, dt_timezone.utc)
+                    last_modified = int(modified_at.timestamp())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+
+        return inner
+
+    return decorator
@@ -0,0 +1,23 @@
+"""
+Setup of every new database connection.
+
+- ``shopapp.sqlite`` applies the pragmas of ``SHOP_SQLITE_PRAGMAS``;
+- ``shopapp.instrumentation`` times its queries for ``PerformanceMiddleware``;
+- ``shopapp.replicas`` retries failed replica reads on the primary.
+
+Connected in ``ShopappConfig.ready()``; ``shopapp.signals`` keeps to the model
+receivers.
+"""
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .instrumentation import install_query_timer
+from .replicas import install_fail_over
+from .sqlite import configure_connection
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    configure_connection(connection)
+    install_query_timer(connection)
+    install_fail_over(connection)
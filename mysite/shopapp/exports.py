@@ -0,0 +1,115 @@
+"""
+Streaming order export.
+
+Orders are read with a server-side iterator and their product ids are fetched
+with one query per batch, so memory use does not depend on the number of orders.
+Every iterator has an async twin built on the async ORM for ASGI deployments.
+"""
+import json
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import QuerySet
+from django.http import HttpRequest, StreamingHttpResponse
+
+from .models import Order
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FIELDS = ("pk", "delivery_address", "promocode", "user_id")
+
+
+def attach_products(rows: list[dict]) -> list[dict]:
+    """
+    Add product ids to a batch of exported orders with a single query.
+    """
+    products = {row["pk"]: row.setdefault("products", []) for row in rows}
+    links = (
+        Order.products.through.objects
+        .filter(order_id__in=products.keys())
+        .order_by("order_id", "product_id")
+        .values_list("order_id", "product_id")
+    )
+    for order_id, product_id in links:
+        products[order_id].append(product_id)
+    return rows
+
+
+def iter_order_batches(queryset: QuerySet[Order], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[list[dict]]:
+    """
+    Yield exported orders in batches of at most ``batch_size`` rows.
+    """
+    rows = queryset.order_by("pk").values(*EXPORT_FIELDS).iterator(chunk_size=batch_size)
+    while batch := list(islice(rows, batch_size)):
+        yield attach_products(batch)
+
+
+async def aiter_order_batches(queryset: QuerySet[Order], batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list[dict]]:
+    batch = []
+    async for row in queryset.order_by("pk").values(*EXPORT_FIELDS).aiterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield await sync_to_async(attach_products)(batch)
+            batch = []
+    if batch:
+        yield await sync_to_async(attach_products)(batch)
+
+
+def iter_json(batches: Iterable[list[dict]]) -> Iterator[str]:
+    """
+    Encode batches as a single {"orders": [...]} document, one chunk per batch.
+    """
+    yield '{"orders": ['
+    separator = ""
+    for batch in batches:
+        yield separator + ", ".join(json.dumps(row) for row in batch)
+        separator = ", "
+    yield "]}"
+
+
+def iter_ndjson(batches: Iterable[list[dict]]) -> Iterator[str]:
+    """
+    Encode batches as newline delimited JSON, one order per line.
+    """
+    for batch in batches:
+        yield "".join(json.dumps(row) + "\n" for row in batch)
+
+
+async def aiter_json(batches: AsyncIterable[list[dict]]) -> AsyncIterator[str]:
+    yield '{"orders": ['
+    separator = ""
+    async for batch in batches:
+        yield separator + ", ".join(json.dumps(row) for row in batch)
+        separator = ", "
+    yield "]}"
+
+
+async def aiter_ndjson(batches: AsyncIterable[list[dict]]) -> AsyncIterator[str]:
+    async for batch in batches:
+        yield "".join(json.dumps(row) + "\n" for row in batch)
+
+
+async def aexport_json(queryset: QuerySet[Order]) -> str:
+    """
+    Build the whole {"orders": [...]} document without blocking the event loop.
+    """
+    return "".join([chunk async for chunk in aiter_json(aiter_order_batches(queryset))])
+
+
+STREAM_FORMATS = {
+    "json": ("application/json", iter_json, aiter_json),
+    "ndjson": ("application/x-ndjson", iter_ndjson, aiter_ndjson),
+}
+
+
+def stream_orders(request: HttpRequest, queryset: QuerySet[Order], stream_format: str) -> StreamingHttpResponse:
+    """
+    Stream an export with the iterator flavour the server can consume without buffering.
+    """
+    content_type, encode, aencode = STREAM_FORMATS[stream_format]
+    if isinstance(request, ASGIRequest):
+        content = aencode(aiter_order_batches(queryset))
+    else:
+        content = encode(iter_order_batches(queryset))
+    return StreamingHttpResponse(content, content_type=content_type)
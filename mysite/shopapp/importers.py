@@ -0,0 +1,148 @@
+"""
+Bulk order import from CSV.
+
+Rows are read from the upload as a stream and handled in chunks: every chunk is
+validated, its product ids and prices are resolved with one query, and its
+orders, with their totals, and order-product links are written with
+``bulk_create`` in one transaction, together with the sales rollups. A bad row never stops the import; it is
+reported with its line number at the end.
+"""
+import csv
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Order, Product
+from .signals import bump_user_orders
+from .rollups import count_created_orders
+from .totals import Totals
+
+REQUIRED_COLUMNS = ("delivery_address", "promocode", "products")
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    imported: int = 0
+    seconds: float = 0.0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Imported {self.imported} of {self.rows} rows in {self.seconds:.1f} s "
+            f"({self.rows_per_second:.0f} rows/s), {len(self.errors)} rows rejected"
+        )
+
+
+@dataclass
+class OrderRow:
+    line: int
+    delivery_address: str
+    promocode: str
+    product_ids: list[int]
+    # (id, price, discount) of the distinct products, once validated.
+    products: list[tuple[int, Decimal, int]] = field(default_factory=list)
+
+
+class OrderCSVImporter:
+    chunk_size = 1000
+    promocode_max_length = Order._meta.get_field("promocode").max_length
+
+    def __init__(self, user: User, chunk_size: int = None):
+        self.user = user
+        self.chunk_size = chunk_size or self.chunk_size
+
+    def parse_row(self, line: int, row: dict) -> OrderRow:
+        promocode = row["promocode"] or ""
+        if len(promocode) > self.promocode_max_length:
+            raise RowError(f"promocode is longer than {self.promocode_max_length} characters")
+        try:
+            product_ids = [int(pk) for pk in (row["products"] or "").split()]
+        except ValueError:
+            raise RowError(f"products must be space separated ids, got {row['products']!r}")
+        return OrderRow(line, row["delivery_address"] or "", promocode, product_ids)
+
+    def validate_chunk(self, rows: list[tuple[int, dict]], report: ImportReport) -> list[OrderRow]:
+        parsed = []
+        for line, row in rows:
+            try:
+                parsed.append(self.parse_row(line, row))
+            except RowError as error:
+                report.errors.append((line, str(error)))
+        wanted = {pk for row in parsed for pk in row.product_ids}
+        prices = {
+            pk: (price, discount)
+            for pk, price, discount in Product.objects.filter(pk__in=wanted).values_list("pk", "price", "discount")
+        }
+        valid = []
+        for row in parsed:
+            missing = sorted(set(row.product_ids) - prices.keys())
+            if missing:
+                report.errors.append((row.line, f"unknown products {missing}"))
+            else:
+                row.products = [(pk, *prices[pk]) for pk in dict.fromkeys(row.product_ids)]
+                valid.append(row)
+        return valid
+
+    def write_chunk(self, rows: list[OrderRow]) -> int:
+        # bulk_create sends no signals: totals and rollups are written here.
+        with transaction.atomic():
+            orders = Order.objects.bulk_create(
+                Order(
+                    delivery_address=row.delivery_address,
+                    promocode=row.promocode,
+                    user=self.user,
+                    **asdict(Totals.of((price, discount) for _, price, discount in row.products)),
+                )
+                for row in rows
+            )
+            Order.products.through.objects.bulk_create(
+                Order.products.through(order_id=order.pk, product_id=product_id)
+                for order, row in zip(orders, rows)
+                for product_id, _, _ in row.products
+            )
+            count_created_orders(orders, {order.pk: row.products for order, row in zip(orders, rows)})
+        return len(orders)
+
+    def chunks(self, lines: Iterable[str], report: ImportReport) -> Iterator[list[tuple[int, dict]]]:
+        reader = csv.DictReader(lines)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            report.errors.append((1, f"missing columns {missing}"))
+            return
+        # Line numbers point at the CSV line of the row, the header being line 1.
+        rows = ((reader.line_num, row) for row in reader)
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield chunk
+
+    def run(self, lines: Iterable[str], progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+        """
+        Import every row of ``lines``; ``progress`` is called with the report after each chunk.
+        """
+        report = ImportReport()
+        started = perf_counter()
+        for chunk in self.chunks(lines, report):
+            report.rows += len(chunk)
+            valid = self.validate_chunk(chunk, report)
+            if valid:
+                report.imported += self.write_chunk(valid)
+            if progress is not None:
+                progress(report)
+        if report.imported:
+            bump_user_orders([self.user.pk])
+        report.seconds = perf_counter() - started
+        report.errors.sort()
+        return report
@@ -0,0 +1,146 @@
+"""
+Per-request performance metrics.
+
+``PerformanceMiddleware`` opens a ``RequestMetrics`` for every request and keeps
+it in a context variable, which ``sync_to_async`` carries into worker threads.
+Everything below adds to it while it is set and costs a single lookup otherwise:
+
+- ``time_query`` is installed on every database connection as an execute
+  wrapper and counts queries and their time;
+- the ``Instrumented*Cache`` backends count hits and misses;
+- the ``InstrumentedDjangoTemplates`` backend times template rendering.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.backends.django import DjangoTemplates, Template
+
+_MISSING = object()
+
+
+@dataclass
+class RequestMetrics:
+    started: float = field(default_factory=perf_counter)
+    db_queries: int = 0
+    db_time: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cache_time: float = 0.0
+    template_time: float = 0.0
+    view_started: float = None
+    view_time: float = 0.0
+    total_time: float = 0.0
+
+    def finish(self):
+        finished = perf_counter()
+        self.total_time = finished - self.started
+        if self.view_started is not None:
+            self.view_time = finished - self.view_started
+
+    def server_timing(self) -> str:
+        return ", ".join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+            f'cache;dur={self.cache_time * 1000:.1f};desc="{self.cache_hits} hit / {self.cache_misses} miss"',
+            f"tpl;dur={self.template_time * 1000:.1f}",
+            f"view;dur={self.view_time * 1000:.1f}",
+            f"total;dur={self.total_time * 1000:.1f}",
+        ))
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round(self.total_time * 1000, 2),
+            "view_ms": round(self.view_time * 1000, 2),
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db_time * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_ms": round(self.cache_time * 1000, 2),
+            "template_ms": round(self.template_time * 1000, 2),
+        }
+
+
+current_metrics: ContextVar[RequestMetrics | None] = ContextVar("current_metrics", default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += perf_counter() - started
+        metrics.db_queries += 1
+
+
+def install_query_timer(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class InstrumentedCacheMixin:
+    """
+    Count hits and misses of ``get`` and ``get_many``; ``aget`` and ``get_or_set`` go through ``get``.
+    """
+
+    def get(self, key, default=None, version=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().get(key, default, version)
+        started = perf_counter()
+        value = super().get(key, _MISSING, version)
+        metrics.cache_time += perf_counter() - started
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    def get_many(self, keys, version=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().get_many(keys, version)
+        keys = list(keys)
+        started = perf_counter()
+        # Backends may implement get_many with get; count each key once.
+        token = current_metrics.set(None)
+        try:
+            values = super().get_many(keys, version)
+        finally:
+            current_metrics.reset(token)
+        metrics.cache_time += perf_counter() - started
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+
+
+class InstrumentedFileBasedCache(InstrumentedCacheMixin, FileBasedCache):
+    pass
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,342 @@
+"""
+Background jobs in the database.
+
+Heavy work is submitted as a ``Job`` row and run by ``run_workers`` processes
+instead of inside a request; clients poll the job and download its result.
+There is no broker, only the existing database:
+
+- a worker claims a job with a compare-and-swap ``UPDATE ... WHERE pk = %s
+  AND attempts = %s``: of several workers that picked the same candidate,
+  exactly one updates a row, the others move on to the next candidate;
+- a claim is a lease. A heartbeat thread renews it while the job runs; a
+  job whose worker died stops renewing and is claimed again once the lease
+  expires. A job whose worker still runs on this host is left alone even
+  then, so a task never runs twice at once;
+- a failed attempt is queued again after an exponential backoff until
+  ``max_attempts`` is reached. Tasks that are not idempotent, like the CSV
+  import, get a single attempt.
+
+Tasks are functions registered with ``@task``; they get the job and a
+``JobContext`` to report progress and write result files. ``purge_jobs``
+deletes finished jobs with their files once ``RESULT_TTL`` has passed.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from io import TextIOWrapper
+from pathlib import Path
+from time import monotonic
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .exports import iter_json, iter_ndjson, iter_order_batches
+from .importers import OrderCSVImporter
+from .models import Job, Order
+from .rollups import order_months, rebuild_month
+
+log = logging.getLogger(__name__)
+
+# Progress is written at most this often; every write renews the lease.
+PROGRESS_INTERVAL = 0.5
+CLAIM_CANDIDATES = 5
+
+
+@dataclass
+class Task:
+    function: Callable
+    max_attempts: int
+
+
+TASKS: dict[str, Task] = {}
+
+
+def task(kind: str, max_attempts: int = 3):
+    def register(function):
+        TASKS[kind] = Task(function, max_attempts)
+        return function
+
+    return register
+
+
+def root() -> Path:
+    return Path(settings.SHOP_JOBS["ROOT"])
+
+
+def job_path(name: str) -> Path:
+    path = root() / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claimant_alive(worker: str) -> bool:
+    """
+    Whether the ``worker_id()`` ``worker`` may still be running.
+
+    Only processes on this host can be checked; elsewhere the lease decides.
+    """
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit(kind: str, params: Optional[dict] = None, user: Optional[User] = None, delay: float = 0) -> Job:
+    return Job.objects.create(
+        kind=kind,
+        params=params or {},
+        max_attempts=TASKS[kind].max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        created_by=user,
+    )
+
+
+def lease_end():
+    return timezone.now() + timedelta(seconds=settings.SHOP_JOBS["LEASE_SECONDS"])
+
+
+def claim(worker: str) -> Optional[Job]:
+    """
+    Atomically take the next due job for ``worker``, or return ``None``.
+    """
+    now = timezone.now()
+    due = Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, lease_expires__lt=now)
+    candidates = Job.objects.filter(due).order_by("run_after", "pk").values_list(
+        "pk", "status", "attempts", "max_attempts", "claimed_by",
+    )
+    for pk, status, attempts, max_attempts, claimed_by in candidates[:CLAIM_CANDIDATES]:
+        if status == Job.RUNNING and claimant_alive(claimed_by):
+            # Slow, not dead: failing or rerunning the job would race the running attempt.
+            continue
+        # ``attempts`` only grows, so it versions the row: the update fails if another worker got here first.
+        mine = Job.objects.filter(pk=pk, status=status, attempts=attempts)
+        if status == Job.RUNNING and attempts >= max_attempts:
+            mine.update(status=Job.FAILED, finished_at=now, lease_expires=None, error="The worker stopped responding")
+            continue
+        if mine.update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            claimed_by=worker,
+            lease_expires=lease_end(),
+            started_at=now,
+        ):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+@dataclass
+class JobContext:
+    job: Job
+    _reported_at: float = field(default=0.0)
+
+    def progress(self, done: int, total: Optional[int] = None, force: bool = False):
+        """
+        Report ``done`` of ``total`` units.
+        """
+        if not force and monotonic() - self._reported_at < PROGRESS_INTERVAL:
+            return
+        self._reported_at = monotonic()
+        self.job.progress_done, self.job.progress_total = done, total
+        # Only while the job is still ours: a lost lease must not be renewed.
+        Job.objects.filter(pk=self.job.pk, attempts=self.job.attempts, status=Job.RUNNING).update(
+            progress_done=done, progress_total=total, lease_expires=lease_end(),
+        )
+
+    def result_path(self, suffix: str) -> Path:
+        self.job.result_file = f"results/{self.job.pk}-{self.job.attempts}{suffix}"
+        return job_path(self.job.result_file)
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Renew the lease of ``job`` every third of ``LEASE_SECONDS`` until stopped.
+
+    Tasks that block for long without reporting progress keep their lease;
+    the lease only runs out once the worker process is gone.
+    """
+
+    def __init__(self, job: Job):
+        super().__init__(name=f"job-{job.pk}-lease", daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def renew(self) -> bool:
+        return bool(Job.objects.filter(pk=self.job.pk, attempts=self.job.attempts, status=Job.RUNNING).update(
+            lease_expires=lease_end(),
+        ))
+
+    def run(self):
+        interval = settings.SHOP_JOBS["LEASE_SECONDS"] / 3
+        try:
+            while not self.stopped.wait(interval):
+                try:
+                    if not self.renew():
+                        log.warning("Job %s lost its lease", self.job)
+                        return
+                except DatabaseError:
+                    log.exception("Could not renew the lease of job %s", self.job)
+        finally:
+            # The thread's own connection.
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=settings.SHOP_JOBS["RETRY_DELAY"] * 2 ** (attempts - 1))
+
+
+def run(job: Job):
+    """
+    Run a claimed job and record its outcome.
+    """
+    context = JobContext(job)
+    mine = Job.objects.filter(pk=job.pk, attempts=job.attempts, status=Job.RUNNING)
+    heartbeat = LeaseHeartbeat(job)
+    heartbeat.start()
+    try:
+        try:
+            result = TASKS[job.kind].function(job, context)
+        finally:
+            heartbeat.stop()
+    except Exception:
+        error = traceback.format_exc()
+        if job.result_file:
+            # The next attempt writes its own file.
+            (root() / job.result_file).unlink(missing_ok=True)
+        log.warning("Job %s failed on attempt %s of %s:\n%s", job, job.attempts, job.max_attempts, error)
+        if job.attempts < job.max_attempts:
+            mine.update(
+                status=Job.QUEUED, run_after=timezone.now() + retry_delay(job.attempts),
+                lease_expires=None, error=error,
+            )
+        else:
+            mine.update(status=Job.FAILED, finished_at=timezone.now(), lease_expires=None, error=error)
+        return
+    mine.update(
+        status=Job.DONE,
+        result=result,
+        result_file=job.result_file,
+        progress_done=job.progress_done,
+        progress_total=job.progress_total,
+        finished_at=timezone.now(),
+        lease_expires=None,
+        error="",
+    )
+
+
+def work(worker: str, stop: Callable[[], bool] = lambda: False) -> int:
+    """
+    Claim and run jobs until none is due or ``stop()``; returns how many ran.
+    """
+    count = 0
+    while not stop() and (job := claim(worker)) is not None:
+        run(job)
+        count += 1
+    return count
+
+
+def purge_jobs(ttl: Optional[int] = None) -> int:
+    """
+    Delete the jobs finished more than ``ttl`` seconds ago, ``RESULT_TTL`` by default, with their files.
+    """
+    ttl = settings.SHOP_JOBS["RESULT_TTL"] if ttl is None else ttl
+    stale = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED), finished_at__lt=timezone.now() - timedelta(seconds=ttl),
+    )
+    count = 0
+    for job in stale.iterator():
+        # A failed import leaves its input behind.
+        for name in (job.result_file, job.params.get("input")):
+            if name:
+                (root() / name).unlink(missing_ok=True)
+        job.delete()
+        count += 1
+    return count
+
+
+# Tasks.
+
+@task("export_orders")
+def export_orders(job: Job, context: JobContext) -> dict:
+    """
+    Write all orders, or those of ``params["user_id"]``, as JSON or NDJSON.
+    """
+    stream_format = job.params.get("format", "json")
+    encode = {"json": iter_json, "ndjson": iter_ndjson}[stream_format]
+    orders = Order.objects.all()
+    if job.params.get("user_id"):
+        orders = orders.filter(user_id=job.params["user_id"])
+    total = orders.count()
+    exported = 0
+
+    def batches():
+        nonlocal exported
+        for batch in iter_order_batches(orders):
+            yield batch
+            exported += len(batch)
+            context.progress(exported, total)
+
+    path = context.result_path(f".{stream_format}")
+    with path.open("w", encoding="utf-8") as file:
+        for chunk in encode(batches()):
+            file.write(chunk)
+    context.progress(exported, total, force=True)
+    return {"orders": exported, "format": stream_format}
+
+
+# A retry would import the rows committed by the failed attempt a second time.
+@task("import_orders_csv", max_attempts=1)
+def import_orders_csv(job: Job, context: JobContext) -> dict:
+    """
+    Import the CSV saved at ``params["input"]`` for ``params["user_id"]``.
+    """
+    path = root() / job.params["input"]
+    total = path.stat().st_size
+    importer = OrderCSVImporter(user=User.objects.get(pk=job.params["user_id"]))
+    with path.open("rb") as raw:
+        lines = TextIOWrapper(raw, encoding=job.params.get("encoding", "utf-8"), newline="")
+        report = importer.run(lines, progress=lambda report: context.progress(raw.tell(), total))
+    context.progress(total, total, force=True)
+    path.unlink(missing_ok=True)
+    return {
+        "summary": report.summary(),
+        "rows": report.rows,
+        "imported": report.imported,
+        "errors": report.errors[:100],
+        "errors_total": len(report.errors),
+    }
+
+
+@task("backfill_sales_rollups")
+def backfill_sales_rollups(job: Job, context: JobContext) -> dict:
+    """
+    Rebuild the sales rollups, from ``params["since"]`` (``YYYY-MM-DD``) if given.
+    """
+    since = job.params.get("since")
+    months = order_months(date.fromisoformat(since) if since else None)
+    for index, month in enumerate(months):
+        rebuild_month(month)
+        context.progress(index + 1, len(months))
+    context.progress(len(months), len(months), force=True)
+    return {"months": [month.isoformat() for month in months]}
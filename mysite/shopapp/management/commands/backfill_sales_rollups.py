@@ -0,0 +1,36 @@
+from datetime import datetime
+from time import perf_counter
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.rollups import order_months, rebuild_month
+
+
+class Command(BaseCommand):
+    """
+    Recompute the sales rollups from the orders, one month per transaction.
+
+    Signals keep the rollups in step with ORM writes; run it once after
+    deploying the rollup tables, or after bulk or raw SQL changes to orders.
+    ``--since`` limits the rebuild to the recent months.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", default=None, help="First month to rebuild, YYYY-MM")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = datetime.strptime(options["since"], "%Y-%m").date()
+            except ValueError:
+                raise CommandError(f"--since must look like 2024-01, not {options['since']!r}")
+        months = order_months(since)
+        started = perf_counter()
+        for month in months:
+            month_started = perf_counter()
+            rebuild_month(month)
+            self.stdout.write(f"{month:%Y-%m}: rebuilt in {perf_counter() - month_started:.2f} s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(months)} months in {perf_counter() - started:.1f} s"
+        ))
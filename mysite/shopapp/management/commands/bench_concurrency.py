@@ -0,0 +1,159 @@
+import asyncio
+from statistics import median
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management import BaseCommand, CommandError
+
+
+def parse_url(url: str) -> tuple[str, int, str]:
+    parts = urlsplit(url)
+    if parts.scheme != "http" or not parts.hostname:
+        raise CommandError(f"Expected an http:// URL, got {url!r}")
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return parts.hostname, parts.port or 80, path
+
+
+class Command(BaseCommand):
+    """
+    Measure how many slow clients a running deployment can hold while staying responsive.
+
+    ``--connections`` clients hit ``--url`` and then crawl: in ``upload`` mode they
+    send the request body a few bytes at a time, in ``download`` mode they read the
+    response a few bytes at a time. Meanwhile ``--probe-url`` is requested once per
+    ``--probe-interval`` and its latency is reported. Run it once against the WSGI
+    deployment and once against the ASGI one to compare them, e.g.::
+
+        gunicorn mysite.wsgi:application -w 4 --bind 127.0.0.1:8001
+        gunicorn mysite.asgi:application -w 4 -k uvicorn.workers.UvicornWorker --bind 127.0.0.1:8002
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000/en/shop/upload/")
+        parser.add_argument("--probe-url", default="http://127.0.0.1:8000/en/shop/products/latest/feed/")
+        parser.add_argument("--mode", choices=["upload", "download"], default="upload")
+        parser.add_argument("--connections", type=int, default=200)
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds to hold the slow clients")
+        parser.add_argument("--probe-interval", type=float, default=0.1)
+        parser.add_argument("--probe-timeout", type=float, default=5.0)
+        parser.add_argument("--cookie", default="", help="Cookie header sent with every request")
+
+    def request_head(self, method: str, host: str, port: int, path: str, extra: str = "") -> bytes:
+        cookie = f"Cookie: {self.cookie}\r\n" if self.cookie else ""
+        return (
+            f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n{cookie}{extra}\r\n"
+        ).encode("latin-1")
+
+    async def fetch_csrf_token(self, url: str) -> str:
+        """
+        GET ``url`` once and return the CSRF cookie it sets, so slow uploads pass the check.
+        """
+        host, port, path = parse_url(url)
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(self.request_head("GET", host, port, path, "Connection: close\r\n"))
+        await writer.drain()
+        head, _, _ = (await reader.read()).partition(b"\r\n\r\n")
+        writer.close()
+        for line in head.decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.lower() == "set-cookie" and value.strip().startswith("csrftoken="):
+                return value.strip().split(";")[0].split("=", 1)[1]
+        return ""
+
+    async def slow_client(self, url: str, mode: str, deadline: float):
+        host, port, path = parse_url(url)
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.refused += 1
+            return
+        self.opened += 1
+        try:
+            if mode == "upload":
+                size = 1024 * 1024
+                writer.write(self.request_head(
+                    "POST", host, port, path,
+                    f"Content-Type: multipart/form-data; boundary=bench\r\n"
+                    f"Content-Length: {size}\r\nX-CSRFToken: {self.csrf_token}\r\n",
+                ))
+                writer.write(
+                    b'--bench\r\nContent-Disposition: form-data; name="myfile"; filename="bench.bin"\r\n\r\n'
+                )
+                while perf_counter() < deadline and not reader.at_eof():
+                    writer.write(b"x")
+                    await writer.drain()
+                    await asyncio.sleep(1)
+            else:
+                writer.write(self.request_head("GET", host, port, path, "Connection: close\r\n"))
+                await writer.drain()
+                while perf_counter() < deadline:
+                    if not await reader.read(16):
+                        break
+                    await asyncio.sleep(1)
+        except OSError:
+            self.dropped += 1
+        finally:
+            writer.close()
+
+    async def probe(self, url: str, timeout: float) -> float | None:
+        host, port, path = parse_url(url)
+
+        async def fetch() -> bytes:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                writer.write(self.request_head("GET", host, port, path, "Connection: close\r\n"))
+                await writer.drain()
+                status = await reader.readline()
+                await reader.read()
+                return status
+            finally:
+                writer.close()
+
+        started = perf_counter()
+        try:
+            # Not asyncio.timeout(): that needs Python 3.11.
+            status = await asyncio.wait_for(fetch(), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        if b" 200 " not in status:
+            return None
+        return perf_counter() - started
+
+    async def run(self, options) -> list[float | None]:
+        if options["mode"] == "upload":
+            self.csrf_token = await self.fetch_csrf_token(options["url"])
+            if self.csrf_token:
+                self.cookie = "; ".join(filter(None, [self.cookie, f"csrftoken={self.csrf_token}"]))
+        deadline = perf_counter() + options["duration"]
+        clients = [
+            asyncio.create_task(self.slow_client(options["url"], options["mode"], deadline))
+            for _ in range(options["connections"])
+        ]
+        # Let the slow clients take their connections before probing.
+        await asyncio.sleep(1)
+        probes = []
+        while perf_counter() < deadline:
+            probes.append(asyncio.create_task(self.probe(options["probe_url"], options["probe_timeout"])))
+            await asyncio.sleep(options["probe_interval"])
+        await asyncio.gather(*clients)
+        return await asyncio.gather(*probes)
+
+    def handle(self, *args, **options):
+        self.cookie = options["cookie"]
+        self.csrf_token = ""
+        self.opened = self.refused = self.dropped = 0
+        results = asyncio.run(self.run(options))
+        answered = sorted(latency * 1000 for latency in results if latency is not None)
+        self.stdout.write(
+            f"Slow clients: {self.opened} connected, {self.refused} refused, {self.dropped} dropped"
+        )
+        if not answered:
+            self.stdout.write(self.style.ERROR(f"Probes: 0 of {len(results)} answered"))
+            return
+        p95 = answered[min(len(answered) - 1, int(len(answered) * 0.95))]
+        self.stdout.write(
+            f"Probes: {len(answered)} of {len(results)} answered, "
+            f"median {median(answered):.1f} ms, p95 {p95:.1f} ms, max {answered[-1]:.1f} ms"
+        )
@@ -0,0 +1,175 @@
+import logging
+import os
+from contextlib import contextmanager
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates
+from django.test import Client, RequestFactory, override_settings
+from django.urls import resolve, reverse
+from django.utils import translation
+
+from shopapp.instrumentation import (
+    InstrumentedDjangoTemplates,
+    InstrumentedLocMemCache,
+    RequestMetrics,
+    current_metrics,
+    install_query_timer,
+    time_query,
+)
+from shopapp.middlewares import PerformanceMiddleware
+
+STOCK_BACKENDS = {
+    "shopapp.instrumentation.InstrumentedDjangoTemplates": "django.template.backends.django.DjangoTemplates",
+    "shopapp.instrumentation.InstrumentedFileBasedCache": "django.core.cache.backends.filebased.FileBasedCache",
+    "shopapp.instrumentation.InstrumentedLocMemCache": "django.core.cache.backends.locmem.LocMemCache",
+}
+
+
+def stock(config: dict) -> dict:
+    return {**config, "BACKEND": STOCK_BACKENDS.get(config["BACKEND"], config["BACKEND"])}
+
+
+class Command(BaseCommand):
+    """
+    Measure the cost of PerformanceMiddleware and the instrumented backends.
+
+    First every instrumented piece is timed against its stock counterpart in a
+    tight loop. Then whole requests go through the full handler with the test client against the
+    configured database; the two setups take turns so that both see the same
+    caches and the same machine load. The log line is switched on, formatted
+    and written to /dev/null, as it would be to a log file.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000, help="Iterations per component loop")
+        parser.add_argument("--requests", type=int, default=2000, help="Requests per setup and path")
+        parser.add_argument("--rounds", type=int, default=10)
+        parser.add_argument("--path", action="append", help="Paths to request, defaults to a page and an API list")
+
+    def timed(self, function, iterations: int) -> float:
+        started = perf_counter()
+        for _ in range(iterations):
+            function()
+        return (perf_counter() - started) / iterations
+
+    def compare(self, label: str, plain, instrumented, iterations: int):
+        timings = {"plain": [], "instrumented": []}
+        for _ in range(5):
+            timings["plain"].append(self.timed(plain, iterations))
+            timings["instrumented"].append(self.timed(instrumented, iterations))
+        overhead = (median(timings["instrumented"]) - median(timings["plain"])) * 1e6
+        self.stdout.write(f"{label}: {overhead:.2f} us")
+
+    def measure_components(self, iterations: int):
+        with translation.override("en"):
+            path = reverse("shopapp:products_list")
+            request = RequestFactory().get(path)
+            request.resolver_match = resolve(path)
+
+        def view(request):
+            return HttpResponse()
+
+        def handler(request):
+            # What the handler does below the middleware: process_view, then the view.
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = PerformanceMiddleware(handler)
+        self.compare("Middleware per request", lambda: handler(request), lambda: middleware(request), iterations)
+
+        token = current_metrics.set(RequestMetrics())
+        try:
+            with connection.cursor() as cursor:
+                timings = {"plain": [], "instrumented": []}
+                for _ in range(5):
+                    connection.execute_wrappers.remove(time_query)
+                    timings["plain"].append(self.timed(lambda: cursor.execute("SELECT 1"), iterations))
+                    install_query_timer(connection)
+                    timings["instrumented"].append(self.timed(lambda: cursor.execute("SELECT 1"), iterations))
+                overhead = (median(timings["instrumented"]) - median(timings["plain"])) * 1e6
+                self.stdout.write(f"Query wrapper per query: {overhead:.2f} us")
+
+            plain_cache = LocMemCache("bench-plain", {})
+            instrumented_cache = InstrumentedLocMemCache("bench-instrumented", {})
+            plain_cache.set("key", "value")
+            instrumented_cache.set("key", "value")
+            self.compare("Cache get", lambda: plain_cache.get("key"), lambda: instrumented_cache.get("key"),
+                         iterations)
+
+            options = {"NAME": "bench", "DIRS": [], "APP_DIRS": False, "OPTIONS": {}}
+            source = "{% for item in items %}<li>{{ item }}</li>{% endfor %}"
+            plain_template = DjangoTemplates(options).from_string(source)
+            instrumented_template = InstrumentedDjangoTemplates(options).from_string(source)
+            context = {"items": range(10)}
+            self.compare("Template render", lambda: plain_template.render(context),
+                         lambda: instrumented_template.render(context), iterations)
+        finally:
+            current_metrics.reset(token)
+
+    @contextmanager
+    def uninstrumented(self):
+        middleware = [name for name in settings.MIDDLEWARE if name != "shopapp.middlewares.PerformanceMiddleware"]
+        with override_settings(
+            MIDDLEWARE=middleware,
+            TEMPLATES=[stock(config) for config in settings.TEMPLATES],
+            CACHES={alias: stock(config) for alias, config in settings.CACHES.items()},
+        ):
+            connection.ensure_connection()
+            connection.execute_wrappers.remove(time_query)
+            try:
+                yield
+            finally:
+                install_query_timer(connection)
+
+    def measure(self, client: Client, path: str, count: int) -> float:
+        started = perf_counter()
+        for _ in range(count):
+            response = client.get(path)
+        assert response.status_code == 200, f"{path} answered {response.status_code}"
+        return (perf_counter() - started) / count
+
+    def handle(self, *args, **options):
+        with translation.override("en"):
+            paths = options["path"] or [reverse("shopapp:products_list"), reverse("shopapp:product-list")]
+        performance_log = logging.getLogger("shopapp.performance")
+        devnull = open(os.devnull, "w")
+        performance_log.handlers, performance_log.propagate = [logging.StreamHandler(devnull)], False
+        measured = override_settings(
+            SHOP_INSTRUMENTATION={**settings.SHOP_INSTRUMENTATION, "LOG": True},
+            # Every request of the test client comes from 127.0.0.1; throttling is not measured here.
+            SHOP_THROTTLING={**settings.SHOP_THROTTLING, "EXEMPT_IPS": ["127.0.0.1"]},
+        )
+        measured.enable()
+        per_round = max(1, options["requests"] // options["rounds"])
+        try:
+            self.measure_components(options["iterations"])
+            for path in paths:
+                timings = {"instrumented": [], "plain": []}
+                instrumented = Client(HTTP_HOST="127.0.0.1")
+                with self.uninstrumented():
+                    plain = Client(HTTP_HOST="127.0.0.1")
+                # Warm up both setups: connections, template loaders, caches.
+                self.measure(instrumented, path, 20)
+                with self.uninstrumented():
+                    self.measure(plain, path, 20)
+                for _ in range(options["rounds"]):
+                    timings["instrumented"].append(self.measure(instrumented, path, per_round))
+                    with self.uninstrumented():
+                        timings["plain"].append(self.measure(plain, path, per_round))
+                plain_us = median(timings["plain"]) * 1e6
+                instrumented_us = median(timings["instrumented"]) * 1e6
+                self.stdout.write(
+                    f"{path}: {plain_us:.0f} us plain, {instrumented_us:.0f} us instrumented, "
+                    f"overhead {instrumented_us - plain_us:.0f} us ({(instrumented_us / plain_us - 1) * 100:.1f}%)"
+                )
+        finally:
+            measured.disable()
+            performance_log.handlers, performance_log.propagate = [], True
+            devnull.close()
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
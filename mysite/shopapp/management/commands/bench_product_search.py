@@ -0,0 +1,106 @@
+import random
+from functools import reduce
+from itertools import accumulate
+from operator import and_
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from shopapp.models import Product
+from shopapp.search import fts_available, search_products
+
+CATEGORIES = (
+    "notebook laptop desktop phone smartphone tablet monitor keyboard mouse camera "
+    "printer router speaker headphones charger cable adapter battery watch console"
+).split()
+SYLLABLES = "ka ro mi tex lu van zor pi qua del fin gro ny sol tra ve"
+SYLLABLES = SYLLABLES.split()
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list[str]:
+    """
+    Brand and model like words; drawn with a Zipf-like skew, as in real catalogues.
+    """
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    """
+    Compare full-text product search with the LIKE based search on a synthetic catalogue.
+
+    The catalogue is created inside a transaction that is rolled back at the end,
+    so the database is left as it was.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=30)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--vocabulary", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def fill_catalogue(self, count: int, batch_size: int, vocabulary: list[str], rng: random.Random):
+        user = User.objects.create(username="bench-product-search")
+        cum_weights = list(accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+        def words(k: int) -> str:
+            return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=k))
+
+        started = perf_counter()
+        for offset in range(0, count, batch_size):
+            Product.objects.bulk_create(
+                [
+                    Product(
+                        name=f"{words(1)} {rng.choice(CATEGORIES)} {words(1)}",
+                        description=f"{words(rng.randint(5, 30))} {rng.choice(CATEGORIES)}",
+                        price=rng.randint(1, 500000) / 100,
+                        created_by=user,
+                    )
+                    for _ in range(min(batch_size, count - offset))
+                ],
+                batch_size=batch_size,
+            )
+        self.stdout.write(f"Created {count} products in {perf_counter() - started:.1f} s")
+
+    @staticmethod
+    def like_search(terms: list[str]):
+        conditions = [Q(name__icontains=term) | Q(description__icontains=term) for term in terms]
+        return Product.objects.filter(reduce(and_, conditions))
+
+    def measure(self, label: str, build, queries: list[list[str]]):
+        timings, matches = [], 0
+        for terms in queries:
+            started = perf_counter()
+            queryset = build(terms)
+            matches += queryset.count()
+            list(queryset[:10])
+            timings.append((perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"{label}: median {median(timings):.1f} ms, p95 {p95:.1f} ms, "
+            f"{matches / len(queries):.0f} matches per query"
+        )
+
+    def handle(self, *args, **options):
+        if not fts_available(Product.objects.db):
+            raise CommandError("The full-text index is not available, run migrations on SQLite first")
+        rng = random.Random(options["seed"])
+        vocabulary = make_vocabulary(options["vocabulary"], rng)
+        queries = [
+            rng.sample(vocabulary, 1) if rng.random() < 0.7 else [rng.choice(vocabulary), rng.choice(CATEGORIES)]
+            for _ in range(options["queries"])
+        ]
+        with transaction.atomic():
+            self.fill_catalogue(options["products"], options["batch_size"], vocabulary, rng)
+            self.measure("LIKE (icontains)", self.like_search, queries)
+            self.measure("FTS5 (bm25 ranked)", lambda terms: search_products(Product.objects.all(), terms), queries)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("Benchmark finished, catalogue rolled back"))
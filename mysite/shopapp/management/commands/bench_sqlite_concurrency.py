@@ -0,0 +1,141 @@
+import multiprocessing
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+
+from shopapp.models import Order, Product
+
+# Django's own defaults: rollback journal, full fsync on every commit and the
+# 5 second lock timeout of the sqlite3 module.
+BASELINE_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 5000}
+
+
+def percentile(values: list[float], share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def read(rng: random.Random, user_ids: list[int], product_ids: list[int]):
+    if rng.random() < 0.5:
+        list(Product.objects.filter(archived=False).order_by("-created_at")[:20])
+    else:
+        orders = Order.objects.filter(user_id=rng.choice(user_ids)).order_by("-created_at")
+        list(orders.prefetch_related("products")[:20])
+
+
+def write(rng: random.Random, user_ids: list[int], product_ids: list[int]):
+    if rng.random() < 0.5:
+        with transaction.atomic():
+            order = Order.objects.create(user_id=rng.choice(user_ids), delivery_address="Benchmark st., 1")
+            order.products.add(*rng.sample(product_ids, min(3, len(product_ids))))
+    else:
+        Product.objects.filter(pk=rng.choice(product_ids)).update(price=F("price") + 1)
+
+
+def run_client(task: dict) -> tuple[str, list[float], int]:
+    """
+    Repeat reads or writes until the deadline; runs in a forked worker process.
+    """
+    settings.SHOP_SQLITE_PRAGMAS = task["pragmas"]
+    connection.settings_dict["NAME"] = task["database"]
+    rng = random.Random(task["seed"])
+    operation = read if task["role"] == "reader" else write
+    latencies, errors = [], 0
+    while time.time() < task["start"]:
+        time.sleep(0.001)
+    while time.time() < task["deadline"]:
+        started = time.perf_counter()
+        try:
+            operation(rng, task["user_ids"], task["product_ids"])
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    return task["role"], latencies, errors
+
+
+class Command(BaseCommand):
+    """
+    Compare concurrent readers and writers on Order and Product with Django's and the tuned SQLite setup.
+
+    Every setup runs on its own copy of the configured database, so the data
+    is the same and the original file is not touched. Readers list live
+    products or a user's orders with their products; writers create orders
+    with products or bump product prices. Fill the database first, e.g. with
+    ``generate_shop_data``.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def copy_database(self, directory: Path, name: str, journal_mode: str) -> str:
+        target = str(directory / f"{name}.sqlite3")
+        source = sqlite3.connect(connection.settings_dict["NAME"])
+        copy = sqlite3.connect(target)
+        source.backup(copy)
+        copy.execute(f"PRAGMA journal_mode = {journal_mode}")
+        copy.close()
+        source.close()
+        return target
+
+    def run_setup(self, name: str, pragmas: dict, directory: Path, options: dict, user_ids, product_ids):
+        database = self.copy_database(directory, name, pragmas.get("journal_mode", "DELETE"))
+        start = time.time() + 1
+        roles = ["reader"] * options["readers"] + ["writer"] * options["writers"]
+        tasks = [
+            {
+                "role": role,
+                "pragmas": pragmas,
+                "database": database,
+                "seed": options["seed"] * 1000 + index,
+                "start": start,
+                "deadline": start + options["duration"],
+                "user_ids": user_ids,
+                "product_ids": product_ids,
+            }
+            for index, role in enumerate(roles)
+        ]
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        with multiprocessing.get_context("fork").Pool(len(tasks)) as pool:
+            results = pool.map(run_client, tasks)
+        for role in ("reader", "writer"):
+            latencies = sorted(latency * 1000 for result_role, values, _ in results if result_role == role
+                               for latency in values)
+            errors = sum(errors for result_role, _, errors in results if result_role == role)
+            self.stdout.write(
+                f"{name} {role}s: {len(latencies) / options['duration']:.0f} ops/s, "
+                f"median {median(latencies) if latencies else 0:.2f} ms, "
+                f"p99 {percentile(latencies, 0.99):.2f} ms, {errors} locked errors"
+            )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark compares SQLite setups")
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("The benchmark needs the fork start method")
+        rng = random.Random(options["seed"])
+        user_ids = list(Order.objects.values_list("user_id", flat=True).distinct()[:1000])
+        product_ids = list(Product.objects.values_list("pk", flat=True)[:1000])
+        if not user_ids or not product_ids:
+            raise CommandError("Fill the database first, e.g. with generate_shop_data")
+        rng.shuffle(user_ids)
+        directory = Path(tempfile.mkdtemp(prefix="bench-sqlite-"))
+        try:
+            self.run_setup("default", BASELINE_PRAGMAS, directory, options, user_ids, product_ids)
+            self.run_setup("tuned", settings.SHOP_SQLITE_PRAGMAS, directory, options, user_ids, product_ids)
+        finally:
+            shutil.rmtree(directory)
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
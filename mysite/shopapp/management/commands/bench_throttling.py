@@ -0,0 +1,56 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+from django.utils import translation
+
+from shopapp.middlewares import ThrottlingMiddleware
+from shopapp.throttling import Rate, TokenBucket, get_store
+
+
+class Command(BaseCommand):
+    """
+    Measure per-request overhead of the throttling middleware
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+        parser.add_argument("--clients", type=int, default=1000)
+        parser.add_argument("--backend", choices=["shared_memory", "cache"], default="shared_memory")
+        parser.add_argument("--cache", default="default", help="Cache alias holding the buckets")
+
+    def report(self, label: str, elapsed: float, iterations: int):
+        self.stdout.write(f"{label}: {elapsed / iterations * 1e6:.1f} us per request")
+
+    def handle(self, *args, **options):
+        iterations, clients = options["iterations"], options["clients"]
+        config = {**settings.SHOP_THROTTLING, "BACKEND": options["backend"], "CACHE_ALIAS": options["cache"]}
+        bucket = TokenBucket("bench", Rate(rate=1e6, burst=10 ** 9), get_store(config))
+        started = perf_counter()
+        for i in range(iterations):
+            bucket.consume(f"ip:10.0.{i % clients // 256}.{i % 256}")
+        self.report("TokenBucket.consume", perf_counter() - started, iterations)
+
+        with override_settings(SHOP_THROTTLING=config):
+            middleware = ThrottlingMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        with translation.override("en"):
+            path = reverse("shopapp:products_list")
+            match = resolve(path)
+        requests = []
+        for i in range(clients):
+            request = factory.get(path, REMOTE_ADDR=f"10.1.{i // 256}.{i % 256}")
+            request.user = AnonymousUser()
+            request.resolver_match = match
+            requests.append(request)
+        started = perf_counter()
+        for i in range(iterations):
+            request = requests[i % clients]
+            middleware(request)
+            middleware.process_view(request, match.func, match.args, match.kwargs)
+        self.report("ThrottlingMiddleware", perf_counter() - started, iterations)
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
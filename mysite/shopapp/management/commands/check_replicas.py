@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+
+from shopapp.models import ReplicationHeartbeat
+from shopapp.replicas import HEARTBEAT_ID, replica_lag
+
+
+class Command(BaseCommand):
+    """
+    Write the replication heartbeat on the primary and report the lag of every replica.
+
+    Run it with ``--interval`` next to the site to keep the heartbeat fresh; the
+    router then measures replica lag against it. Exits with an error when a
+    replica is unavailable or lags more than ``SHOP_REPLICAS["MAX_LAG_SECONDS"]``.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds; 0 runs once")
+        parser.add_argument("--no-beat", action="store_true", help="Only report, do not write the heartbeat")
+
+    def check_replicas(self, beat: bool) -> bool:
+        if beat:
+            ReplicationHeartbeat.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+                pk=HEARTBEAT_ID, defaults={"beat_at": timezone.now()},
+            )
+        config = settings.SHOP_REPLICAS
+        healthy = True
+        for alias in config["ALIASES"]:
+            try:
+                lag = replica_lag(alias)
+            except DatabaseError as error:
+                self.stdout.write(self.style.ERROR(f"{alias}: unavailable ({error})"))
+                healthy = False
+                continue
+            if lag > config["MAX_LAG_SECONDS"]:
+                self.stdout.write(self.style.WARNING(f"{alias}: lag {lag:.1f} s, over the limit"))
+                healthy = False
+            else:
+                self.stdout.write(f"{alias}: lag {lag:.1f} s")
+        return healthy
+
+    def handle(self, *args, **options):
+        if not settings.SHOP_REPLICAS["ALIASES"]:
+            self.stdout.write("No replicas configured, set DJANGO_DB_REPLICAS")
+        if not options["interval"]:
+            if not self.check_replicas(beat=not options["no_beat"]):
+                raise CommandError("Some replicas are unavailable or lagging")
+            return
+        while True:
+            self.check_replicas(beat=not options["no_beat"])
+            time.sleep(options["interval"])
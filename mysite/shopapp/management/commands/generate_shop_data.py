@@ -0,0 +1,262 @@
+import multiprocessing
+import random
+from datetime import timedelta
+from itertools import accumulate
+from math import log, sqrt
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, router, transaction
+from django.db.models import Max
+from django.db.models.sql import InsertQuery
+from django.utils import timezone
+
+from myauth.models import Profile
+from shopapp.models import Order, Product
+from shopapp.rollups import order_months, rebuild_month
+from shopapp.signals import bump_catalogue
+from shopapp.totals import reconcile_totals
+
+WORDS = (
+    "smart ultra compact pro mini max lite classic wireless portable digital "
+    "silent rapid solid fresh bright dual eco prime steel carbon"
+).split()
+CATEGORIES = (
+    "notebook laptop desktop phone smartphone tablet monitor keyboard mouse camera "
+    "printer router speaker headphones charger cable adapter battery watch console"
+).split()
+STREETS = "Lenina Mira Sadovaya Lesnaya Shkolnaya Sovetskaya Molodezhnaya Tsentralnaya Novaya Chaikinoi".split()
+PROMOCODES = ("sale10", "sale20", "welcome", "blackfriday", "vip")
+PROMOCODE_WEIGHTS = (40, 25, 20, 10, 5)
+
+
+def insert_as_generated(model, objs: list, batch_size: int):
+    """
+    Insert ``objs`` with the values they carry, like ``loaddata`` does.
+
+    A raw insert skips ``pre_save()``, so ``auto_now_add`` and ``auto_now``
+    fields keep the generated dates; unlike ``bulk_create`` it never stamps
+    now(). Like ``bulk_create`` it sends no signals.
+    """
+    using = router.db_for_write(model)
+    fields = model._meta.concrete_fields
+    batch_size = min(batch_size, connections[using].ops.bulk_batch_size(fields, objs))
+    for start in range(0, len(objs), batch_size):
+        query = InsertQuery(model)
+        query.insert_values(fields, objs[start:start + batch_size], raw=True)
+        query.get_compiler(using=using).execute_sql()
+
+
+def zipf_cum_weights(size: int, exponent: float) -> list[float]:
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def recent_datetime(rng: random.Random, now, days: int):
+    # sqrt skews towards the present: the shop grows, so later days have more rows.
+    return now - timedelta(seconds=days * 86400 * (1 - sqrt(rng.random())))
+
+
+def start_worker():
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            # Workers queue up on the database write lock instead of failing.
+            cursor.execute("PRAGMA busy_timeout = 600000")
+
+
+def generate_orders(task: dict) -> tuple[int, int]:
+    """
+    Create orders with primary keys ``task["first_pk"]`` to ``task["last_pk"]`` and their links.
+
+    Runs in the worker processes, so it only relies on what ``task`` carries.
+    """
+    rng = random.Random(task["seed"])
+    now = timezone.now()
+    user_ids, product_ids = task["user_ids"], task["product_ids"]
+    user_weights = zipf_cum_weights(len(user_ids), task["user_skew"])
+    product_weights = zipf_cum_weights(len(product_ids), task["product_skew"])
+    through = Order.products.through
+    orders = links = 0
+    for first in range(task["first_pk"], task["last_pk"] + 1, task["batch_size"]):
+        last = min(first + task["batch_size"], task["last_pk"] + 1)
+        batch_users = rng.choices(user_ids, cum_weights=user_weights, k=last - first)
+        batch_orders, batch_links = [], []
+        for pk, user_id in zip(range(first, last), batch_users):
+            batch_orders.append(Order(
+                pk=pk,
+                user_id=user_id,
+                delivery_address=f"{rng.choice(STREETS)} st., {rng.randint(1, 150)}",
+                promocode=rng.choices(PROMOCODES, PROMOCODE_WEIGHTS)[0] if rng.random() < 0.2 else "",
+                created_at=recent_datetime(rng, now, task["days"]),
+            ))
+            size = max(1, round(rng.lognormvariate(task["links_mu"], task["links_sigma"])))
+            chosen = rng.choices(product_ids, cum_weights=product_weights, k=size)
+            batch_links.extend(
+                through(order_id=pk, product_id=product_id) for product_id in dict.fromkeys(chosen)
+            )
+        with transaction.atomic():
+            insert_as_generated(Order, batch_orders, task["batch_size"])
+            through.objects.bulk_create(batch_links)
+        orders += len(batch_orders)
+        links += len(batch_links)
+    return orders, links
+
+
+class Command(BaseCommand):
+    """
+    Generate a production-sized shop: users with profiles, products, orders and their products.
+
+    Rows are written with ``bulk_create`` in batches. Who orders and what is
+    ordered follow Zipf-like distributions, basket sizes and prices are
+    lognormal and dates lean towards the present. Orders get primary keys from
+    a reserved range, so ``--workers`` processes can each write their own slice.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--products-per-order", type=float, default=3.0,
+                            help="Mean basket size; sizes are lognormal around it")
+        parser.add_argument("--user-skew", type=float, default=1.0, help="Zipf exponent of orders per user")
+        parser.add_argument("--product-skew", type=float, default=1.1, help="Zipf exponent of product popularity")
+        parser.add_argument("--days", type=int, default=730, help="Spread dates over this many days")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes writing orders; SQLite serialises writers, so this pays off elsewhere")
+        parser.add_argument("--password", default="password", help="Password of every generated user")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def timed(self, label: str, started: float, count: int):
+        elapsed = perf_counter() - started
+        self.stdout.write(f"{label}: {count} in {elapsed:.1f} s ({count / elapsed if elapsed else 0:.0f} rows/s)")
+
+    def create_users(self, count: int, options: dict, rng: random.Random) -> list[int]:
+        started = perf_counter()
+        first = (User.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        # Hashing is deliberately slow, so every user shares one hash.
+        password = make_password(options["password"])
+        now = timezone.now()
+        users = [
+            User(
+                pk=pk,
+                username=f"shopper{pk}",
+                email=f"shopper{pk}@example.com",
+                password=password,
+                date_joined=recent_datetime(rng, now, options["days"]),
+            )
+            for pk in range(first, first + count)
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=options["batch_size"])
+            Profile.objects.bulk_create(
+                (Profile(user_id=user.pk, bio=" ".join(rng.sample(WORDS, 5))) for user in users),
+                batch_size=options["batch_size"],
+            )
+        self.timed("Users with profiles", started, count)
+        return [user.pk for user in users]
+
+    def create_products(self, count: int, options: dict, rng: random.Random, owners: list[int]) -> list[int]:
+        started = perf_counter()
+        first = (Product.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        now = timezone.now()
+        products = [
+            Product(
+                pk=pk,
+                name=f"{rng.choice(WORDS).title()} {rng.choice(CATEGORIES)} {pk}",
+                description=" ".join(rng.choices(WORDS + CATEGORIES, k=rng.randint(5, 30))),
+                price=round(min(rng.lognormvariate(7, 1.2), 999_999), 2),
+                discount=rng.choice((0, 0, 0, 0, 5, 10, 15, 20, 50)),
+                archived=rng.random() < 0.05,
+                created_by_id=rng.choice(owners),
+                created_at=recent_datetime(rng, now, options["days"]),
+            )
+            for pk in range(first, first + count)
+        ]
+        for product in products:
+            product.updated_at = product.created_at
+        with transaction.atomic():
+            insert_as_generated(Product, products, options["batch_size"])
+        # The insert sends no post_save.
+        bump_catalogue()
+        self.timed("Products", started, count)
+        # Only live products can be ordered.
+        return [product.pk for product in products if not product.archived]
+
+    def create_orders(self, count: int, options: dict, rng: random.Random, user_ids: list[int], product_ids: list[int]):
+        started = perf_counter()
+        # Popularity ranks follow list positions; shuffle so they do not follow age.
+        user_ids, product_ids = rng.sample(user_ids, len(user_ids)), rng.sample(product_ids, len(product_ids))
+        first = (Order.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        workers = max(1, min(options["workers"], count // options["batch_size"] or 1))
+        mean = options["products_per_order"]
+        sigma = 0.6
+        # E[lognormal] = exp(mu + sigma^2 / 2); the rounding and the floor of 1 shift it a bit.
+        mu = max(0.0, log(mean) - sigma ** 2 / 2)
+        share = -(-count // workers)
+        tasks = [
+            {
+                "first_pk": first + index * share,
+                "last_pk": min(first + (index + 1) * share, first + count) - 1,
+                "seed": options["seed"] * 1000 + index,
+                "user_ids": user_ids,
+                "product_ids": product_ids,
+                "user_skew": options["user_skew"],
+                "product_skew": options["product_skew"],
+                "links_mu": mu,
+                "links_sigma": sigma,
+                "days": options["days"],
+                "batch_size": options["batch_size"],
+            }
+            for index in range(workers)
+        ]
+        if workers == 1:
+            results = [generate_orders(tasks[0])]
+        else:
+            # Children must not share the parent's database connection.
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(workers, initializer=start_worker) as pool:
+                results = pool.map(generate_orders, tasks)
+        orders = sum(result[0] for result in results)
+        links = sum(result[1] for result in results)
+        self.timed("Orders", started, orders)
+        self.stdout.write(f"Order products: {links} ({links / orders if orders else 0:.2f} per order)")
+        started = perf_counter()
+        # The links were bulk created without m2m_changed, so the totals are computed afterwards.
+        reconcile_totals(Order.objects.filter(pk__gte=first), batch_size=options["batch_size"])
+        self.timed("Order totals", started, orders)
+        started = perf_counter()
+        # The generated orders span the last ``--days``; rebuild the rollups of those months.
+        months = order_months(timezone.localdate() - timedelta(days=options["days"]))
+        for month in months:
+            rebuild_month(month)
+        self.timed("Rollup months", started, len(months))
+
+    def reset_sequences(self):
+        sql = connection.ops.sequence_reset_sql(no_style(), [User, Profile, Product, Order])
+        if sql:
+            with connection.cursor() as cursor:
+                for statement in sql:
+                    cursor.execute(statement)
+
+    def handle(self, *args, **options):
+        if options["workers"] > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("--workers needs the fork start method, run with --workers 1 here")
+        rng = random.Random(options["seed"])
+        started = perf_counter()
+        user_ids = self.create_users(options["users"], options, rng)
+        if not user_ids:
+            user_ids = list(User.objects.values_list("pk", flat=True))
+        if not user_ids:
+            raise CommandError("There are no users to own products and orders")
+        product_ids = self.create_products(options["products"], options, rng, user_ids)
+        if options["orders"]:
+            if not product_ids:
+                product_ids = list(Product.objects.filter(archived=False).values_list("pk", flat=True))
+            if not product_ids:
+                raise CommandError("There are no products to order")
+            self.create_orders(options["orders"], options, rng, user_ids, product_ids)
+        self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS(f"Shop data generated in {perf_counter() - started:.1f} s"))
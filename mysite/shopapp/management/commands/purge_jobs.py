@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.jobs import purge_jobs
+
+
+class Command(BaseCommand):
+    """
+    Delete finished background jobs with their result and input files.
+
+    Run it periodically; a done or failed job goes once it finished more than
+    ``--ttl`` seconds ago, ``SHOP_JOBS["RESULT_TTL"]`` by default.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=None, help="Seconds a finished job is kept")
+
+    def handle(self, *args, **options):
+        ttl = settings.SHOP_JOBS["RESULT_TTL"] if options["ttl"] is None else options["ttl"]
+        purged = purge_jobs(ttl)
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} jobs finished over {ttl} s ago"))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.uploads import purge_sessions
+
+
+class Command(BaseCommand):
+    """
+    Delete resumable uploads left unfinished, with their partial files.
+
+    Run it periodically; a session is stale once no chunk arrived for
+    ``--ttl`` seconds, ``SHOP_UPLOADS["SESSION_TTL"]`` by default.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl", type=int, default=None, help="Idle seconds before a session is stale")
+
+    def handle(self, *args, **options):
+        ttl = settings.SHOP_UPLOADS["SESSION_TTL"] if options["ttl"] is None else options["ttl"]
+        purged = purge_sessions(ttl)
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} upload sessions idle for over {ttl} s"))
@@ -0,0 +1,42 @@
+from time import perf_counter
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.models import Order
+from shopapp.totals import reconcile_totals
+
+
+class Command(BaseCommand):
+    """
+    Recompute the stored order totals from the products and report the orders that drifted.
+
+    Signals keep the totals in step with ORM writes; run it after bulk or raw
+    SQL changes to products or order links. ``--check`` only reports and exits
+    with an error when some order drifted, e.g. for a periodic job.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Report drift without fixing it")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--from-pk", type=int, default=None, help="Only orders from this id on")
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options["from_pk"] is not None:
+            queryset = queryset.filter(pk__gte=options["from_pk"])
+        started = perf_counter()
+        report = reconcile_totals(queryset, fix=not options["check"], batch_size=options["batch_size"])
+        for pk, stored, actual in report.samples:
+            self.stdout.write(
+                f"Order #{pk}: stored {stored.items_count} items, {stored.total} / {stored.discounted_total}; "
+                f"actual {actual.items_count} items, {actual.total} / {actual.discounted_total}"
+            )
+        if report.drifted > len(report.samples):
+            self.stdout.write(f"... and {report.drifted - len(report.samples)} more")
+        self.stdout.write(
+            f"Checked {report.checked} orders in {perf_counter() - started:.1f} s, {report.drifted} drifted"
+        )
+        if options["check"] and report.drifted:
+            raise CommandError(f"{report.drifted} orders have drifted totals")
+        if report.drifted:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {report.drifted} orders"))
@@ -0,0 +1,101 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+
+from shopapp.jobs import work, worker_id
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+def run_worker(options: dict, counter=None) -> int:
+    """
+    Run due jobs until stopped, or until none is due with ``once``; returns how many ran.
+    """
+    stopping = False
+
+    def stop(*args):
+        nonlocal stopping
+        stopping = True
+
+    # The job at hand is finished before the worker exits.
+    previous = {signum: signal.signal(signum, stop) for signum in STOP_SIGNALS}
+    worker = worker_id()
+    count = 0
+    try:
+        while not stopping:
+            ran = work(worker, stop=lambda: stopping)
+            count += ran
+            if counter is not None:
+                with counter.get_lock():
+                    counter.value += ran
+            if options["once"]:
+                break
+            if not ran:
+                time.sleep(options["poll"])
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return count
+
+
+class Command(BaseCommand):
+    """
+    Run the queued background jobs of ``shopapp.jobs``.
+
+    Each of ``--processes`` processes claims and runs one job at a time and
+    polls the job table every ``--poll`` seconds while idle. Exports and
+    imports are CPU and I/O bound in Python, so processes, not threads, run
+    them in parallel. SIGTERM or Ctrl-C stop the workers once their current
+    job is done; the parent forwards SIGTERM to its children and waits for
+    them. A job cut short anyway, e.g. by SIGKILL, is claimed again once its
+    lease expires. On SQLite, workers wait on the write lock for the
+    ``busy_timeout`` of ``SHOP_SQLITE_PRAGMAS``, like every other connection.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due")
+        parser.add_argument("--poll", type=float, default=None,
+                            help="Seconds between polls while idle, SHOP_JOBS['POLL_SECONDS'] by default")
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        if processes < 1:
+            raise CommandError("--processes must be at least 1")
+        if processes > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("--processes needs the fork start method, run with --processes 1 here")
+        if options["poll"] is None:
+            options["poll"] = settings.SHOP_JOBS["POLL_SECONDS"]
+        task = {"once": options["once"], "poll": options["poll"]}
+        if processes == 1:
+            count = run_worker(task)
+        else:
+            count = self.run_children(processes, task)
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs in {processes} processes"))
+
+    def run_children(self, processes: int, task: dict) -> int:
+        context = multiprocessing.get_context("fork")
+        counter = context.Value("q", 0)
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        children = [context.Process(target=run_worker, args=(task, counter)) for _ in range(processes)]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        previous = {signum: signal.signal(signum, forward) for signum in STOP_SIGNALS}
+        try:
+            for child in children:
+                child.join()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        return counter.value
@@ -1,25 +1,232 @@
-from django.core.exceptions import RequestAborted
-from django.http import HttpRequest
-from datetime import datetime, timedelta
+import json
+import logging
+import math
+from time import perf_counter
 
-last_request = {}
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError
+from django.http import HttpRequest, HttpResponse
 
+from .instrumentation import RequestMetrics, current_metrics
+from .replicas import ReplicaState, current_state
+from .sampling import note_request
+from .throttling import Rate, TokenBucket, get_store
 
-def throttling_middleware(get_response):
+log = logging.getLogger(__name__)
+performance_log = logging.getLogger("shopapp.performance")
+
+
+class ThrottlingMiddleware:
     """
     Ограничение обработки запросов пользователя, если он делает обращения слишком часто.
-    :param get_response:
-    :return:
+
+    Authenticated users are keyed by user id, anonymous clients by IP. Limits
+    come from ``SHOP_THROTTLING``: each client has one ``ANONYMOUS`` or
+    ``AUTHENTICATED`` bucket shared by all routes, plus a bucket of its own for
+    each ``ROUTES`` entry, a URL name (``"shopapp:order_export"``) or a whole
+    namespace (``"shopapp"``), whose requests do not count against the shared
+    one. Clients in ``EXEMPT_IPS``, none by default, are never
+    throttled. Buckets are shared by all workers through the store picked by
+    ``BACKEND``. Throttled requests get 429 with a ``Retry-After`` header.
     """
-    def middleware(request: HttpRequest):
-        if request.method == "GET":
-            client_ip = request.META["REMOTE_ADDR"]
-            if client_ip in last_request and datetime.now() - last_request[client_ip] < timedelta(seconds=0.01):
-                last_request[client_ip] = datetime.now()
-                raise RequestAborted
-            request.user_ip = client_ip
-            last_request[client_ip] = datetime.now()
-        response = get_response(request)
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        config = settings.SHOP_THROTTLING
+        store = get_store(config)
+        self.exempt_ips = set(config.get("EXEMPT_IPS", ()))
+        self.default_buckets = {
+            authenticated: TokenBucket(scope, Rate.from_config(config[scope.upper()]), store)
+            for authenticated, scope in ((False, "anonymous"), (True, "authenticated"))
+        }
+        self.route_buckets = {
+            route: TokenBucket(route, Rate.from_config(route_config), store)
+            for route, route_config in config.get("ROUTES", {}).items()
+        }
+
+    def __call__(self, request: HttpRequest):
+        if self.is_async:
+            return self.__acall__(request)
+        request.user_ip = request.META.get("REMOTE_ADDR")
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest):
+        request.user_ip = request.META.get("REMOTE_ADDR")
+        return await self.get_response(request)
+
+    def get_bucket(self, request: HttpRequest, authenticated: bool) -> TokenBucket:
+        match = request.resolver_match
+        for route in (match.view_name, match.namespace):
+            if route in self.route_buckets:
+                return self.route_buckets[route]
+        return self.default_buckets[authenticated]
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        if request.user_ip in self.exempt_ips:
+            return None
+        user = getattr(request, "user", None)
+        authenticated = bool(user and user.is_authenticated)
+        client = f"user:{user.pk}" if authenticated else f"ip:{request.user_ip}"
+        retry_after = self.get_bucket(request, authenticated).consume(client)
+        if not retry_after:
+            return None
+        response = HttpResponse("Too many requests", status=429)
+        response["Retry-After"] = str(math.ceil(retry_after))
         return response
 
-    return middleware
+
+class PerformanceMiddleware:
+    """
+    Measure every request and report it in ``Server-Timing`` and in the ``shopapp.performance`` log.
+
+    Records SQL queries and their time, cache hits and misses, template render
+    time, view time and total time (see ``shopapp.instrumentation``). Put it
+    first in ``MIDDLEWARE`` so the total covers the other middlewares.
+    ``SHOP_INSTRUMENTATION`` switches the header and the log line on and off.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        config = settings.SHOP_INSTRUMENTATION
+        self.server_timing = config["SERVER_TIMING"]
+        self.log = config["LOG"]
+
+    def __call__(self, request: HttpRequest):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.report(request, response, metrics)
+
+    async def __acall__(self, request: HttpRequest):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.report(request, response, metrics)
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_started = perf_counter()
+
+    def report(self, request: HttpRequest, response, metrics: RequestMetrics):
+        metrics.finish()
+        # Slow and failing routes get traced in full for a while.
+        note_request(request.path, metrics.total_time, response.status_code)
+        if self.server_timing:
+            response["Server-Timing"] = metrics.server_timing()
+        if self.log and performance_log.isEnabledFor(logging.INFO):
+            match = request.resolver_match
+            record = {
+                "method": request.method,
+                "path": request.path,
+                "route": match.view_name if match else None,
+                "status": response.status_code,
+                **metrics.as_dict(),
+            }
+            performance_log.info(json.dumps(record), extra={"metrics": record})
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Give ``ReplicaRouter`` the state of the request and keep read-your-writes consistency.
+
+    Requests with an unsafe method, and requests that carry a valid pin cookie,
+    read from the primary. Successful unsafe requests set the cookie, signed
+    and expiring after ``SHOP_REPLICAS["PIN_SECONDS"]``, or the maximum replica
+    lag if that is longer: a shorter pin could read a replica that has not
+    caught up with the write yet. A safe request whose query failed on a
+    replica runs again on the primary. Does nothing when no replica is
+    configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+    cookie_salt = "shopapp.replicas"
+    safe_methods = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        config = settings.SHOP_REPLICAS
+        self.enabled = bool(config["ALIASES"])
+        self.pin_seconds = max(config["PIN_SECONDS"], math.ceil(config["MAX_LAG_SECONDS"]))
+        self.cookie_name = config["COOKIE_NAME"]
+
+    def __call__(self, request: HttpRequest):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        token = current_state.set(self.start(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request: HttpRequest):
+        if not self.enabled:
+            return await self.get_response(request)
+        token = current_state.set(self.start(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return self.finish(request, response)
+
+    def start(self, request: HttpRequest) -> ReplicaState:
+        pinned = request.method not in self.safe_methods
+        if not pinned and self.cookie_name in request.COOKIES:
+            pinned = request.get_signed_cookie(
+                self.cookie_name, default=None, salt=self.cookie_salt, max_age=self.pin_seconds,
+            ) is not None
+        return ReplicaState(pinned=pinned)
+
+    def process_exception(self, request: HttpRequest, exception: Exception):
+        state = current_state.get()
+        if (
+            state is None or state.pinned or not state.replica_failed
+            or not isinstance(exception, DatabaseError) or request.method not in self.safe_methods
+        ):
+            return None
+        # Nothing was written, so the view can safely run again, reading from the primary.
+        state.pinned = True
+        log.warning("Replica query failed, retrying %s on the primary", request.path)
+        match = request.resolver_match
+        view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+        return view(request, *match.args, **match.kwargs)
+
+    def finish(self, request: HttpRequest, response):
+        if request.method not in self.safe_methods and response.status_code < 500:
+            response.set_signed_cookie(
+                self.cookie_name, "1", salt=self.cookie_salt, max_age=self.pin_seconds,
+                httponly=True, samesite="Lax",
+            )
+        return response
+
+
+throttling_middleware = ThrottlingMiddleware
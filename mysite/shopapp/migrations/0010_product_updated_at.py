@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:10
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+fts = import_module("shopapp.migrations.0008_product_fts")
+# SQLite may add or drop the column by rebuilding the table, which drops the
+# full-text triggers of 0008; create them again and rebuild the index.
+RECREATE_FTS_SQL = [statement for statement in fts.DROP_SQL if "TRIGGER" in statement] + fts.CREATE_SQL[1:]
+
+
+def copy_created_at(apps, schema_editor):
+    # Existing products were stamped with the migration time; nothing newer than their creation is known.
+    Product = apps.get_model("shopapp", "Product")
+    Product.objects.using(schema_editor.connection.alias).update(updated_at=models.F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0009_replication_heartbeat'),
+    ]
+
+    operations = [
+        # Runs last when unapplying, after the column is gone.
+        migrations.RunPython(migrations.RunPython.noop, fts.run_on_sqlite(RECREATE_FTS_SQL)),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.RunPython(fts.run_on_sqlite(RECREATE_FTS_SQL), migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='shop_product_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:13
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+CENT = Decimal("0.01")
+
+
+def fill_totals(apps, schema_editor):
+    # A frozen copy of shopapp.totals: migrations must not follow later changes of the app code.
+    Order = apps.get_model("shopapp", "Order")
+    database = schema_editor.connection.alias
+    totals = {}
+    links = Order.products.through.objects.using(database).values_list(
+        "order_id", "product__price", "product__discount",
+    )
+    for order_id, price, discount in links.iterator(chunk_size=2000):
+        items_count, total, discounted_total = totals.get(order_id, (0, Decimal(0), Decimal(0)))
+        discounted = (Decimal(price) * (100 - discount) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        totals[order_id] = (items_count + 1, total + Decimal(price), discounted_total + discounted)
+    Order.objects.using(database).bulk_update(
+        [
+            Order(pk=pk, items_count=items_count, total=total.quantize(CENT), discounted_total=discounted.quantize(CENT))
+            for pk, (items_count, total, discounted) in totals.items()
+        ],
+        ["items_count", "total", "discounted_total"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total'], name='shop_order_total_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['discounted_total'], name='shop_order_discounted_idx'),
+        ),
+    ]
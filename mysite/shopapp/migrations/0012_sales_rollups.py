@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shopapp', '0011_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserMonthlyOrders',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PromocodeDailyOrders',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('promocode', models.CharField(blank=True, max_length=20)),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='shop_promocode_orders_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='promocodedailyorders',
+            constraint=models.UniqueConstraint(fields=('promocode', 'day'), name='shop_promocode_day_unique'),
+        ),
+        migrations.AddField(
+            model_name='productdailysales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shopapp.product'),
+        ),
+        migrations.AddIndex(
+            model_name='usermonthlyorders',
+            index=models.Index(fields=['month'], name='shop_user_orders_month_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usermonthlyorders',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='shop_user_month_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='productdailysales',
+            index=models.Index(fields=['day'], name='shop_product_sales_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='shop_product_day_unique'),
+        ),
+    ]
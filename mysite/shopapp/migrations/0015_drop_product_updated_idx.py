@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0014_jobs'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='shop_product_updated_idx',
+        ),
+    ]
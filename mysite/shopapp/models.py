@@ -1,5 +1,8 @@
+import uuid
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Q
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _, ngettext as n_
 
@@ -8,12 +11,19 @@ class Product(models.Model):
     class Meta:
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
+        indexes = [
+            # Catalogue, feed and sitemap: live products, newest first.
+            models.Index(fields=["-created_at"], condition=Q(archived=False), name="shop_product_live_created_idx"),
+            # API keyset pagination over the whole catalogue.
+            models.Index(fields=["created_at"], name="shop_product_created_idx"),
+        ]
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2,
                                 validators=[])
     discount = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT)
 
@@ -27,9 +37,173 @@ class Order(models.Model):
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+        indexes = [
+            # Orders of a user, by date: user order lists, exports and API filters.
+            models.Index(fields=["user", "created_at"], name="shop_order_user_created_idx"),
+            models.Index(fields=["promocode", "created_at"], name="shop_order_promo_created_idx"),
+            # API keyset pagination over all orders.
+            models.Index(fields=["created_at"], name="shop_order_created_idx"),
+            # API filters and ordering on order value.
+            models.Index(fields=["total"], name="shop_order_total_idx"),
+            models.Index(fields=["discounted_total"], name="shop_order_discounted_idx"),
+        ]
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
+    # Kept in step with the products by signals, see totals.py.
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    discounted_total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+
+
+class ProductDailySales(models.Model):
+    """
+    Units of a product in the orders of one day and their revenue at the current discounted price.
+
+    Like the two rollups below it is maintained by signals, see rollups.py,
+    and rebuilt by ``backfill_sales_rollups``.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "day"], name="shop_product_day_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="shop_product_sales_day_idx"),
+        ]
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+
+class PromocodeDailyOrders(models.Model):
+    """
+    Orders placed with a promocode on one day; orders without one count under "".
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["promocode", "day"], name="shop_promocode_day_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="shop_promocode_orders_day_idx"),
+        ]
+    promocode = models.CharField(max_length=20, blank=True)
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+
+
+class UserMonthlyOrders(models.Model):
+    """
+    Orders of a user in one month, ``month`` being its first day.
+    """
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "month"], name="shop_user_month_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["month"], name="shop_user_orders_month_idx"),
+        ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="monthly_orders")
+    month = models.DateField()
+    orders = models.IntegerField(default=0)
+
+
+class Blob(models.Model):
+    """
+    Uploaded content, stored once under its SHA-256 however many times it is uploaded, see uploads.py.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def path(self) -> str:
+        return f"{self.sha256[:2]}/{self.sha256[2:4]}/{self.sha256}"
+
+    def __str__(self):
+        return self.sha256
+
+
+class Upload(models.Model):
+    """
+    A file as a user uploaded it: its name and its content.
+    """
+    name = models.CharField(max_length=255)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="uploads")
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="uploads")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress: ``received`` bytes of ``size`` have been written to its partial file.
+    """
+    class Meta:
+        indexes = [
+            # purge_upload_sessions: sessions left unfinished.
+            models.Index(fields=["updated_at"], name="shop_upload_session_idx"),
+        ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by ``run_workers``, see jobs.py.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    class Meta:
+        indexes = [
+            # Claiming: the queued jobs that are due, and running jobs whose worker went silent.
+            models.Index(fields=["status", "run_after"], name="shop_job_due_idx"),
+            models.Index(fields=["status", "lease_expires"], name="shop_job_lease_idx"),
+        ]
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField()
+    claimed_by = models.CharField(max_length=100, blank=True)
+    lease_expires = models.DateTimeField(null=True)
+    progress_done = models.BigIntegerField(default=0)
+    progress_total = models.BigIntegerField(null=True)
+    result = models.JSONField(null=True)
+    # Relative to SHOP_JOBS["ROOT"]; served by the job's download endpoint.
+    result_file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk}"
+
 
+class ReplicationHeartbeat(models.Model):
+    """
+    A single row whose timestamp ``check_replicas`` keeps refreshing on the primary;
+    how far a replica's copy is behind is its replication lag.
+    """
+    beat_at = models.DateTimeField()
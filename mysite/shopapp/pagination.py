@@ -0,0 +1,272 @@
+"""
+Pagination for the shop API and the HTML catalogue.
+
+Page numbers stay the default. ``?pagination=cursor`` (or any request that
+carries a ``cursor``) switches to keyset pagination, which seeks straight to the
+next page by the values of the ordering columns instead of counting and skipping
+rows, so every page costs the same however deep it is.
+
+``VersionedCountPaginator`` paginates HTML lists whose total only changes
+together with a version counter: the count is cached under that version.
+"""
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+from functools import cached_property
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Max, Q, QuerySet
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .versioning import versioned_key
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    Estimate the size of ``queryset`` from planner statistics instead of COUNT(*).
+
+    PostgreSQL estimates the filtered query itself. SQLite only keeps table
+    statistics, so there an unfiltered estimate is the size of the whole table:
+    the row count from ANALYZE, or the highest primary key if ANALYZE was never
+    run. A filtered query is counted exactly instead, as no statistics describe it.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            return int(cursor.fetchone()[0][0]["Plan"]["Plan Rows"])
+    if queryset.query.where:
+        return queryset.count()
+    table = queryset.model._meta.db_table
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone():
+                # The first number of every stat row is the number of rows it covers;
+                # partial indexes cover fewer, so the largest one is the table size.
+                cursor.execute("SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s", [table])
+                row = cursor.fetchone()
+                if row[0] is not None:
+                    return row[0]
+    return queryset.model._default_manager.using(queryset.db).aggregate(estimate=Max("pk"))["estimate"] or 0
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    ``DjangoJSONEncoder`` that keeps the microseconds it would cut.
+
+    A cursor value must equal the column value exactly, or the last row of a
+    page is found again on the next one.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat(timespec="microseconds")
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination keyed on the full ordering plus ``pk``.
+
+    The ordering comes from ``OrderingFilter`` when the client picks one and is
+    ``(created_at, pk)`` otherwise. ``?count=exact`` or ``?count=estimated`` add a
+    total to the response; without it no count query is made at all.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+    default_ordering = ("created_at",)
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self, page_size: int):
+        self.page_size = page_size
+
+    def get_ordering(self, queryset: QuerySet) -> list[str]:
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering or self.default_ordering)
+        if not {"pk", "-pk", "id", "-id"} & set(ordering):
+            ordering.append("pk")
+        return ordering
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, values: list) -> str:
+        return urlsafe_b64encode(json.dumps(values, cls=CursorEncoder).encode()).decode()
+
+    def decode_cursor(self, cursor: str, ordering: list[str]) -> list:
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (ValueError, BinasciiError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def seek_filter(ordering: list[str], values: list) -> Q:
+        """
+        Rows strictly after ``values`` in ``ordering``: (a > x) OR (a = x AND b > y) ...
+        """
+        condition = Q()
+        for position, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{name}__{lookup}": values[position]})
+            for previous, value in zip(ordering[:position], values):
+                step &= Q(**{previous.lstrip("-"): value})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def row_values(row, ordering: list[str]) -> list:
+        meta = type(row)._meta
+        values = []
+        for field in ordering:
+            name = field.lstrip("-")
+            if name == "pk":
+                values.append(row.pk)
+                continue
+            try:
+                values.append(getattr(row, meta.get_field(name).attname))
+            except FieldDoesNotExist:
+                # An annotation, like the rank of a search.
+                values.append(getattr(row, name))
+        return values
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*ordering)
+        self.count = None
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode == "exact":
+            self.count = queryset.count()
+        elif count_mode == "estimated":
+            self.count = estimate_count(queryset)
+        elif count_mode is not None:
+            raise ValidationError({self.count_query_param: 'Expected "exact" or "estimated".'})
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(ordering, self.decode_cursor(cursor, ordering)))
+        page_size = self.get_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = self.encode_cursor(self.row_values(rows[-1], ordering))
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([("next", self.get_next_link()), ("results", data)])
+        if self.count is not None:
+            response["count"] = self.count
+            response.move_to_end("count", last=False)
+        return Response(response)
+
+
+class ShopPagination(PageNumberPagination):
+    """
+    Page number pagination that hands over to ``KeysetPagination`` on request.
+    """
+    mode_query_param = "pagination"
+    page_size_query_param = "page_size"
+    max_page_size = KeysetPagination.max_page_size
+
+    def use_keyset(self, request) -> bool:
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if not self.use_keyset(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination(self.page_size)
+        self.display_page_controls = False
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": 'Set to "cursor" for keyset pagination.',
+                "schema": {"type": "string", "enum": ["cursor"]},
+            },
+            {
+                "name": KeysetPagination.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor returned in the `next` link of a keyset page.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": KeysetPagination.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": (
+                    "Add an exact or estimated total to a keyset page. Only PostgreSQL estimates"
+                    " filtered lists; other databases count them exactly."
+                ),
+                "schema": {"type": "string", "enum": ["exact", "estimated"]},
+            },
+        ]
+
+
+class VersionedCountPaginator(Paginator):
+    """
+    A paginator that counts the objects once per generation of ``namespace``.
+
+    The count is cached without a timeout under a ``versioned_key``, so a bump
+    of the namespace is the only thing that makes it run COUNT(*) again.
+    """
+
+    def __init__(self, object_list, per_page, *args, namespace: str, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.namespace = namespace
+
+    @cached_property
+    def count(self) -> int:
+        key = versioned_key(self.namespace, None, "count")
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, timeout=None)
+        return count
@@ -0,0 +1,145 @@
+"""
+Read replicas.
+
+``ReplicaRouter`` sends the reads of a request to a healthy replica listed in
+``SHOP_REPLICAS["ALIASES"]`` and everything else to ``default``:
+
+- only requests go to replicas: ``ReplicaPinningMiddleware`` opens a
+  ``ReplicaState`` for each one, and code running outside a request (commands,
+  shells, migrations) always uses the primary;
+- read-your-writes: a request that writes, and every request of the client
+  for ``PIN_SECONDS`` after an unsafe method, reads from the primary. The pin
+  is a signed cookie, so checking it costs no database query;
+- a replica is checked at most every ``CHECK_INTERVAL`` seconds: it must answer
+  and its ``ReplicationHeartbeat`` must be less than ``MAX_LAG_SECONDS`` behind
+  the primary's. ``check_replicas`` keeps the primary's heartbeat fresh.
+  Without a primary heartbeat the lag is unknown and replicas are not used.
+  Unavailable or lagging replicas are skipped until they pass again; when
+  none pass, reads go to the primary;
+- a query that fails on a replica marks it unavailable, and
+  ``ReplicaPinningMiddleware`` runs the request again on the primary, as long
+  as it is safe and has not written anything.
+"""
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.connection import ConnectionDoesNotExist
+
+HEARTBEAT_ID = 1
+
+
+@dataclass
+class ReplicaState:
+    pinned: bool = False
+    # A query of this request failed on a replica.
+    replica_failed: bool = False
+
+
+current_state: ContextVar[Optional[ReplicaState]] = ContextVar("current_replica_state", default=None)
+
+
+def heartbeat(alias: str) -> Optional[float]:
+    """
+    The heartbeat timestamp stored in ``alias``, None when it was never written.
+    """
+    from .models import ReplicationHeartbeat
+
+    beat_at = (
+        ReplicationHeartbeat.objects.using(alias)
+        .filter(pk=HEARTBEAT_ID)
+        .values_list("beat_at", flat=True)
+        .first()
+    )
+    return beat_at.timestamp() if beat_at else None
+
+
+def replica_lag(alias: str) -> float:
+    """
+    Seconds ``alias`` is behind the primary, infinite when either heartbeat is missing.
+
+    Raises ``DatabaseError`` if it cannot be read.
+    """
+    primary, replica = heartbeat(DEFAULT_DB_ALIAS), heartbeat(alias)
+    if primary is None or replica is None:
+        return float("inf")
+    return max(0.0, primary - replica)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        config = settings.SHOP_REPLICAS
+        self.replicas = list(config["ALIASES"])
+        self.max_lag = config["MAX_LAG_SECONDS"]
+        self.check_interval = config["CHECK_INTERVAL"]
+        # alias -> (healthy, monotonic time of the check)
+        self.health: dict[str, tuple[bool, float]] = {}
+
+    def is_healthy(self, alias: str) -> bool:
+        healthy, checked_at = self.health.get(alias, (False, None))
+        now = time.monotonic()
+        if checked_at is None or now - checked_at >= self.check_interval:
+            try:
+                healthy = replica_lag(alias) <= self.max_lag
+            except (DatabaseError, ConnectionDoesNotExist):
+                healthy = False
+            self.health[alias] = (healthy, now)
+        return healthy
+
+    def mark_unavailable(self, alias: str):
+        self.health[alias] = (False, time.monotonic())
+
+    def db_for_read(self, model, **hints):
+        state = current_state.get()
+        if state is None or state.pinned or not self.replicas:
+            return DEFAULT_DB_ALIAS
+        healthy = [alias for alias in self.replicas if self.is_healthy(alias)]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = current_state.get()
+        if state is not None:
+            # Later reads of this request must see what it wrote.
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.replicas
+
+
+def fail_over(execute, sql, params, many, context):
+    """
+    Execute wrapper for replica connections: a failing replica is skipped from then on.
+
+    The error still reaches the caller; the request state records it so that
+    the middleware can run the request again on the primary.
+    """
+    try:
+        return execute(sql, params, many, context)
+    except DatabaseError:
+        alias = context["connection"].alias
+        for router in _replica_routers():
+            router.mark_unavailable(alias)
+        state = current_state.get()
+        if state is not None:
+            state.replica_failed = True
+        raise
+
+
+def _replica_routers() -> list[ReplicaRouter]:
+    from django.db import router
+
+    return [instance for instance in router.routers if isinstance(instance, ReplicaRouter)]
+
+
+def install_fail_over(connection):
+    if connection.alias in settings.SHOP_REPLICAS["ALIASES"] and fail_over not in connection.execute_wrappers:
+        connection.execute_wrappers.append(fail_over)
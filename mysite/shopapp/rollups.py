@@ -0,0 +1,223 @@
+"""
+Sales rollups.
+
+Reports read three small pre-aggregated tables instead of scanning orders,
+their products and the products themselves:
+
+- ``ProductDailySales``: units and revenue of every product per order day;
+- ``PromocodeDailyOrders``: orders per promocode per day;
+- ``UserMonthlyOrders``: orders per user per month.
+
+Signals apply every order, order-product and price change to them as a few
+single-row increments. ``rebuild_month`` recomputes one month from the orders,
+so ``backfill_sales_rollups`` fills history a month per transaction and never
+holds the SQLite write lock for long. Like the order totals, revenue follows
+the current discounted price of the product.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, Product, ProductDailySales, PromocodeDailyOrders, UserMonthlyOrders
+from .totals import discounted_price
+
+
+def order_day(created_at: datetime) -> date:
+    return timezone.localdate(created_at)
+
+
+def month_of(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def increment(model, keys: dict, **deltas):
+    """
+    Add ``deltas`` to the row of ``model`` identified by ``keys``, creating it when missing.
+    """
+    changes = {name: F(name) + delta for name, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Created by a concurrent request in the meantime.
+        model.objects.filter(**keys).update(**changes)
+
+
+def count_order(user_id: int, promocode: str, created_at: datetime, sign: int):
+    day = order_day(created_at)
+    increment(PromocodeDailyOrders, {"promocode": promocode or "", "day": day}, orders=sign)
+    increment(UserMonthlyOrders, {"user_id": user_id, "month": month_of(day)}, orders=sign)
+
+
+def count_products(created_at: datetime, products: Iterable[tuple[int, Decimal, int]], sign: int):
+    """
+    Add (``sign=1``) or take away ``(product id, price, discount)`` from the sales of the order day.
+    """
+    day = order_day(created_at)
+    for product_id, price, discount in products:
+        increment(
+            ProductDailySales, {"product_id": product_id, "day": day},
+            units=sign, revenue=sign * discounted_price(price, discount),
+        )
+
+
+def count_product_orders(product: Product, order_dates: Iterable[datetime], sign: int):
+    """
+    Add (``sign=1``) or take away ``product`` from the sales of orders created at ``order_dates``.
+    """
+    unit_price = discounted_price(product.price, product.discount)
+    for day, units in Counter(order_day(created_at) for created_at in order_dates).items():
+        increment(
+            ProductDailySales, {"product_id": product.pk, "day": day},
+            units=sign * units, revenue=sign * units * unit_price,
+        )
+
+
+def increment_many(model, deltas: dict[tuple, dict]):
+    """
+    Add ``deltas[key]`` to the rows of ``model`` whose unique fields equal ``key``.
+
+    Reads the existing rows once, locked where the database can, then writes
+    them with one ``bulk_update`` and the missing ones with one ``bulk_create``.
+    Must run in a transaction, like the ``bulk_create`` of the counted orders.
+    """
+    if not deltas:
+        return
+    # The rollups have a single unique constraint, over the key fields.
+    key_fields = [model._meta.get_field(name).attname for name in model._meta.constraints[0].fields]
+    lookups = {f"{name}__in": {key[index] for key in deltas} for index, name in enumerate(key_fields)}
+    existing = {
+        tuple(getattr(row, name) for name in key_fields): row
+        for row in model.objects.select_for_update().filter(**lookups)
+    }
+    changed = []
+    for key, values in deltas.items():
+        if (row := existing.get(key)) is not None:
+            for name, delta in values.items():
+                setattr(row, name, getattr(row, name) + delta)
+            changed.append(row)
+    if changed:
+        model.objects.bulk_update(changed, next(iter(deltas.values())).keys())
+    missing = {key: values for key, values in deltas.items() if key not in existing}
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(model(**dict(zip(key_fields, key)), **values) for key, values in missing.items())
+    except IntegrityError:
+        # Some were created by a concurrent request in the meantime.
+        for key, values in missing.items():
+            increment(model, dict(zip(key_fields, key)), **values)
+
+
+def count_created_orders(orders: list[Order], products: dict[int, list[tuple[int, Decimal, int]]]):
+    """
+    Add orders written with ``bulk_create``, which sends no signals, and ``products[order.pk]``.
+
+    The increments are summed first, then written in a few queries per rollup table;
+    call it in the transaction that created the orders.
+    """
+    promocodes, users = Counter(), Counter()
+    sales = defaultdict(lambda: {"units": 0, "revenue": Decimal("0.00")})
+    for order in orders:
+        day = order_day(order.created_at)
+        promocodes[order.promocode or "", day] += 1
+        users[order.user_id, month_of(day)] += 1
+        for product_id, price, discount in products.get(order.pk, ()):
+            sales[product_id, day]["units"] += 1
+            sales[product_id, day]["revenue"] += discounted_price(price, discount)
+    increment_many(PromocodeDailyOrders, {key: {"orders": count} for key, count in promocodes.items()})
+    increment_many(UserMonthlyOrders, {key: {"orders": count} for key, count in users.items()})
+    increment_many(ProductDailySales, dict(sales))
+
+
+def reprice_product(product: Product):
+    unit_price = discounted_price(product.price, product.discount)
+    ProductDailySales.objects.filter(product=product).update(revenue=F("units") * Value(unit_price))
+
+
+def product_prices(product_ids: Iterable[int]) -> list[tuple[int, Decimal, int]]:
+    return list(Product.objects.filter(pk__in=list(product_ids)).values_list("pk", "price", "discount"))
+
+
+def rebuild_month(month: date):
+    """
+    Recompute the rollups of ``month`` from its orders in one transaction.
+    """
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    end = timezone.make_aware(datetime.combine(next_month(month), datetime.min.time()))
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end).order_by()
+    links = (
+        Order.products.through.objects
+        .filter(order__created_at__gte=start, order__created_at__lt=end)
+        .annotate(day=TruncDate("order__created_at"))
+        .values("product_id", "day", "product__price", "product__discount")
+        .annotate(units=Count("pk"))
+        .order_by()
+    )
+    with transaction.atomic():
+        ProductDailySales.objects.filter(day__gte=month, day__lt=next_month(month)).delete()
+        PromocodeDailyOrders.objects.filter(day__gte=month, day__lt=next_month(month)).delete()
+        UserMonthlyOrders.objects.filter(month=month).delete()
+        ProductDailySales.objects.bulk_create(
+            (
+                ProductDailySales(
+                    product_id=row["product_id"],
+                    day=row["day"],
+                    units=row["units"],
+                    revenue=row["units"] * discounted_price(row["product__price"], row["product__discount"]),
+                )
+                for row in links.iterator()
+            ),
+            batch_size=1000,
+        )
+        PromocodeDailyOrders.objects.bulk_create(
+            (
+                PromocodeDailyOrders(promocode=row["promocode"], day=row["day"], orders=row["orders"])
+                for row in (
+                    orders.annotate(day=TruncDate("created_at"))
+                    .values("promocode", "day")
+                    .annotate(orders=Count("pk"))
+                    .iterator()
+                )
+            ),
+            batch_size=1000,
+        )
+        UserMonthlyOrders.objects.bulk_create(
+            (
+                UserMonthlyOrders(user_id=row["user_id"], month=month, orders=row["orders"])
+                for row in orders.values("user_id").annotate(orders=Count("pk")).iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+def months_between(first: date, last: date) -> Iterable[date]:
+    month = month_of(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def order_months(since: Optional[date] = None) -> list[date]:
+    """
+    Every month from ``since`` (or the first order) to the last order.
+    """
+    dates = Order.objects.order_by("created_at").values_list("created_at", flat=True)
+    first, last = dates.first(), dates.last()
+    if first is None:
+        return []
+    start = max(month_of(order_day(first)), month_of(since)) if since else month_of(order_day(first))
+    return list(months_between(start, order_day(last)))
@@ -0,0 +1,124 @@
+"""
+Trace sampling policy for Sentry.
+
+``traces_sampler`` decides per transaction whether it is traced:
+
+- an upstream service's decision (``parent_sampled``) is always kept;
+- otherwise the rate of the longest matching path prefix in ``ROUTES`` is used,
+  or ``DEFAULT_RATE``; language prefixes like ``/en/`` are ignored;
+- a route that recently answered slowly or with a server error is traced at
+  100% for ``BOOST_SECONDS``: ``PerformanceMiddleware`` reports such requests
+  with ``note_request``;
+- whatever is picked must fit in a global ``TRACES_PER_SECOND`` budget, a token
+  bucket shared by all workers through the throttling store.
+
+Error events do not depend on it: Sentry sends every error.
+"""
+import random
+import re
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .throttling import Rate, TokenBucket, get_store
+
+ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def parse_route_rates(value: str) -> dict[str, float]:
+    """
+    Parse ``"/shop/api/=0.001,/static/=0"`` into ``{"/shop/api/": 0.001, "/static/": 0.0}``.
+    """
+    rates = {}
+    for item in value.split(","):
+        prefix, _, rate = item.strip().rpartition("=")
+        if prefix:
+            rates[prefix] = float(rate)
+    return rates
+
+
+class SamplingPolicy:
+    def __init__(self, config: dict, store):
+        self.default_rate = config["DEFAULT_RATE"]
+        # Longest prefix first, so "/shop/api/" wins over "/shop/".
+        self.routes = sorted(config["ROUTES"].items(), key=lambda item: len(item[0]), reverse=True)
+        self.slow_seconds = config["SLOW_REQUEST_SECONDS"]
+        self.boost_seconds = config["BOOST_SECONDS"]
+        self.store = store
+        self.budget = TokenBucket(
+            "trace-budget", Rate(rate=config["TRACES_PER_SECOND"], burst=config["BURST"]), store,
+        )
+        languages = "|".join(re.escape(code) for code, _ in settings.LANGUAGES)
+        self.language_prefix = re.compile(rf"^/(?:{languages})(?=/)")
+
+    def route(self, path: str) -> str:
+        """
+        The path without its language prefix and with numeric ids folded: ``/shop/orders/*/``.
+        """
+        return ID_SEGMENT.sub("/*", self.language_prefix.sub("", path))
+
+    def rate(self, route: str) -> float:
+        for prefix, rate in self.routes:
+            if route.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def boosted(self, route: str) -> bool:
+        state = self.store.get(f"trace-boost:{route}")
+        return state is not None and state[0] > time.time()
+
+    def note_request(self, path: str, seconds: float, status: int):
+        if seconds >= self.slow_seconds or status >= 500:
+            until = time.time() + self.boost_seconds
+            self.store.set(f"trace-boost:{self.route(path)}", (until, until), self.boost_seconds)
+
+    def sample(self, sampling_context: dict) -> float:
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            return 1.0 if parent_sampled else 0.0
+        path = request_path(sampling_context)
+        if path is None:
+            rate = self.default_rate
+        else:
+            route = self.route(path)
+            rate = 1.0 if self.boosted(route) else self.rate(route)
+        if rate <= 0 or random.random() >= rate:
+            return 0.0
+        return 0.0 if self.budget.consume("global") else 1.0
+
+
+def request_path(sampling_context: dict) -> Optional[str]:
+    if "wsgi_environ" in sampling_context:
+        return sampling_context["wsgi_environ"].get("PATH_INFO")
+    scope = sampling_context.get("asgi_scope")
+    if scope and scope.get("type") == "http":
+        return scope.get("path")
+    return None
+
+
+_policy: Optional[SamplingPolicy] = None
+
+
+def get_policy() -> SamplingPolicy:
+    global _policy
+    if _policy is None:
+        _policy = SamplingPolicy(settings.SHOP_TRACE_SAMPLING, get_store(settings.SHOP_THROTTLING))
+    return _policy
+
+
+@receiver(setting_changed)
+def reset_policy(setting, **kwargs):
+    global _policy
+    if setting in ("SHOP_TRACE_SAMPLING", "SHOP_THROTTLING", "LANGUAGES"):
+        _policy = None
+
+
+def traces_sampler(sampling_context: dict) -> float:
+    return get_policy().sample(sampling_context)
+
+
+def note_request(path: str, seconds: float, status: int):
+    get_policy().note_request(path, seconds, status)
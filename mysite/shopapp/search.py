@@ -0,0 +1,75 @@
+"""
+Full-text product search.
+
+On SQLite products are indexed in an FTS5 table that triggers keep in sync with
+``shopapp_product`` (see migration 0008). Matches are ranked with bm25, with a
+hit in the name weighing more than one in the description. Other databases fall
+back to the regular ``icontains`` search.
+"""
+from django.db import connections
+from django.db.models import FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+FTS_TABLE = "shopapp_product_fts"
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+_fts_available = {}
+
+
+def fts_available(alias: str) -> bool:
+    if alias not in _fts_available:
+        connection = connections[alias]
+        _fts_available[alias] = (
+            connection.vendor == "sqlite"
+            # The rank subquery uses a MATERIALIZED common table expression.
+            and connection.Database.sqlite_version_info >= (3, 35)
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[alias]
+
+
+def build_match_query(terms: list[str]) -> str:
+    """
+    Turn user input into an FTS5 query: every term must match as a word prefix.
+    """
+    phrases = []
+    for term in terms:
+        term = term.replace('"', " ").strip()
+        if term:
+            phrases.append(f'"{term}"*')
+    return " ".join(phrases)
+
+
+def search_products(queryset: QuerySet, terms: list[str]) -> QuerySet:
+    """
+    Restrict ``queryset`` to products matching all ``terms``, best matches first.
+    """
+    match = build_match_query(terms)
+    if not match:
+        return queryset
+    product_table = queryset.model._meta.db_table
+    # The matches and their ranks are computed once, materialized by SQLite,
+    # then looked up per product: no FTS query runs per row.
+    rank = RawSQL(
+        f"WITH ranked AS MATERIALIZED (SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank"
+        f" FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)"
+        f" SELECT ranked.rank FROM ranked WHERE ranked.rowid = {product_table}.id",
+        (NAME_WEIGHT, DESCRIPTION_WEIGHT, match),
+        output_field=FloatField(),
+    )
+    matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by("search_rank")
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ``SearchFilter`` backed by the product full-text index when it is available.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not fts_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, terms)
@@ -1,7 +1,7 @@
 
 from rest_framework import serializers
 
-from .models import Product, Order
+from .models import Product, Order, ProductDailySales, PromocodeDailyOrders, UserMonthlyOrders
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -27,4 +27,30 @@ class OrderSerializer(serializers.ModelSerializer):
             "created_at",
             "user",
             "products",
+            "items_count",
+            "total",
+            "discounted_total",
         )
+        read_only_fields = ("items_count", "total", "discounted_total")
+
+
+class OrderExpandedSerializer(OrderSerializer):
+    products = ProductSerializer(many=True, read_only=True)
+
+
+class ProductDailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductDailySales
+        fields = ("product", "day", "units", "revenue")
+
+
+class PromocodeDailyOrdersSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PromocodeDailyOrders
+        fields = ("promocode", "day", "orders")
+
+
+class UserMonthlyOrdersSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserMonthlyOrders
+        fields = ("user", "month", "orders")
@@ -0,0 +1,214 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Order, Product
+from .rollups import count_order, count_product_orders, count_products, product_prices, reprice_product
+from .totals import discounted_price, money, orders_of_product, recompute_order, shift_orders, shift_product_orders
+from .versioning import bump_version, bump_versions
+
+# Everything of one user's orders, scoped by user id.
+ORDERS_NAMESPACE = "orders"
+# A single order, scoped by order id.
+ORDER_NAMESPACE = "order"
+# What order fragments show of a product or a user, scoped by their id.
+ORDER_PRODUCT_NAMESPACE = "order-product"
+ORDER_USER_NAMESPACE = "order-user"
+CATALOGUE_NAMESPACE = "catalogue"
+# When the catalogue version last moved: its Last-Modified, deletions included.
+CATALOGUE_CHANGED_KEY = "shopapp:catalogue-changed-at"
+
+
+def bump_user_orders(user_ids):
+    for user_id in set(user_ids):
+        bump_version(ORDERS_NAMESPACE, user_id)
+
+
+def bump_orders(order_ids):
+    """
+    Invalidate the cached fragments of single orders.
+    """
+    bump_versions(ORDER_NAMESPACE, order_ids)
+
+
+def bump_order_rows(rows):
+    """
+    Invalidate orders and their users' order lists from ``(order id, user id)`` pairs.
+    """
+    rows = list(rows)
+    bump_user_orders(user_id for _, user_id in rows)
+    bump_orders(order_id for order_id, _ in rows)
+
+
+def bump_catalogue():
+    """
+    Invalidate the cached catalogue pages and product count.
+
+    Bulk writes such as ``QuerySet.update()`` send no signal and must call it themselves.
+    """
+    bump_version(CATALOGUE_NAMESPACE)
+    cache.set(CATALOGUE_CHANGED_KEY, timezone.now(), timeout=None)
+
+
+# Totals first: the cache invalidation below must not let a page cache the old totals.
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_totals(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            recompute_order(instance.pk)
+        return
+    # Changed from the product side: shift the orders the product joined or left.
+    if action == "post_add":
+        shift_product_orders(instance, list(pk_set), 1)
+    elif action == "pre_remove":
+        # ``pk_set`` also holds orders that never had the product.
+        instance._unlinked_order_ids = list(
+            orders_of_product(instance.pk).filter(order_id__in=pk_set).values_list("order_id", flat=True)
+        )
+    elif action == "pre_clear":
+        instance._unlinked_order_ids = list(orders_of_product(instance.pk).values_list("order_id", flat=True))
+    elif action in ("post_remove", "post_clear"):
+        shift_product_orders(instance, getattr(instance, "_unlinked_order_ids", []), -1)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance: Product, **kwargs):
+    instance._previous_price = None
+    if instance.pk is not None:
+        instance._previous_price = (
+            Product.objects.filter(pk=instance.pk).values_list("price", "discount").first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance: Product, created: bool, **kwargs):
+    previous = getattr(instance, "_previous_price", None)
+    if created or previous is None or previous == (money(instance.price), int(instance.discount)):
+        return
+    price, discount = previous
+    shift_orders(
+        orders_of_product(instance.pk),
+        0,
+        money(instance.price) - price,
+        discounted_price(instance.price, instance.discount) - discounted_price(price, discount),
+    )
+    reprice_product(instance)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleted_totals(sender, instance: Product, **kwargs):
+    shift_product_orders(instance, list(orders_of_product(instance.pk).values_list("order_id", flat=True)), -1)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_owner(sender, instance: Order, **kwargs):
+    if instance.pk is None:
+        instance._previous_user_id = instance._previous_promocode = None
+        return
+    instance._previous_user_id, instance._previous_promocode = (
+        Order.objects.filter(pk=instance.pk).values_list("user_id", "promocode").first() or (None, None)
+    )
+
+
+@receiver(post_save, sender=Order)
+def order_rollups(sender, instance: Order, created: bool, **kwargs):
+    previous = (getattr(instance, "_previous_user_id", None), getattr(instance, "_previous_promocode", None))
+    if created:
+        count_order(instance.user_id, instance.promocode, instance.created_at, 1)
+    elif previous[0] is not None and previous != (instance.user_id, instance.promocode):
+        count_order(*previous, instance.created_at, -1)
+        count_order(instance.user_id, instance.promocode, instance.created_at, 1)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted_rollups(sender, instance: Order, **kwargs):
+    # Its product links go without an m2m_changed signal.
+    count_order(instance.user_id, instance.promocode, instance.created_at, -1)
+    count_products(instance.created_at, instance.products.values_list("pk", "price", "discount"), -1)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_rollups(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if not reverse:
+        if action == "pre_remove":
+            instance._unlinked_products = list(
+                instance.products.filter(pk__in=pk_set).values_list("pk", "price", "discount")
+            )
+        elif action == "pre_clear":
+            instance._unlinked_products = list(instance.products.values_list("pk", "price", "discount"))
+        elif action == "post_add":
+            count_products(instance.created_at, product_prices(pk_set), 1)
+        elif action in ("post_remove", "post_clear"):
+            count_products(instance.created_at, getattr(instance, "_unlinked_products", []), -1)
+        return
+    if action == "pre_remove":
+        instance._unlinked_order_dates = list(
+            instance.orders.filter(pk__in=pk_set).values_list("created_at", flat=True)
+        )
+    elif action == "pre_clear":
+        instance._unlinked_order_dates = list(instance.orders.values_list("created_at", flat=True))
+    elif action == "post_add":
+        count_product_orders(instance, Order.objects.filter(pk__in=pk_set).values_list("created_at", flat=True), 1)
+    elif action in ("post_remove", "post_clear"):
+        count_product_orders(instance, getattr(instance, "_unlinked_order_dates", []), -1)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance: Order, **kwargs):
+    previous_user_id = getattr(instance, "_previous_user_id", None)
+    bump_user_orders(
+        user_id for user_id in (instance.user_id, previous_user_id) if user_id is not None
+    )
+    bump_orders([instance.pk])
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs):
+    bump_user_orders([instance.user_id])
+    # SQLite may hand the id out again; the new order must not find this one's fragment.
+    bump_orders([instance.pk])
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            bump_user_orders([instance.user_id])
+            bump_orders([instance.pk])
+        return
+    # Changed from the product side: ``pk_set`` holds order ids, except for clear.
+    if action == "pre_clear":
+        instance._cleared_orders = list(instance.orders.values_list("pk", "user_id"))
+    elif action == "post_clear":
+        bump_order_rows(getattr(instance, "_cleared_orders", []))
+    elif action in ("post_add", "post_remove"):
+        bump_order_rows(Order.objects.filter(pk__in=pk_set).values_list("pk", "user_id"))
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    # Deleting a product drops its order links without an m2m_changed signal.
+    bump_order_rows(instance.orders.values_list("pk", "user_id"))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, created: bool, **kwargs):
+    if not created:
+        # Orders show the product's name and price; one bump covers all of them.
+        bump_version(ORDER_PRODUCT_NAMESPACE, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance: User, created: bool, update_fields=None, **kwargs):
+    # Logging in only stamps last_login, which no order shows.
+    if not created and update_fields != frozenset({"last_login"}):
+        # The global order list shows the name of each order's user.
+        bump_version(ORDER_USER_NAMESPACE, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance: Product, **kwargs):
+    bump_catalogue()
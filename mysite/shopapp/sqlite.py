@@ -0,0 +1,35 @@
+"""
+SQLite connection setup.
+
+Every new SQLite connection gets the pragmas of ``SHOP_SQLITE_PRAGMAS``: WAL so
+readers and the writer stop blocking each other, ``synchronous=NORMAL`` (safe
+with WAL, one fsync per checkpoint instead of per commit), a memory-mapped
+database file, a larger page cache and a ``busy_timeout`` so writers queue up
+for the lock instead of failing with "database is locked".
+"""
+import re
+
+from django.conf import settings
+
+PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE = re.compile(r"^-?\w+$")
+
+
+def apply_pragmas(connection, pragmas: dict):
+    if connection.vendor != "sqlite":
+        return
+    for name, value in pragmas.items():
+        # Pragmas cannot take query parameters; refuse anything but plain words and numbers.
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f"Invalid SQLite pragma {name} = {value!r}")
+        if name == "journal_mode":
+            # Persistent in the file: only switch when needed, which read-only replicas cannot do.
+            current = connection.connection.execute("PRAGMA journal_mode").fetchone()[0]
+            if current.lower() == str(value).lower() or "mode=ro" in str(connection.settings_dict["NAME"]):
+                continue
+        # The raw connection skips execute wrappers: this is setup, not a query of the request.
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+def configure_connection(connection):
+    apply_pragmas(connection, getattr(settings, "SHOP_SQLITE_PRAGMAS", {}))
@@ -1,10 +1,46 @@
+import hashlib
 import json
+import re
+import shutil
+import tempfile
+from io import StringIO
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
-from django.urls import reverse
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, F
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 
-from shopapp.models import Order, Product
+from shopapp.models import (
+    Blob,
+    Job,
+    Order,
+    Product,
+    ProductDailySales,
+    PromocodeDailyOrders,
+    Upload,
+    UploadSession,
+    UserMonthlyOrders,
+)
+from shopapp.jobs import TASKS, LeaseHeartbeat, Task, claim, submit, worker_id
+from shopapp.middlewares import ReplicaPinningMiddleware
+from shopapp.replicas import ReplicaRouter, ReplicaState, current_state, replica_lag
+from shopapp.sampling import get_policy, traces_sampler
+from shopapp.signals import ORDER_NAMESPACE, ORDERS_NAMESPACE
+from shopapp.sitemap import ShopSitemap
+from shopapp.versioning import get_version
+from shopapp.views import LatestProductsFeed, ProductsListView
 
 
 class OrderDetailViewTestCase(TestCase):
@@ -65,3 +101,866 @@ class OrdersExportTestCase(TestCase):
         }
         received_data = json.loads(response.content)
         self.assertEqual(received_data, expected_data)
+
+    def test_order_export_stream(self):
+        response = self.client.get(reverse("shopapp:order_export"), {"stream": "json"})
+        self.assertEqual(response.status_code, 200)
+        received_data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([order["pk"] for order in received_data["orders"]], [2, 3, 4])
+
+    def test_order_export_ndjson(self):
+        response = self.client.get(reverse("shopapp:order_export"), {"stream": "ndjson"})
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).splitlines()
+        received_data = [json.loads(line) for line in lines]
+        self.assertEqual(received_data[0]["products"], [5, 9])
+        self.assertEqual(len(received_data), 3)
+
+    async def test_order_export_stream_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse("shopapp:order_export"), {"stream": "ndjson"})
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual([json.loads(line)["pk"] for line in lines], [2, 3, 4])
+
+    def test_order_export_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username="Customer", password="qwerty"))
+        response = self.client.get(reverse("shopapp:order_export"))
+        self.assertEqual(response.status_code, 403)
+        self.client.logout()
+        response = self.client.get(reverse("shopapp:order_export"))
+        self.assertEqual(response.status_code, 302)
+
+
+class UserOrderExportTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+        "order-fixture.json",
+    ]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.client.force_login(self.user)
+        self.url = reverse("shopapp:user_orders_export", kwargs={"user_id": 1})
+
+    def test_export_is_invalidated_by_order_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content)["orders"][0]["products"], [5, 9])
+
+        order = Order.objects.get(pk=2)
+        order.products.remove(9)
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content)["orders"][0]["products"], [5])
+
+        order.delete()
+        response = self.client.get(self.url)
+        self.assertEqual([order["pk"] for order in json.loads(response.content)["orders"]], [3, 4])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SHOP_THROTTLING={
+        "BACKEND": "cache",
+        "ANONYMOUS": {"rate": 1, "burst": 2},
+        "AUTHENTICATED": {"rate": 1, "burst": 2},
+        "ROUTES": {"shopapp:products_list": {"rate": 0.5, "burst": 1}},
+    },
+)
+class ThrottlingMiddlewareTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_anonymous_clients_get_429_with_retry_after(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse("shopapp:index")).status_code, 200)
+        response = self.client.get(reverse("shopapp:index"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_route_limits_use_their_own_bucket(self):
+        self.assertEqual(self.client.get(reverse("shopapp:products_list")).status_code, 200)
+        response = self.client.get(reverse("shopapp:products_list"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(self.client.get(reverse("shopapp:index")).status_code, 200)
+
+    def test_exempt_clients_are_not_throttled(self):
+        with override_settings(SHOP_THROTTLING={**settings.SHOP_THROTTLING, "EXEMPT_IPS": ["127.0.0.1"]}):
+            for _ in range(3):
+                self.assertEqual(self.client.get(reverse("shopapp:index")).status_code, 200)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductsListCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username="Tester", password="qwerty", is_staff=True, is_superuser=True)
+        Product.objects.bulk_create(
+            Product(name=f"Product {index}", price=index, created_by=self.user) for index in range(60)
+        )
+
+    def test_pages_are_cached_until_catalogue_changes(self):
+        url = reverse("shopapp:products_list")
+        response = self.client.get(url, {"page": 2})
+        self.assertEqual(len(response.context["products"]), 10)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url, {"page": 2}), "Page 2 of 2")
+        Product.objects.create(name="Fresh product", created_by=self.user)
+        self.assertContains(self.client.get(url), "Fresh product")
+
+    def test_admin_archiving_invalidates_pages(self):
+        self.assertContains(self.client.get(reverse("shopapp:products_list")), "Product 59")
+        self.client.force_login(self.user)
+        self.client.post(reverse("admin:shopapp_product_changelist"), {
+            "action": "mark_archived",
+            "_selected_action": Product.objects.filter(name="Product 59").values_list("pk", flat=True),
+        })
+        self.assertNotContains(self.client.get(reverse("shopapp:products_list")), "Product 59")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OrderFragmentCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.first, self.second = (
+            Product.objects.create(name=name, created_by=self.user) for name in ("First", "Second")
+        )
+        for product in (self.first, self.second):
+            Order.objects.create(user=self.user, delivery_address="Test address").products.add(product)
+
+    def test_changed_order_is_rendered_alone(self):
+        url = reverse("shopapp:orders_list")
+        self.client.get(url)
+        # Orders and their product ids only: the list and every order fragment come from the cache.
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        # The price lookup and the update: one version bump, however many orders show the product.
+        with self.assertNumQueries(2):
+            self.second.name = "Renamed"
+            self.second.save()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, "Renamed")
+        self.assertContains(response, "First")
+        self.assertEqual(len(queries), 3)
+        self.assertIn(f"IN ({self.second.orders.get().pk})", queries[2]["sql"])
+
+    def test_renamed_user_is_shown(self):
+        url = reverse("shopapp:orders_list")
+        self.client.get(url)
+        self.user.first_name = "Renamed"
+        self.user.save()
+        self.assertContains(self.client.get(url), "User: Renamed", count=2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalGetTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.product = Product.objects.create(name="Table", created_by=self.user)
+
+    def assertRevalidates(self, url: str):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+        # One metadata query at most: no template or serializer runs.
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertLessEqual(len(queries), 1)
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+        return response["ETag"]
+
+    def test_product_endpoints(self):
+        urls = [
+            reverse("shopapp:product_details", kwargs={"pk": self.product.pk}),
+            reverse("shopapp:product-detail", kwargs={"pk": self.product.pk}),
+            reverse("shopapp:product-list"),
+            reverse("shopapp:products_feed"),
+            "/sitemap.xml",
+        ]
+        etags = {url: self.assertRevalidates(url) for url in urls}
+        self.product.name = "Chair"
+        self.product.save()
+        for url, etag in etags.items():
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_deleted_products_change_catalogue_etag(self):
+        url = reverse("shopapp:product-list")
+        chair = Product.objects.create(name="Chair", created_by=self.user)
+        response = self.client.get(url)
+        # Last-Modified has whole seconds: delete in a later one.
+        later = datetime.now(timezone.utc) + timedelta(seconds=2)
+        with patch("shopapp.signals.timezone.now", return_value=later):
+            chair.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 200)
+
+
+class OrderViewSetTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+        "order-fixture.json",
+    ]
+
+    def test_list_does_not_query_per_order(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("shopapp:order-list"))
+        self.assertEqual(response.json()["results"][0]["products"], [5, 9])
+
+    def test_expand_products(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("shopapp:order-list"), {"expand": "products"})
+        products = response.json()["results"][0]["products"]
+        self.assertEqual([product["pk"] for product in products], [5, 9])
+        self.assertIn("price", products[0])
+
+
+class OrderTotalsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.table = Product.objects.create(name="Table", price="100.00", discount=10, created_by=self.user)
+        self.chair = Product.objects.create(name="Chair", price="19.99", discount=0, created_by=self.user)
+        self.order = Order.objects.create(user=self.user, delivery_address="Test address")
+        self.order.products.add(self.table, self.chair)
+
+    def assertTotals(self, items_count: int, total: str, discounted_total: str, order: Order = None):
+        order = Order.objects.get(pk=(order or self.order).pk)
+        self.assertEqual(
+            (order.items_count, order.total, order.discounted_total),
+            (items_count, Decimal(total), Decimal(discounted_total)),
+        )
+
+    def test_follow_order_products(self):
+        self.assertTotals(2, "119.99", "109.99")
+        self.order.products.remove(self.table)
+        self.assertTotals(1, "19.99", "19.99")
+        self.table.orders.add(self.order)
+        self.assertTotals(2, "119.99", "109.99")
+        self.chair.orders.remove(self.order, Order.objects.create(user=self.user))
+        self.assertTotals(1, "100.00", "90.00")
+
+    def test_follow_product_changes(self):
+        other = Order.objects.create(user=self.user)
+        other.products.add(self.table)
+        self.table.price, self.table.discount = Decimal("50.00"), 50
+        self.table.save()
+        self.assertTotals(2, "69.99", "44.99")
+        self.assertTotals(1, "50.00", "25.00", other)
+        self.chair.delete()
+        self.assertTotals(1, "50.00", "25.00")
+
+    def test_reconcile_fixes_drift(self):
+        Product.objects.filter(pk=self.chair.pk).update(price=Decimal("29.99"))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("reconcile_order_totals", "--check", stdout=out)
+        self.assertIn(f"Order #{self.order.pk}", out.getvalue())
+        versions = get_version(ORDER_NAMESPACE, self.order.pk), get_version(ORDERS_NAMESPACE, self.user.pk)
+        call_command("reconcile_order_totals", stdout=StringIO())
+        self.assertTotals(2, "129.99", "119.99")
+        # The cached fragments showed the drifted totals.
+        self.assertNotEqual((get_version(ORDER_NAMESPACE, self.order.pk), get_version(ORDERS_NAMESPACE, self.user.pk)), versions)
+        call_command("reconcile_order_totals", "--check", stdout=StringIO())
+
+    def test_api_filters_and_orders_by_total(self):
+        Order.objects.create(user=self.user).products.add(self.chair)
+        response = self.client.get(reverse("shopapp:order-list"), {"ordering": "-total", "total__lte": "200"})
+        self.assertEqual([order["total"] for order in response.json()["results"]], ["119.99", "19.99"])
+
+
+class SalesRollupsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.table = Product.objects.create(name="Table", price="100.00", discount=10, created_by=self.user)
+        self.chair = Product.objects.create(name="Chair", price="19.99", discount=0, created_by=self.user)
+        self.order = Order.objects.create(user=self.user, promocode="sale", delivery_address="Test address")
+        self.order.products.add(self.table, self.chair)
+
+    def rollups(self) -> tuple:
+        return (
+            sorted(ProductDailySales.objects.filter(units__gt=0).values_list("product", "day", "units", "revenue")),
+            sorted(PromocodeDailyOrders.objects.filter(orders__gt=0).values_list("promocode", "day", "orders")),
+            sorted(UserMonthlyOrders.objects.filter(orders__gt=0).values_list("user", "month", "orders")),
+        )
+
+    def test_follow_orders_and_products(self):
+        day = self.order.created_at.date()
+        other = Order.objects.create(user=self.user)
+        other.products.add(self.table)
+        self.order.products.remove(self.chair)
+        self.table.discount = 50
+        self.table.save()
+        sales, promocodes, months = self.rollups()
+        self.assertEqual(sales, [(self.table.pk, day, 2, Decimal("100.00"))])
+        self.assertEqual(promocodes, [("", day, 1), ("sale", day, 1)])
+        self.assertEqual(months, [(self.user.pk, day.replace(day=1), 2)])
+        other.delete()
+        self.order.promocode = "spring"
+        self.order.save()
+        sales, promocodes, months = self.rollups()
+        self.assertEqual(sales, [(self.table.pk, day, 1, Decimal("50.00"))])
+        self.assertEqual(promocodes, [("spring", day, 1)])
+        self.assertEqual(months, [(self.user.pk, day.replace(day=1), 1)])
+
+    def test_backfill_matches_increments(self):
+        call_command("generate_shop_data", users=5, products=10, orders=100, batch_size=50, stdout=StringIO())
+        self.order.products.add(Product.objects.last())
+        incremental = self.rollups()
+        ProductDailySales.objects.all().delete()
+        PromocodeDailyOrders.objects.all().delete()
+        out = StringIO()
+        call_command("backfill_sales_rollups", stdout=out)
+        self.assertIn("Rebuilt", out.getvalue())
+        self.assertEqual(self.rollups(), incremental)
+        with self.assertRaises(CommandError):
+            call_command("backfill_sales_rollups", since="last month", stdout=StringIO())
+
+    def test_analytics_api_is_for_staff(self):
+        url = reverse("shopapp:productdailysales-list")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_superuser(username="Admin", password="qwerty"))
+        response = self.client.get(url, {"product": self.table.pk})
+        self.assertEqual([row["revenue"] for row in response.json()["results"]], ["90.00"])
+        response = self.client.get(reverse("shopapp:promocodedailyorders-list"), {"promocode": "sale"})
+        self.assertEqual(response.json()["results"][0]["orders"], 1)
+        response = self.client.get(reverse("shopapp:usermonthlyorders-list"), {"user": self.user.pk})
+        self.assertEqual(response.json()["results"][0]["orders"], 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+    ]
+
+    def walk(self, params: dict) -> list:
+        response = self.client.get(reverse("shopapp:product-list"), {"pagination": "cursor", **params})
+        pks = []
+        # More pages than products means the cursor stopped moving forward.
+        for _ in range(Product.objects.count() + 1):
+            data = response.json()
+            pks.extend(product["pk"] for product in data["results"])
+            if data["next"] is None:
+                return pks
+            response = self.client.get(data["next"])
+        self.fail(f"The cursor never reached the end: {pks}")
+
+    def test_walks_every_product_once(self):
+        pks = self.walk({"page_size": 2})
+        self.assertEqual(sorted(pks), sorted(Product.objects.values_list("pk", flat=True)))
+
+    def test_cursor_keeps_microseconds(self):
+        Product.objects.all().delete()
+        user = User.objects.create_user(username="Tester", password="qwerty")
+        # Created back to back, so auto_now_add stamps them within the same millisecond or so.
+        created = [Product.objects.create(name=f"Product {index}", created_by=user).pk for index in range(8)]
+        self.assertEqual(self.walk({"page_size": 1}), created)
+
+    def test_follows_ordering_filter(self):
+        pks = self.walk({"page_size": 3, "ordering": "-price"})
+        expected = list(Product.objects.order_by("-price", "pk").values_list("pk", flat=True))
+        self.assertEqual(pks, expected)
+
+    def test_count_modes(self):
+        url = reverse("shopapp:product-list")
+        response = self.client.get(url, {"pagination": "cursor", "count": "exact"})
+        self.assertEqual(response.json()["count"], Product.objects.count())
+        response = self.client.get(url, {"pagination": "cursor", "count": "estimated"})
+        self.assertGreaterEqual(response.json()["count"], Product.objects.count())
+        response = self.client.get(url, {"pagination": "cursor", "count": "estimated", "search": "Desktop"})
+        self.assertEqual(response.json()["count"], len(self.walk({"search": "Desktop"})))
+        self.assertLess(response.json()["count"], Product.objects.count())
+        response = self.client.get(url, {"pagination": "cursor"})
+        self.assertNotIn("count", response.json())
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTestCase(TestCase):
+    """
+    Hot queries must be answered from an index: no full table scans, no sorting.
+    """
+    full_scan = re.compile(r"\bSCAN (?!.*\bUSING\b.*\bINDEX\b)|USE TEMP B-TREE")
+
+    def hot_queries(self):
+        day = datetime(2023, 5, 12, tzinfo=timezone.utc)
+        return {
+            "products list": ProductsListView.queryset,
+            "products feed": LatestProductsFeed().items(),
+            "sitemap": ShopSitemap().items(),
+            "products api keyset": Product.objects.order_by("created_at", "pk")[:10],
+            "orders api keyset": Order.objects.order_by("created_at", "pk")[:10],
+            "orders by user": Order.objects.filter(user_id=1).order_by("created_at"),
+            "orders by user and date": Order.objects.filter(user_id=1, created_at=day),
+            "orders by promocode": Order.objects.filter(promocode="sale20").order_by("created_at"),
+            "orders by total": Order.objects.filter(total__gte=100).order_by("-total"),
+            "user orders export": Order.objects.filter(user_id=1).order_by("pk").values("pk"),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIsNone(self.full_scan.search(plan), f"{name} is not indexed:\n{plan}")
+
+
+@skipUnless(connection.vendor == "sqlite", "the full-text index is SQLite specific")
+class ProductSearchTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+    ]
+
+    def search(self, term: str) -> list:
+        response = self.client.get(reverse("shopapp:product-list"), {"search": term})
+        return [product["pk"] for product in response.json()["results"]]
+
+    def test_matches_word_prefixes_in_any_field(self):
+        self.assertEqual(set(self.search("desk")), {4, 12})
+        self.assertEqual(set(self.search("pc")), {2, 7})
+        self.assertEqual(self.search("sasa desktop"), [12])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search("user product")[0], 13)
+        self.assertEqual(self.search("pc")[0], 2)
+
+    def test_cursor_pages_follow_rank(self):
+        ranked = self.search("desc")
+        self.assertGreater(len(ranked), 1)
+        url = reverse("shopapp:product-list")
+        response = self.client.get(url, {"search": "desc", "pagination": "cursor", "page_size": 1})
+        pks = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pks.extend(product["pk"] for product in data["results"])
+            if data["next"] is None or len(pks) > len(ranked):
+                break
+            response = self.client.get(data["next"])
+        self.assertEqual(pks, ranked)
+
+    def test_index_follows_product_changes(self):
+        product = Product.objects.get(pk=8)
+        product.name = "Rotary phone"
+        product.save()
+        self.assertEqual(self.search("rotary"), [8])
+        self.assertEqual(self.search("telephone"), [])
+        product.delete()
+        self.assertEqual(self.search("rotary"), [])
+
+
+class OrderCSVImportTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+    ]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_superuser(username="Tester", password="qwerty")
+        self.client.force_login(self.user)
+
+    def test_import_reports_rejected_rows(self):
+        csv_file = SimpleUploadedFile("orders.csv", (
+            "delivery_address,promocode,products\n"
+            "Lenina 5,sale,3 4\n"
+            "Lenina 6,,5\n"
+            "Lenina 7,,3 999\n"
+            "Lenina 8,,three\n"
+        ).encode())
+        # Session and user, one product lookup for the chunk, then a transaction with two inserts
+        # and, per rollup table, a read of the existing rows and an insert in a savepoint.
+        with self.assertNumQueries(19):
+            response = self.client.post(reverse("admin:import-orders-csv"), {"csv_file": csv_file})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(reverse("admin:shopapp_order_changelist"))
+        messages = [str(message) for message in response.context["messages"]]
+        self.assertIn("Imported 2 of 4 rows", messages[0])
+        self.assertIn("Line 4: unknown products [999]", messages)
+        self.assertTrue(messages[2].startswith("Line 5: products must be space separated ids"))
+        orders = Order.objects.filter(user=self.user).order_by("pk")
+        self.assertEqual([list(order.products.values_list("pk", flat=True)) for order in orders], [[3, 4], [5]])
+
+
+class GenerateShopDataTestCase(TestCase):
+    def test_generates_linked_data(self):
+        call_command(
+            "generate_shop_data", users=20, products=50, orders=300, batch_size=100, stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith="shopper", profile__isnull=False).count(), 20)
+        self.assertEqual(Product.objects.count(), 50)
+        orders = Order.objects.annotate(product_count=Count("products"))
+        self.assertEqual(orders.count(), 300)
+        self.assertFalse(orders.filter(product_count=0).exists())
+        self.assertFalse(orders.exclude(items_count=F("product_count")).exists())
+        # Dates are spread over the past instead of all being "now".
+        self.assertGreater(Order.objects.dates("created_at", "month").count(), 1)
+        self.assertGreater(Product.objects.dates("created_at", "month").count(), 1)
+        self.assertFalse(Order.objects.filter(products__archived=True).exists())
+        # The models still stamp their own dates.
+        product = Product.objects.create(name="Fresh product", created_by=User.objects.first())
+        self.assertLess(datetime.now(timezone.utc) - product.created_at, timedelta(minutes=1))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "shopapp.instrumentation.InstrumentedLocMemCache"}},
+    SHOP_INSTRUMENTATION={**settings.SHOP_INSTRUMENTATION, "LOG": True},
+)
+class PerformanceMiddlewareTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_reports_server_timing_and_log_line(self):
+        with self.assertLogs("shopapp.performance", "INFO") as logs:
+            response = self.client.get(reverse("shopapp:products_list"))
+        timing = dict(
+            metric.split(";", 1) for metric in response["Server-Timing"].split(", ")
+        )
+        self.assertEqual(set(timing), {"db", "cache", "tpl", "view", "total"})
+        self.assertIn('desc="1 queries"', timing["db"])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["route"], "shopapp:products_list")
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["db_queries"], 1)
+        self.assertGreater(record["template_ms"], 0)
+
+    def test_counts_cache_hits_and_misses(self):
+        user = User.objects.create_user(username="Tester", password="qwerty")
+        self.client.force_login(user)
+        url = reverse("shopapp:user_orders_export", kwargs={"user_id": user.pk})
+        with self.assertLogs("shopapp.performance", "INFO") as logs:
+            self.client.get(url)
+            self.client.get(url)
+        first, second = (json.loads(record.getMessage()) for record in logs.records)
+        self.assertGreater(first["cache_misses"], second["cache_misses"])
+        self.assertGreater(second["cache_hits"], first["cache_hits"])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SHOP_THROTTLING={**settings.SHOP_THROTTLING, "BACKEND": "cache"},
+    SHOP_TRACE_SAMPLING={
+        "DEFAULT_RATE": 1.0,
+        "ROUTES": {"/shop/api/": 0.0},
+        "SLOW_REQUEST_SECONDS": 1.0,
+        "BOOST_SECONDS": 60,
+        "TRACES_PER_SECOND": 0.001,
+        "BURST": 3,
+    },
+)
+class TraceSamplingTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+    @staticmethod
+    def sample(path: str, **context) -> float:
+        return traces_sampler({"wsgi_environ": {"PATH_INFO": path}, **context})
+
+    def test_route_rates_ignore_language_prefix(self):
+        self.assertEqual(self.sample("/en/shop/api/products/"), 0.0)
+        self.assertEqual(self.sample("/ru/shop/products/"), 1.0)
+
+    def test_parent_decision_is_kept(self):
+        self.assertEqual(self.sample("/en/shop/api/products/", parent_sampled=True), 1.0)
+        self.assertEqual(self.sample("/en/shop/products/", parent_sampled=False), 0.0)
+
+    def test_budget_caps_traces(self):
+        decisions = [self.sample("/en/shop/products/") for _ in range(5)]
+        self.assertEqual(decisions, [1.0, 1.0, 1.0, 0.0, 0.0])
+
+    def test_slow_and_failing_routes_are_boosted(self):
+        policy = get_policy()
+        policy.note_request("/en/shop/api/products/5/", 0.1, 200)
+        self.assertEqual(self.sample("/en/shop/api/products/7/"), 0.0)
+        policy.note_request("/en/shop/api/products/5/", 2.5, 200)
+        self.assertEqual(self.sample("/ru/shop/api/products/7/"), 1.0)
+        self.assertEqual(self.sample("/en/shop/api/orders/"), 0.0)
+        policy.note_request("/en/shop/api/orders/", 0.1, 500)
+        self.assertEqual(self.sample("/en/shop/api/orders/"), 1.0)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite pragmas")
+class SQLitePragmasTestCase(TestCase):
+    def test_connections_get_configured_pragmas(self):
+        # The test database lives in memory, where journal_mode and mmap_size do not apply.
+        with connection.cursor() as cursor:
+            for name in ("synchronous", "cache_size", "busy_timeout"):
+                cursor.execute(f"PRAGMA {name}")
+                value = cursor.fetchone()[0]
+                expected = settings.SHOP_SQLITE_PRAGMAS[name]
+                self.assertEqual(value, 1 if expected == "NORMAL" else expected, name)
+
+
+REPLICAS = {"ALIASES": ["replica"], "PIN_SECONDS": 5, "MAX_LAG_SECONDS": 10,
+            "CHECK_INTERVAL": 5, "COOKIE_NAME": "db_pin"}
+
+
+@override_settings(SHOP_REPLICAS=REPLICAS)
+class ReplicaRouterTestCase(TestCase):
+    def setUp(self) -> None:
+        self.router = ReplicaRouter()
+        self.router.health["replica"] = (True, float("inf"))
+
+    def read_in_request(self, state: ReplicaState) -> str:
+        token = current_state.set(state)
+        try:
+            return self.router.db_for_read(Product)
+        finally:
+            current_state.reset(token)
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_request_reads_use_healthy_replica(self):
+        self.assertEqual(self.read_in_request(ReplicaState()), "replica")
+        self.router.mark_unavailable("replica")
+        self.assertEqual(self.read_in_request(ReplicaState()), "default")
+
+    def test_writes_pin_request_to_primary(self):
+        state = ReplicaState()
+        token = current_state.set(state)
+        try:
+            self.assertEqual(self.router.db_for_write(Order), "default")
+        finally:
+            current_state.reset(token)
+        self.assertTrue(state.pinned)
+        self.assertEqual(self.read_in_request(state), "default")
+
+    def test_missing_primary_heartbeat_is_unhealthy(self):
+        self.assertEqual(replica_lag("default"), float("inf"))
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "shopapp"))
+        self.assertTrue(self.router.allow_migrate("default", "shopapp"))
+
+
+@override_settings(SHOP_REPLICAS=REPLICAS)
+class ReplicaPinningMiddlewareTestCase(TestCase):
+    def test_unsafe_requests_set_pin_cookie(self):
+        response = self.client.get(reverse("myauth:login"))
+        self.assertNotIn("db_pin", response.cookies)
+        response = self.client.post(reverse("myauth:login"), {"username": "nobody", "password": "wrong"})
+        self.assertIn("db_pin", response.cookies)
+        # PIN_SECONDS is 5, but a pin must outlast the maximum replica lag.
+        self.assertEqual(response.cookies["db_pin"]["max-age"], 10)
+
+    def test_failed_replica_reads_run_again_on_primary(self):
+        middleware = ReplicaPinningMiddleware(lambda request: None)
+        request = RequestFactory().get(reverse("shopapp:products_list"))
+        request.user = User.objects.create_user(username="Tester", password="qwerty")
+        request.resolver_match = resolve(request.path)
+        state = ReplicaState(replica_failed=True)
+        token = current_state.set(state)
+        try:
+            response = middleware.process_exception(request, DatabaseError("disk I/O error"))
+        finally:
+            current_state.reset(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(state.pinned)
+        self.assertIsNone(middleware.process_exception(request, DatabaseError("disk I/O error")))
+
+
+class UploadsTestCase(TestCase):
+    def setUp(self) -> None:
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(SHOP_UPLOADS={
+            "ROOT": Path(root), "URL": "/media/blobs/", "MAX_SIZE": 1000, "ANONYMOUS_MAX_SIZE": 100,
+            "CHUNK_SIZE": 400, "SESSION_TTL": 60,
+        }))
+        self.root = Path(root)
+        self.user = User.objects.create_user(username="Tester", password="qwerty")
+        self.client.force_login(self.user)
+
+    def test_identical_files_are_stored_once(self):
+        content = b"same bytes" * 10
+        for name in ("first.txt", "second.txt"):
+            response = self.client.post(reverse("shopapp:file_upload"), {"myfile": SimpleUploadedFile(name, content)})
+            self.assertEqual(response.status_code, 200)
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.assertTrue(response.context["deduplicated"])
+        self.assertEqual(Blob.objects.get().sha256, sha256)
+        self.assertEqual(sorted(Upload.objects.values_list("name", flat=True)), ["first.txt", "second.txt"])
+        self.assertEqual((self.root / Blob.objects.get().path).read_bytes(), content)
+        self.assertEqual(list((self.root / "tmp").iterdir()), [])
+
+    def test_too_large_files_are_rejected_while_streaming(self):
+        response = self.client.post(reverse("shopapp:file_upload"), {"myfile": SimpleUploadedFile("big", b"x" * 1001)})
+        self.assertTrue(response.context["big_file"])
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(list((self.root / "tmp").iterdir()), [])
+
+    def test_anonymous_uploads_get_a_small_limit(self):
+        self.client.logout()
+        response = self.client.post(reverse("shopapp:file_upload"), {"myfile": SimpleUploadedFile("big", b"x" * 101)})
+        self.assertTrue(response.context["big_file"])
+        self.assertEqual(response.context["max_size"], 100)
+        self.assertFalse(Blob.objects.exists())
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("shopapp:file_upload"), {"myfile": SimpleUploadedFile("big", b"x" * 101)})
+        self.assertFalse(response.context["big_file"])
+        self.assertEqual(Blob.objects.get().size, 101)
+
+    def put_chunk(self, url: str, content: bytes, start: int, size: int):
+        return self.client.put(
+            url, content, content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(content) - 1}/{size}",
+        )
+
+    def test_resumable_upload(self):
+        content = bytes(range(256)) * 3
+        response = self.client.post(
+            reverse("shopapp:upload_sessions"), {"name": "data.bin", "size": len(content)}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        url = response["Location"]
+        self.assertEqual(self.put_chunk(url, content[:400], 0, len(content)).json()["offset"], 400)
+        # A retried or out of order chunk gets the offset to resume from.
+        response = self.put_chunk(url, content[600:], 600, len(content))
+        self.assertEqual((response.status_code, response.json()["offset"]), (409, 400))
+        self.assertEqual(self.client.get(url).json()["offset"], 400)
+        response = self.put_chunk(url, content[400:], 400, len(content))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["sha256"], hashlib.sha256(content).hexdigest())
+        self.assertEqual((self.root / Blob.objects.get().path).read_bytes(), content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_resumable_upload_limits(self):
+        url = reverse("shopapp:upload_sessions")
+        response = self.client.post(url, {"name": "big", "size": 1001}, content_type="application/json")
+        self.assertEqual(response.status_code, 413)
+        session_url = self.client.post(url, {"name": "data", "size": 900}, content_type="application/json")["Location"]
+        self.assertEqual(self.put_chunk(session_url, b"x" * 401, 0, 900).status_code, 413)
+        self.assertEqual(self.put_chunk(session_url, b"x" * 10, 0, 1000).status_code, 416)
+        UploadSession.objects.update(updated_at=datetime.now(timezone.utc) - timedelta(minutes=5))
+        call_command("purge_upload_sessions", stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(list((self.root / "partial").iterdir()), [])
+
+
+class JobsTestCase(TestCase):
+    fixtures = [
+        "user-fixture.json",
+        "products-fixture.json",
+        "order-fixture.json",
+    ]
+
+    def setUp(self) -> None:
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(SHOP_JOBS={
+            "ROOT": Path(root), "LEASE_SECONDS": 60, "RETRY_DELAY": 30, "POLL_SECONDS": 0,
+            "INLINE_IMPORT_MAX_SIZE": 10, "RESULT_TTL": 60,
+        }))
+        self.user = User.objects.create_superuser(username="Tester", password="qwerty")
+        self.client.force_login(self.user)
+
+    def run_workers(self):
+        call_command("run_workers", "--once", stdout=StringIO())
+
+    def test_export_is_submitted_polled_and_downloaded(self):
+        response = self.client.post(reverse("shopapp:order_export") + "?format=ndjson")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], Job.QUEUED)
+        status_url = response.headers["Location"]
+        self.run_workers()
+        data = self.client.get(status_url).json()
+        self.assertEqual(data["status"], Job.DONE)
+        orders = Order.objects.count()
+        self.assertEqual(data["progress"], {"done": orders, "total": orders})
+        self.assertEqual(data["result"], {"orders": orders, "format": "ndjson"})
+        response = self.client.get(data["download_url"])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), orders)
+        self.assertEqual(sorted(json.loads(line)["pk"] for line in lines), sorted(Order.objects.values_list("pk", flat=True)))
+        result = Path(settings.SHOP_JOBS["ROOT"]) / Job.objects.get().result_file
+        call_command("purge_jobs", stdout=StringIO())
+        self.assertTrue(result.exists())
+        Job.objects.update(finished_at=datetime.now(timezone.utc) - timedelta(minutes=5))
+        call_command("purge_jobs", stdout=StringIO())
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(result.exists())
+
+    def test_jobs_of_other_users_are_hidden(self):
+        job = submit("export_orders", {"format": "json"}, self.user)
+        other = User.objects.create_user(username="Other", password="qwerty")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse("shopapp:job", kwargs={"pk": job.pk})).status_code, 404)
+
+    def test_failed_attempts_are_retried_with_backoff(self):
+        def failing(job, context):
+            raise RuntimeError("disk full")
+
+        self.enterContext(patch.dict(TASKS, {"failing": Task(failing, max_attempts=2)}))
+        job = submit("failing")
+        with self.assertLogs("shopapp.jobs", "WARNING"):
+            self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, datetime.now(timezone.utc) + timedelta(seconds=20))
+        self.assertIn("RuntimeError: disk full", job.error)
+        Job.objects.update(run_after=datetime.now(timezone.utc))
+        with self.assertLogs("shopapp.jobs", "WARNING"):
+            self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        data = self.client.get(reverse("shopapp:job", kwargs={"pk": job.pk})).json()
+        self.assertEqual(data["error"], "RuntimeError: disk full")
+
+    def test_a_job_is_claimed_once(self):
+        job = submit("export_orders")
+        claimed = claim("first")
+        self.assertEqual((claimed.pk, claimed.claimed_by, claimed.attempts), (job.pk, "first", 1))
+        self.assertIsNone(claim("second"))
+
+    def test_expired_leases_are_claimed_again(self):
+        job = submit("export_orders")
+        claim("crashed")
+        Job.objects.update(lease_expires=datetime.now(timezone.utc) - timedelta(seconds=1))
+        claimed = claim("second")
+        self.assertEqual((claimed.pk, claimed.claimed_by, claimed.attempts), (job.pk, "second", 2))
+        Job.objects.update(lease_expires=datetime.now(timezone.utc) - timedelta(seconds=1), attempts=3)
+        self.assertIsNone(claim("third"))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_expired_leases_of_live_workers_are_left_alone(self):
+        job = submit("import_orders_csv", {"input": "uploads/orders.csv"})
+        claim(worker_id())
+        Job.objects.update(lease_expires=datetime.now(timezone.utc) - timedelta(seconds=1))
+        self.assertIsNone(claim("second"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.claimed_by, job.attempts), (Job.RUNNING, worker_id(), 1))
+
+    def test_the_heartbeat_renews_the_lease(self):
+        submit("export_orders")
+        job = claim("first")
+        Job.objects.update(lease_expires=datetime.now(timezone.utc) + timedelta(seconds=1))
+        self.assertTrue(LeaseHeartbeat(job).renew())
+        self.assertGreater(Job.objects.get().lease_expires, datetime.now(timezone.utc) + timedelta(seconds=30))
+        Job.objects.update(status=Job.QUEUED)
+        self.assertFalse(LeaseHeartbeat(job).renew())
+
+    def test_large_csv_imports_are_queued(self):
+        csv_file = SimpleUploadedFile("orders.csv", b"delivery_address,promocode,products\nQueued street 1,sale,3 4\n")
+        response = self.client.post(reverse("admin:import-orders-csv"), {"csv_file": csv_file})
+        self.assertEqual(response.status_code, 302)
+        job = Job.objects.get()
+        self.assertEqual((job.kind, job.status), ("import_orders_csv", Job.QUEUED))
+        self.assertFalse(Order.objects.filter(delivery_address="Queued street 1").exists())
+        self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.result["imported"], 1)
+        order = Order.objects.get(delivery_address="Queued street 1")
+        self.assertEqual(list(order.products.values_list("pk", flat=True)), [3, 4])
+        self.assertFalse((Path(settings.SHOP_JOBS["ROOT"]) / job.params["input"]).exists())
@@ -0,0 +1,136 @@
+"""
+Token bucket rate limiting with state shared between worker processes.
+
+Buckets are kept either in a memory-mapped file (the default: a fixed-size
+table shared by every worker on the host, so memory is bounded by design) or
+in a Django cache (for deployments spread over several hosts, where cache
+timeouts evict idle buckets).
+"""
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Optional
+
+from django.core.cache import caches
+
+BucketState = tuple[float, float]
+
+
+@dataclass(frozen=True)
+class Rate:
+    """
+    ``rate`` tokens are added per second, up to ``burst`` tokens.
+    """
+    rate: float
+    burst: int
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Rate":
+        return cls(rate=float(config["rate"]), burst=int(config["burst"]))
+
+    @property
+    def refill_time(self) -> float:
+        return self.burst / self.rate
+
+
+class CacheStore:
+    """
+    Buckets stored in a Django cache; a bucket expires once it would be full again.
+    """
+
+    def __init__(self, alias: str = "default"):
+        self.cache = caches[alias]
+
+    def get(self, key: str) -> Optional[BucketState]:
+        return self.cache.get(f"throttle:{key}")
+
+    def set(self, key: str, state: BucketState, timeout: float):
+        self.cache.set(f"throttle:{key}", state, math.ceil(timeout) + 1)
+
+
+class SharedMemoryStore:
+    """
+    Buckets stored in a fixed number of slots of a memory-mapped file.
+
+    A key is hashed to a single slot. When two keys share a slot the newer one
+    takes it over, which at worst hands the other client a fresh bucket; this is
+    how stale buckets are evicted without any bookkeeping.
+    """
+    slot = struct.Struct("=Qdd")
+
+    def __init__(self, path: Optional[str] = None, slots: int = 65536):
+        path = path or os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+            "mysite-throttling",
+        )
+        size = slots * self.slot.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.slots = slots
+
+    def _locate(self, key: str) -> tuple[int, int]:
+        digest = int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+        return digest, digest % self.slots * self.slot.size
+
+    def get(self, key: str) -> Optional[BucketState]:
+        digest, offset = self._locate(key)
+        stored, tokens, updated_at = self.slot.unpack_from(self.buffer, offset)
+        return (tokens, updated_at) if stored == digest else None
+
+    def set(self, key: str, state: BucketState, timeout: float):
+        digest, offset = self._locate(key)
+        self.slot.pack_into(self.buffer, offset, digest, *state)
+
+
+def get_store(config: dict):
+    """
+    Build the bucket store described by the ``SHOP_THROTTLING`` setting.
+    """
+    if config.get("BACKEND", "shared_memory") == "cache":
+        return CacheStore(config.get("CACHE_ALIAS", "default"))
+    return SharedMemoryStore(config.get("SHARED_MEMORY_PATH"), config.get("SHARED_MEMORY_SLOTS", 65536))
+
+
+class TokenBucket:
+    """
+    A family of buckets sharing one rate, one bucket per key.
+
+    Reading and updating a bucket is not atomic, so concurrent workers may
+    occasionally admit a request or two over the limit; the limit itself still
+    holds over any window longer than a few requests.
+    """
+
+    def __init__(self, scope: str, rate: Rate, store):
+        self.scope = scope
+        self.rate = rate
+        self.store = store
+
+    def consume(self, key: str, tokens: float = 1) -> float:
+        """
+        Take ``tokens`` from the bucket for ``key``.
+
+        Returns 0 when the tokens were taken, otherwise the number of seconds
+        until enough tokens are available.
+        """
+        bucket_key = f"{self.scope}:{key}"
+        now = time.time()
+        state = self.store.get(bucket_key)
+        if state is None:
+            available = self.rate.burst
+        else:
+            available, updated_at = state
+            available = min(self.rate.burst, available + max(0.0, now - updated_at) * self.rate.rate)
+        if available < tokens:
+            return (tokens - available) / self.rate.rate
+        self.store.set(bucket_key, (available - tokens, now), self.rate.refill_time)
+        return 0
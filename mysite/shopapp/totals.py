@@ -0,0 +1,148 @@
+"""
+Stored order totals.
+
+``Order.items_count``, ``total`` and ``discounted_total`` follow the products
+of the order, so nothing has to join and sum products to show an order's value:
+
+- adding or removing products of an order recomputes that order from its
+  few products;
+- linking or unlinking a product from the product side, changing its price
+  or discount and deleting it shift every order holding the product by the
+  difference, with a single UPDATE.
+
+Writes that send no signal (``QuerySet.update``, ``bulk_create``, raw SQL)
+leave the totals behind; ``reconcile_totals`` recomputes them in bulk and
+reports the orders that drifted.
+"""
+from dataclasses import asdict, dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import islice
+from typing import Iterable, Optional
+
+from django.db.models import F, QuerySet
+
+from .models import Order, Product
+
+CENT = Decimal("0.01")
+
+
+def money(value) -> Decimal:
+    # Through str so that a float price set on an unsaved instance stays exact.
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def discounted_price(price, discount: int) -> Decimal:
+    """
+    The price after a ``discount`` percent, rounded to the cent like every stored amount.
+    """
+    return money(money(price) * (100 - int(discount)) / 100)
+
+
+@dataclass
+class Totals:
+    items_count: int = 0
+    total: Decimal = Decimal("0.00")
+    discounted_total: Decimal = Decimal("0.00")
+
+    @classmethod
+    def of(cls, products: Iterable[tuple[Decimal, int]]) -> "Totals":
+        """
+        Totals of ``(price, discount)`` pairs.
+        """
+        totals = cls()
+        for price, discount in products:
+            totals.items_count += 1
+            totals.total += money(price)
+            totals.discounted_total += discounted_price(price, discount)
+        totals.total = totals.total.quantize(CENT)
+        totals.discounted_total = totals.discounted_total.quantize(CENT)
+        return totals
+
+
+def recompute_order(order_id: int):
+    totals = Totals.of(Product.objects.filter(orders=order_id).values_list("price", "discount"))
+    Order.objects.filter(pk=order_id).update(**asdict(totals))
+
+
+def shift_orders(order_ids, items_count: int, total: Decimal, discounted_total: Decimal):
+    """
+    Add the given amounts to the totals of ``order_ids``, a list or a subquery.
+    """
+    if not items_count and not total and not discounted_total:
+        return
+    Order.objects.filter(pk__in=order_ids).update(
+        items_count=F("items_count") + items_count,
+        total=F("total") + total,
+        discounted_total=F("discounted_total") + discounted_total,
+    )
+
+
+def shift_product_orders(product: Product, order_ids, sign: int):
+    """
+    Add (``sign=1``) or take away (``sign=-1``) ``product`` in the totals of ``order_ids``.
+    """
+    shift_orders(
+        order_ids, sign, sign * money(product.price), sign * discounted_price(product.price, product.discount),
+    )
+
+
+def orders_of_product(product_id: int) -> QuerySet:
+    return Order.products.through.objects.filter(product_id=product_id).values("order_id")
+
+
+@dataclass
+class ReconcileReport:
+    checked: int = 0
+    drifted: int = 0
+    # (order id, stored totals, actual totals) of the first drifted orders.
+    samples: list[tuple[int, Totals, Totals]] = field(default_factory=list)
+
+
+def reconcile_totals(
+    queryset: Optional[QuerySet] = None,
+    fix: bool = True,
+    batch_size: int = 2000,
+    samples: int = 20,
+) -> ReconcileReport:
+    """
+    Recompute the totals of ``queryset`` (all orders by default) batch by batch.
+
+    Every batch costs two reads, its orders and their products, plus one
+    ``bulk_update`` of the drifted orders when ``fix`` is set. ``bulk_update``
+    sends no signals, so the cached fragments of the fixed orders and their
+    users' lists are invalidated here.
+    """
+    # signals.py imports this module.
+    from .signals import bump_order_rows
+
+    queryset = Order.objects.all() if queryset is None else queryset
+    report = ReconcileReport()
+    rows = (
+        queryset.order_by("pk")
+        .values_list("pk", "user_id", "items_count", "total", "discounted_total")
+        .iterator(chunk_size=batch_size)
+    )
+    while batch := list(islice(rows, batch_size)):
+        stored = {pk: Totals(items_count, total, discounted_total) for pk, _, items_count, total, discounted_total in batch}
+        users = {pk: user_id for pk, user_id, *_ in batch}
+        products = {pk: [] for pk in stored}
+        links = (
+            Order.products.through.objects
+            .filter(order_id__in=stored.keys())
+            .values_list("order_id", "product__price", "product__discount")
+        )
+        for order_id, price, discount in links:
+            products[order_id].append((price, discount))
+        drifted = []
+        for pk, totals in stored.items():
+            actual = Totals.of(products[pk])
+            if actual != totals:
+                drifted.append(Order(pk=pk, **asdict(actual)))
+                if len(report.samples) < samples:
+                    report.samples.append((pk, totals, actual))
+        report.checked += len(stored)
+        report.drifted += len(drifted)
+        if fix and drifted:
+            Order.objects.bulk_update(drifted, ["items_count", "total", "discounted_total"])
+            bump_order_rows((order.pk, users[order.pk]) for order in drifted)
+    return report
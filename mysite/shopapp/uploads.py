@@ -0,0 +1,276 @@
+"""
+File uploads.
+
+Every upload is hashed while it streams to disk and stored once per content:
+
+- form uploads go through ``HashingFileUploadHandler``, which writes each file
+  straight to a temporary file next to the blobs, never to memory, updates
+  its SHA-256 chunk by chunk and stops reading once ``MAX_SIZE`` is passed;
+- resumable uploads send the file as ``PUT`` requests of at most
+  ``CHUNK_SIZE`` bytes with a ``Content-Range`` each, appended to a partial
+  file; a client that lost its connection asks for the offset and resumes;
+- a finished file is moved to ``ROOT/<sha[:2]>/<sha[2:4]>/<sha>`` with a
+  rename unless that content is already there, so identical files take the
+  disk space of one. ``Upload`` rows keep the names users gave them.
+
+Blobs are never overwritten, so they can be served with far-future caching.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Blob, Upload, UploadSession
+
+READ_SIZE = 64 * 1024
+# Running hashes of the resumable uploads this process is receiving.
+HASHERS_LIMIT = 256
+_hashers: dict = {}
+
+
+class UploadRejected(Exception):
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def root() -> Path:
+    return Path(settings.SHOP_UPLOADS["ROOT"])
+
+
+def work_dir(name: str) -> Path:
+    # Under ROOT, so that finished files are renamed into place, not copied.
+    path = root() / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def blob_storage() -> FileSystemStorage:
+    return FileSystemStorage(location=root(), base_url=settings.SHOP_UPLOADS["URL"])
+
+
+class HashedUploadedFile(UploadedFile):
+    """
+    An uploaded file in a temporary file under ROOT, with its SHA-256.
+    """
+
+    def __init__(self, name, content_type, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix=".upload", dir=work_dir("tmp"))
+        super().__init__(file, name, content_type, 0, charset, content_type_extra)
+        self.hasher = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self.hasher.hexdigest()
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # Renamed into the blob store.
+            pass
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """
+    Stream multipart files to ``HashedUploadedFile``; set ``too_large`` and stop past ``max_size``.
+
+    Replaces the default handlers, so must be installed before ``request.POST``
+    or ``request.FILES`` is read, CSRF checks included.
+    """
+
+    def __init__(self, request=None, max_size: Optional[int] = None):
+        super().__init__(request)
+        self.max_size = settings.SHOP_UPLOADS["MAX_SIZE"] if max_size is None else max_size
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.too_large = True
+            self.file.close()
+            raise StopUpload(connection_reset=True)
+        self.file.write(raw_data)
+        self.file.hasher.update(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+
+def store_blob(path, sha256: str, size: int) -> tuple[Blob, bool]:
+    """
+    Move the file at ``path`` into the store under ``sha256``, unless it is there already.
+
+    Returns the blob and whether it is new; a duplicate is left at ``path``.
+    """
+    blob = Blob(sha256=sha256, size=size)
+    target = root() / blob.path
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic: readers never see a partial blob, and a concurrent upload of
+        # the same content just replaces it with identical bytes.
+        os.replace(path, target)
+    blob, created = Blob.objects.get_or_create(sha256=sha256, defaults={"size": size})
+    return blob, created
+
+
+def save_upload(file: HashedUploadedFile, user: Optional[User]) -> tuple[Upload, bool]:
+    blob, created = store_blob(file.temporary_file_path(), file.sha256, file.size)
+    upload = Upload.objects.create(name=os.path.basename(file.name)[:255], blob=blob, uploaded_by=user)
+    return upload, created
+
+
+def form_max_size(user: Optional[User]) -> int:
+    """
+    The size limit of a form upload: anonymous uploads are kept forever, so they get a small one.
+    """
+    if user is not None and user.is_authenticated:
+        return settings.SHOP_UPLOADS["MAX_SIZE"]
+    return settings.SHOP_UPLOADS["ANONYMOUS_MAX_SIZE"]
+
+
+def upload_url(upload: Upload) -> str:
+    return blob_storage().url(upload.blob.path)
+
+
+# Resumable uploads.
+
+def partial_path(session: UploadSession) -> Path:
+    return work_dir("partial") / str(session.pk)
+
+
+def start_session(user: User, name: str, size: int) -> UploadSession:
+    if size < 0:
+        raise UploadRejected("size must not be negative")
+    if size > settings.SHOP_UPLOADS["MAX_SIZE"]:
+        raise UploadRejected("file too large", status=413, max_size=settings.SHOP_UPLOADS["MAX_SIZE"])
+    session = UploadSession.objects.create(user=user, name=os.path.basename(name)[:255], size=size)
+    partial_path(session).touch()
+    return session
+
+
+def session_hasher(session: UploadSession):
+    """
+    The SHA-256 of the ``received`` bytes, kept by the process that received them.
+
+    Rehashed from the partial file when another process received the last chunk.
+    """
+    cached = _hashers.get(session.pk)
+    if cached is not None and cached[0] == session.received:
+        return cached[1]
+    hasher = hashlib.sha256()
+    remaining = session.received
+    with partial_path(session).open("rb") as partial:
+        while remaining and (data := partial.read(min(READ_SIZE, remaining))):
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def remember_hasher(session: UploadSession, hasher):
+    if session.pk not in _hashers and len(_hashers) >= HASHERS_LIMIT:
+        _hashers.pop(next(iter(_hashers)))
+    _hashers[session.pk] = (session.received, hasher)
+
+
+def parse_content_range(header: str, size: int) -> tuple[int, int]:
+    """
+    ``(start, end)``, end excluded, of a ``Content-Range: bytes start-last/size`` header.
+    """
+    try:
+        unit, _, spec = header.partition(" ")
+        span, _, total = spec.partition("/")
+        first, _, last = span.partition("-")
+        start, end, total = int(first), int(last) + 1, int(total)
+    except ValueError:
+        raise UploadRejected("Content-Range must look like 'bytes 0-1023/4096'")
+    if unit != "bytes" or total != size or not 0 <= start < end <= size:
+        raise UploadRejected(f"Content-Range does not fit a file of {size} bytes", status=416)
+    return start, end
+
+
+def receive_chunk(session: UploadSession, start: int, end: int, stream: BinaryIO) -> UploadSession:
+    """
+    Append bytes ``start:end`` of the file, read from ``stream``, to the partial file of ``session``.
+
+    The chunk is streamed in ``READ_SIZE`` pieces and hashed on the way. Only
+    a chunk that starts at the received offset is accepted; one cut short,
+    e.g. by a dropped connection, is discarded and can be sent again.
+    """
+    if end - start > settings.SHOP_UPLOADS["CHUNK_SIZE"]:
+        raise UploadRejected("chunk too large", status=413, chunk_size=settings.SHOP_UPLOADS["CHUNK_SIZE"])
+    if start != session.received:
+        raise UploadRejected("chunk does not start at the received offset", status=409, offset=session.received)
+    hasher = session_hasher(session).copy()
+    remaining = end - start
+    with partial_path(session).open("r+b") as partial:
+        partial.seek(start)
+        partial.truncate()
+        while remaining and (data := stream.read(min(READ_SIZE, remaining))):
+            partial.write(data)
+            hasher.update(data)
+            remaining -= len(data)
+        if remaining:
+            partial.seek(start)
+            partial.truncate()
+            raise UploadRejected("chunk shorter than its Content-Range", offset=session.received)
+    # A concurrent request for the same chunk may have got here first.
+    if not UploadSession.objects.filter(pk=session.pk, received=start).update(
+        received=end, updated_at=timezone.now(),
+    ):
+        session.refresh_from_db()
+        raise UploadRejected("chunk does not start at the received offset", status=409, offset=session.received)
+    session.received = end
+    remember_hasher(session, hasher)
+    return session
+
+
+def finish_session(session: UploadSession) -> tuple[Upload, bool]:
+    sha256 = session_hasher(session).hexdigest()
+    path, pk = partial_path(session), session.pk
+    with transaction.atomic():
+        blob, created = store_blob(path, sha256, session.size)
+        upload = Upload.objects.create(name=session.name, blob=blob, uploaded_by_id=session.user_id)
+        session.delete()
+    # Left behind when the content was already stored.
+    path.unlink(missing_ok=True)
+    _hashers.pop(pk, None)
+    return upload, created
+
+
+def cancel_session(session: UploadSession):
+    partial_path(session).unlink(missing_ok=True)
+    _hashers.pop(session.pk, None)
+    session.delete()
+
+
+def purge_sessions(ttl: Optional[int] = None) -> int:
+    """
+    Delete the resumable uploads idle for longer than ``ttl`` seconds, ``SESSION_TTL`` by default.
+    """
+    ttl = settings.SHOP_UPLOADS["SESSION_TTL"] if ttl is None else ttl
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=ttl))
+    count = 0
+    for session in stale.iterator():
+        cancel_session(session)
+        count += 1
+    return count
@@ -4,6 +4,8 @@ from .views import (
     shop_index,
     ProductsListView,
     handle_file_upload,
+    UploadSessionsView,
+    UploadSessionView,
     ProductCreateView,
     ProductDetailView,
     ProductUpdateView,
@@ -14,9 +16,14 @@ from .views import (
     OrderUpdateView,
     OrderDeleteView,
     OrderExportView,
+    JobStatusView,
+    JobDownloadView,
     ProductViewSet,
     OrderViewSet,
-    LatestProductsFeed,
+    ProductSalesViewSet,
+    PromocodeOrdersViewSet,
+    UserMonthOrdersViewSet,
+    latest_products_feed,
     UserOrderListView,
     UserOrderExportView,
 )
@@ -26,6 +33,9 @@ app_name = 'shopapp'
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("order", OrderViewSet)
+routers.register("analytics/product-sales", ProductSalesViewSet)
+routers.register("analytics/promocodes", PromocodeOrdersViewSet)
+routers.register("analytics/user-months", UserMonthOrdersViewSet)
 
 urlpatterns = [
     path("", shop_index, name="index"),
@@ -41,8 +51,12 @@ urlpatterns = [
     path("orders/<int:pk>/delete/", OrderDeleteView.as_view(), name='order_delete'),
     path("orders/create/", OrderCreateView.as_view(), name='order_create'),
     path("orders/export/", OrderExportView.as_view(), name='order_export'),
+    path("jobs/<int:pk>/", JobStatusView.as_view(), name='job'),
+    path("jobs/<int:pk>/download/", JobDownloadView.as_view(), name='job_download'),
     path("upload/", handle_file_upload, name='file_upload'),
-    path("products/latest/feed/", LatestProductsFeed(), name="products_feed"),
+    path("uploads/", UploadSessionsView.as_view(), name='upload_sessions'),
+    path("uploads/<uuid:pk>/", UploadSessionView.as_view(), name='upload_session'),
+    path("products/latest/feed/", latest_products_feed, name="products_feed"),
     path("users/<int:user_id>/orders/", UserOrderListView.as_view(), name='user_orders_list'),
     path("users/<int:user_id>/orders/export/", UserOrderExportView.as_view(), name='user_orders_export'),
 ]
@@ -0,0 +1,84 @@
+"""
+Generation counters for cache keys.
+
+Every cached value that depends on some data includes the current generation of
+that data in its key. Signals bump the generation when the data changes, so old
+entries are simply never read again and can be cached for a long time.
+"""
+import time
+from typing import Hashable, Iterable
+
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = "shopapp:version"
+
+
+def _version_key(namespace: str, scope: Hashable = None) -> str:
+    if scope is None:
+        return f"{VERSION_KEY_PREFIX}:{namespace}"
+    return f"{VERSION_KEY_PREFIX}:{namespace}:{scope}"
+
+
+def _initial_version() -> int:
+    # A fresh counter starts from the clock so that a counter lost to cache
+    # eviction can never come back with a generation that was already used.
+    return time.time_ns()
+
+
+def get_version(namespace: str, scope: Hashable = None) -> int:
+    """
+    Return the current generation of ``namespace``/``scope``.
+    """
+    key = _version_key(namespace, scope)
+    version = cache.get(key)
+    if version is None:
+        version = _initial_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_versions(namespace: str, scopes: Iterable[Hashable]) -> dict:
+    """
+    Return generations for many scopes of one namespace with a single cache round trip.
+    """
+    keys = {_version_key(namespace, scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, scope in keys.items():
+        if scope not in versions:
+            versions[scope] = get_version(namespace, scope)
+    return versions
+
+
+def bump_version(namespace: str, scope: Hashable = None) -> int:
+    """
+    Move ``namespace``/``scope`` to a new generation, invalidating keys built from the old one.
+    """
+    key = _version_key(namespace, scope)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_versions(namespace: str, scopes: Iterable[Hashable]):
+    """
+    Move many scopes of one namespace to a new generation with a single cache round trip.
+
+    The new generations come from the clock, like fresh counters, instead of ``incr``.
+    """
+    version = _initial_version()
+    cache.set_many({_version_key(namespace, scope): version for scope in set(scopes)}, timeout=None)
+
+
+def versioned_key(namespace: str, scope: Hashable = None, *parts) -> str:
+    """
+    Build a cache key that changes whenever ``namespace``/``scope`` is bumped.
+    """
+    version = get_version(namespace, scope)
+    suffix = ":".join(str(part) for part in parts)
+    key = f"{namespace}:{scope}:v{version}"
+    return f"{key}:{suffix}" if suffix else key
@@ -1,23 +1,69 @@
+import hashlib
 import json
+import logging
 from timeit import default_timer
 
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.models import User
 from django.contrib.syndication.views import Feed
-from django.core.files.storage import FileSystemStorage
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, HttpResponse, HttpRequest, HttpResponseRedirect, HttpResponseBadRequest, Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
+from django.utils import translation
 from django.core.cache import cache
-from django.views.generic import ListView, DetailView, UpdateView, CreateView, DeleteView, TemplateView
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.http import condition
+from django.views.generic import ListView, DetailView, UpdateView, CreateView, DeleteView
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.permissions import IsAdminUser
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.filters import OrderingFilter
 
 from myauth.models import Profile
+from .conditional import (
+    acondition, catalogue_etag, catalogue_last_modified, product_etag, product_last_modified,
+)
+from .exports import STREAM_FORMATS, aexport_json, stream_orders
 from .forms import ProductForm, OrderForm
-from .models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from .jobs import root as jobs_root, submit as submit_job
+from .models import Job, Product, Order, ProductDailySales, PromocodeDailyOrders, UploadSession, Upload, UserMonthlyOrders
+from .pagination import ShopPagination, VersionedCountPaginator
+from .search import ProductSearchFilter
+from .serializers import (
+    ProductSerializer,
+    OrderSerializer,
+    OrderExpandedSerializer,
+    ProductDailySalesSerializer,
+    PromocodeDailyOrdersSerializer,
+    UserMonthlyOrdersSerializer,
+)
+from .signals import (
+    CATALOGUE_NAMESPACE, ORDER_NAMESPACE, ORDER_PRODUCT_NAMESPACE, ORDER_USER_NAMESPACE, ORDERS_NAMESPACE,
+)
+from .uploads import (
+    HashingFileUploadHandler,
+    UploadRejected,
+    cancel_session,
+    finish_session,
+    form_max_size,
+    parse_content_range,
+    receive_chunk,
+    save_upload,
+    start_session,
+    upload_url,
+)
+from .versioning import get_version, get_versions, versioned_key
+
+log = logging.getLogger(__name__)
 
 
 def shop_index(request: HttpRequest):
@@ -30,8 +76,9 @@ def shop_index(request: HttpRequest):
 class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ShopPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         OrderingFilter,
     ]
     search_fields = ["name", "description"]
@@ -49,32 +96,149 @@ class ProductViewSet(ModelViewSet):
         "discount",
     ]
 
+    @method_decorator(condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class OrderViewSet(ModelViewSet):
+    """
+    Orders with their product ids; ``?expand=products`` embeds the products themselves.
+    """
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = ShopPagination
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter,
     ]
-    filterset_fields = [
-        "user",
-        "created_at",
-        "promocode",
-    ]
+    filterset_fields = {
+        "user": ["exact"],
+        "created_at": ["exact"],
+        "promocode": ["exact"],
+        "items_count": ["exact", "gte", "lte"],
+        "total": ["exact", "gte", "lte"],
+        "discounted_total": ["exact", "gte", "lte"],
+    }
     ordering_fields = [
         "user",
         "created_at",
         "promocode",
+        "items_count",
+        "total",
+        "discounted_total",
+    ]
+
+    def expand_products(self) -> bool:
+        expand = self.request.query_params.get("expand", "")
+        return self.request.method == "GET" and "products" in expand.split(",")
+
+    def get_queryset(self):
+        if self.expand_products():
+            products = Prefetch("products")
+        else:
+            products = Prefetch("products", queryset=Product.objects.only("pk"))
+        return super().get_queryset().prefetch_related(products)
+
+    def get_serializer_class(self):
+        if self.expand_products():
+            return OrderExpandedSerializer
+        return super().get_serializer_class()
+
+
+class ProductSalesViewSet(ReadOnlyModelViewSet):
+    """
+    Units and revenue per product per day, from the ``ProductDailySales`` rollup.
+    """
+    queryset = ProductDailySales.objects.all()
+    serializer_class = ProductDailySalesSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = ShopPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        OrderingFilter,
+    ]
+    filterset_fields = {
+        "product": ["exact"],
+        "day": ["exact", "gte", "lte"],
+    }
+    ordering_fields = ["day", "units", "revenue"]
+    ordering = ["-day", "product"]
+
+
+class PromocodeOrdersViewSet(ReadOnlyModelViewSet):
+    """
+    Orders per promocode per day, from the ``PromocodeDailyOrders`` rollup.
+    """
+    queryset = PromocodeDailyOrders.objects.all()
+    serializer_class = PromocodeDailyOrdersSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = ShopPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        OrderingFilter,
     ]
+    filterset_fields = {
+        "promocode": ["exact"],
+        "day": ["exact", "gte", "lte"],
+    }
+    ordering_fields = ["day", "orders"]
+    ordering = ["-day", "promocode"]
+
+
+class UserMonthOrdersViewSet(ReadOnlyModelViewSet):
+    """
+    Orders per user per month, from the ``UserMonthlyOrders`` rollup.
+    """
+    queryset = UserMonthlyOrders.objects.all()
+    serializer_class = UserMonthlyOrdersSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = ShopPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        OrderingFilter,
+    ]
+    filterset_fields = {
+        "user": ["exact"],
+        "month": ["exact", "gte", "lte"],
+    }
+    ordering_fields = ["month", "orders"]
+    ordering = ["-month", "user"]
 
 # ================================Products=============================================
 class ProductsListView(ListView):
-    queryset = Product.objects.filter(archived=False)
+    """
+    The catalogue, page by page.
+
+    Every page is rendered once per catalogue version: the template caches it
+    with ``{% cache %}`` under ``catalogue_version``, which the product signals
+    and admin actions bump. The page count is cached the same way, so a cached
+    page costs no product query at all.
+    """
+    # ``pk`` keeps products created in the same instant on one page each; the
+    # index on ``-created_at`` ends in the rowid, so it still serves this order.
+    queryset = Product.objects.filter(archived=False).order_by("-created_at", "pk")
     template_name = "shopapp/products-list.html"
     context_object_name = "products"
+    paginate_by = 50
+    paginator_class = VersionedCountPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return super().get_paginator(
+            queryset, per_page, orphans, allow_empty_first_page, namespace=CATALOGUE_NAMESPACE, **kwargs,
+        )
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["catalogue_version"] = get_version(CATALOGUE_NAMESPACE)
+        return context
 
+
+@method_decorator(condition(etag_func=product_etag, last_modified_func=product_last_modified), name="dispatch")
 class ProductDetailView(DetailView):
     template_name = "shopapp/product-details.html"
     model = Product
@@ -133,7 +297,12 @@ class LatestProductsFeed(Feed):
     description = "Updates on products"
     link = reverse_lazy("shopapp:index")
 
+    def __init__(self, products=None):
+        self.products = products
+
     def items(self):
+        if self.products is not None:
+            return self.products
         return (
             Product.objects.filter(archived=False)
             .order_by("-created_at")[:5]
@@ -145,9 +314,64 @@ class LatestProductsFeed(Feed):
     def item_description(self, item: Product):
         return item.description
 
+
+@acondition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)
+async def latest_products_feed(request: HttpRequest) -> HttpResponse:
+    """
+    Load the feed items with the async ORM, then render the feed without touching the database.
+    """
+    products = [product async for product in LatestProductsFeed().items()]
+    return LatestProductsFeed(products)(request)
+
 # ================================Orders=============================================
-class OrdersListView(ListView):
-    model = Order
+class OrderFragmentsMixin:
+    """
+    Russian-doll caching for ``orders-list.html``.
+
+    Every order is rendered once per version of that order, of its user and
+    of each of its products: signals bump the order's when the order changes,
+    and a single version for a product or a user, however many orders show
+    it. The product ids of the page cost one query on the link table. The
+    whole list is cached under a digest of the fragment versions, so a change
+    re-renders the list around the cached fragments of the orders that did
+    not change. Only the orders whose fragment is missing get their products
+    prefetched.
+    """
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        orders = list(context["object_list"])
+        product_ids = {order.pk: [] for order in orders}
+        links = Order.products.through.objects.filter(order_id__in=product_ids).values_list("order_id", "product_id")
+        for order_id, product_id in links.order_by("order_id", "product_id"):
+            product_ids[order_id].append(product_id)
+        versions = get_versions(ORDER_NAMESPACE, product_ids)
+        products = get_versions(ORDER_PRODUCT_NAMESPACE, {pk for pks in product_ids.values() for pk in pks})
+        users = get_versions(ORDER_USER_NAMESPACE, {order.user_id for order in orders})
+        language = translation.get_language()
+        for order in orders:
+            order.fragment_version = "-".join(map(str, [
+                versions[order.pk], users[order.user_id], *(f"{pk}.{products[pk]}" for pk in product_ids[order.pk]),
+            ]))
+        digest = hashlib.md5(
+            ",".join(f"{order.pk}:{order.fragment_version}" for order in orders).encode()
+        ).hexdigest()
+        list_key = make_template_fragment_key("orders_list", [language, digest])
+        order_keys = {
+            make_template_fragment_key("order", [order.pk, order.fragment_version, language]): order
+            for order in orders
+        }
+        cached = cache.get_many([list_key, *order_keys])
+        if list_key not in cached:
+            missing = [order for key, order in order_keys.items() if key not in cached]
+            prefetch_related_objects(missing, "products")
+        context.update({context_key: orders for context_key in ("object_list", self.context_object_name)})
+        context["orders_digest"] = digest
+        return context
+
+
+class OrdersListView(OrderFragmentsMixin, ListView):
+    queryset = Order.objects.select_related("user")
     template_name = "shopapp//orders-list.html"
     context_object_name = "orders"
 
@@ -193,56 +417,92 @@ class OrderDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy("shopapp:orders_list")
 
 
-class OrderExportView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
-    def test_func(self):
-        return self.request.user.is_staff
-
-    def get(self, request: HttpRequest) -> HttpResponse:
-        data = dict()
-        data["orders"] = list()
-        for order in Order.objects.all():
-            order_dict = {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user_id": order.user_id,
-                "products": [product.pk for product in order.products.all()],
-            }
-            data["orders"].append(order_dict)
-        return HttpResponse(json.dumps(data))
-
-
-class UserOrderExportView(LoginRequiredMixin, TemplateView):
+async def aget_user(request: HttpRequest):
+    """
+    Resolve the lazy ``request.user`` off the event loop; Django 4.2 has no ``request.auser()``.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+class AsyncLoginRequiredView(View):
+    """
+    LoginRequiredMixin and UserPassesTestMixin for views with async handlers.
+    """
+
+    def test_func(self, user) -> bool:
+        return True
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not self.test_func(user):
+            raise PermissionDenied
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class OrderExportView(AsyncLoginRequiredView):
+    """
+    Export all orders as JSON.
+
+    ``?stream=json`` streams the same document in chunks and ``?stream=ndjson``
+    streams one order per line; both keep memory flat for any number of orders.
+    """
+
+    def test_func(self, user) -> bool:
+        return user.is_staff
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        orders = Order.objects.all()
+        stream = request.GET.get("stream")
+        if stream is None:
+            return HttpResponse(await aexport_json(orders), content_type="application/json")
+        if stream not in STREAM_FORMATS:
+            return HttpResponseBadRequest(f"Unknown stream format: {stream}")
+        return stream_orders(request, orders, stream)
+
+    async def post(self, request: HttpRequest) -> HttpResponse:
+        """
+        Queue the export as a background job; answers 202 with the job to poll.
+
+        ``?format=json`` (the default) or ``ndjson`` and ``?user_id=`` as for ``GET``.
+        """
+        stream_format = request.GET.get("format", "json")
+        if stream_format not in STREAM_FORMATS:
+            return HttpResponseBadRequest(f"Unknown format: {stream_format}")
+        params = {"format": stream_format}
+        if request.GET.get("user_id", "").isdigit():
+            params["user_id"] = int(request.GET["user_id"])
+        job = await sync_to_async(submit_job)("export_orders", params, await aget_user(request))
+        data = job_data(job)
+        return JsonResponse(data, status=202, headers={"Location": data["url"]})
+
+
+class UserOrderExportView(AsyncLoginRequiredView):
     serializer_class = OrderSerializer
 
-    def get(self, request: HttpRequest, user_id) -> HttpResponse:
-        cached_key = "orders_data_export" + user_id
-        data = cache.get(cached_key)
+    async def get(self, request: HttpRequest, user_id) -> HttpResponse:
+        cached_key = await sync_to_async(versioned_key)(ORDERS_NAMESPACE, user_id, "export")
+        data = await cache.aget(cached_key)
         if data is None:
-            data = dict()
-            data["orders"] = list()
-            self.owner = get_object_or_404(User, id=user_id)
-            for order in Order.objects.filter(user_id=self.owner):
-                order_dict = {
-                    "pk": order.pk,
-                    "delivery_address": order.delivery_address,
-                    "promocode": order.promocode,
-                    "user_id": order.user_id,
-                    "products": [product.pk for product in order.products.all()],
-                }
-                data["orders"].append(order_dict)
-            cache.set(cached_key, data, 300)
-        return HttpResponse(json.dumps(data))
-
-
-class UserOrderListView(ListView, LoginRequiredMixin):
+            try:
+                self.owner = await User.objects.aget(id=user_id)
+            except User.DoesNotExist:
+                raise Http404
+            data = await aexport_json(Order.objects.filter(user_id=self.owner))
+            await cache.aset(cached_key, data, settings.SHOP_EXPORT_CACHE_TIMEOUT)
+        return HttpResponse(data, content_type="application/json")
+
+
+class UserOrderListView(OrderFragmentsMixin, ListView, LoginRequiredMixin):
     model = Order
     template_name = "shopapp//orders-list.html"
     context_object_name = "orders"
 
     def get_queryset(self) -> HttpResponse:
         self.owner = get_object_or_404(User, id=self.kwargs['user_id'])
-        return Order.objects.filter(user_id=self.owner)
+        return Order.objects.filter(user_id=self.owner).select_related("user")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -251,23 +511,164 @@ class UserOrderListView(ListView, LoginRequiredMixin):
 
 
 # ================================Other=============================================
-def handle_file_upload(request: HttpRequest):
-    big_file = False
-    filename = "null"
-    if request.method == "POST" and request.FILES.get("myfile"):
-        myfile = request.FILES["myfile"]
-        filesize = myfile.size
-        if filesize > 1024*1024:
-            big_file = True
-            print("File too big!", filesize)
-        else:
-            fs = FileSystemStorage()
-            filename = fs.save(myfile.name, myfile)
-            print("saved file", filename)
+def check_csrf(request: HttpRequest):
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+
+async def handle_file_upload(request: HttpRequest):
+    user = await aget_user(request)
     context = {
-        "big_file": big_file,
-        "filename": filename
+        "big_file": False,
+        "max_size": form_max_size(user),
+    }
+    if request.method == "POST":
+        handler = HashingFileUploadHandler(request, max_size=context["max_size"])
+        request.upload_handlers = [handler]
+        # The CSRF check reads the form, so it runs once the streaming handler is installed.
+        rejected = await sync_to_async(check_csrf)(request)
+        if rejected is not None:
+            return rejected
+        files = await sync_to_async(lambda: request.FILES)()
+        if handler.too_large:
+            context["big_file"] = True
+            log.info("Upload over %s bytes rejected", handler.max_size)
+        elif files.get("myfile"):
+            upload, created = await sync_to_async(save_upload)(files["myfile"], user if user.is_authenticated else None)
+            context.update(upload=upload, upload_url=upload_url(upload), deduplicated=not created)
+            log.info("Saved upload %s as %s", upload.name, upload.blob.sha256)
+    return await sync_to_async(render)(request, 'shopapp/file-upload.html', context=context)
+
+
+# The form is CSRF checked in the view, after the upload handler is installed.
+handle_file_upload.csrf_exempt = True
+
+
+def upload_data(upload: Upload, created: bool) -> dict:
+    return {
+        "name": upload.name,
+        "sha256": upload.blob.sha256,
+        "size": upload.blob.size,
+        "url": upload_url(upload),
+        "deduplicated": not created,
     }
-    return render(request, 'shopapp/file-upload.html', context=context)
 
 
+def session_data(session: UploadSession) -> dict:
+    return {
+        "id": str(session.pk),
+        "name": session.name,
+        "size": session.size,
+        "offset": session.received,
+        "chunk_size": settings.SHOP_UPLOADS["CHUNK_SIZE"],
+        "url": reverse("shopapp:upload_session", kwargs={"pk": session.pk}),
+    }
+
+
+def rejected_response(error: UploadRejected) -> JsonResponse:
+    return JsonResponse({"error": str(error), **error.details}, status=error.status)
+
+
+class UploadSessionsView(LoginRequiredMixin, View):
+    """
+    Start a resumable upload: POST ``{"name": ..., "size": ...}`` as JSON.
+    """
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        try:
+            data = json.loads(request.body)
+            name, size = str(data["name"]), int(data["size"])
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": 'expected {"name": ..., "size": ...}'}, status=400)
+        try:
+            session = start_session(request.user, name, size)
+        except UploadRejected as error:
+            return rejected_response(error)
+        if not session.size:
+            return JsonResponse(upload_data(*finish_session(session)), status=201)
+        data = session_data(session)
+        return JsonResponse(data, status=201, headers={"Location": data["url"]})
+
+
+class UploadSessionView(LoginRequiredMixin, View):
+    """
+    A resumable upload: GET its offset, PUT the next chunk with a ``Content-Range``, DELETE to cancel.
+
+    The chunk that completes the file answers 201 with the stored upload.
+    """
+
+    def get_session(self, request: HttpRequest, pk) -> UploadSession:
+        return get_object_or_404(UploadSession, pk=pk, user=request.user)
+
+    def get(self, request: HttpRequest, pk) -> HttpResponse:
+        return JsonResponse(session_data(self.get_session(request, pk)))
+
+    def put(self, request: HttpRequest, pk) -> HttpResponse:
+        session = self.get_session(request, pk)
+        try:
+            start, end = parse_content_range(request.headers.get("Content-Range", ""), session.size)
+            # The body is read from the request stream, never loaded whole.
+            receive_chunk(session, start, end, request)
+        except UploadRejected as error:
+            return rejected_response(error)
+        if session.received < session.size:
+            return JsonResponse(session_data(session))
+        return JsonResponse(upload_data(*finish_session(session)), status=201)
+
+    def delete(self, request: HttpRequest, pk) -> HttpResponse:
+        cancel_session(self.get_session(request, pk))
+        return HttpResponse(status=204)
+
+
+def job_data(job: Job) -> dict:
+    data = {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "progress": {"done": job.progress_done, "total": job.progress_total},
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "url": reverse("shopapp:job", kwargs={"pk": job.pk}),
+    }
+    if job.status == Job.DONE:
+        data["result"] = job.result
+        if job.result_file:
+            data["download_url"] = reverse("shopapp:job_download", kwargs={"pk": job.pk})
+    if job.status in (Job.QUEUED, Job.FAILED) and job.error.strip():
+        # The last line of the traceback; the whole of it is in the worker log.
+        data["error"] = job.error.strip().splitlines()[-1]
+    if job.status == Job.QUEUED:
+        data["run_after"] = job.run_after
+    return data
+
+
+class JobMixin(LoginRequiredMixin):
+    def get_job(self, request: HttpRequest, pk) -> Job:
+        jobs = Job.objects.all() if request.user.is_staff else Job.objects.filter(created_by=request.user)
+        return get_object_or_404(jobs, pk=pk)
+
+
+class JobStatusView(JobMixin, View):
+    """
+    Poll a background job: its status, progress and, once done, its result.
+    """
+
+    def get(self, request: HttpRequest, pk) -> HttpResponse:
+        return JsonResponse(job_data(self.get_job(request, pk)))
+
+
+class JobDownloadView(JobMixin, View):
+    """
+    Download the result file of a finished job.
+    """
+
+    def get(self, request: HttpRequest, pk) -> HttpResponse:
+        job = self.get_job(request, pk)
+        if job.status != Job.DONE or not job.result_file:
+            raise Http404
+        path = jobs_root() / job.result_file
+        if not path.exists():
+            raise Http404
+        return FileResponse(path.open("rb"), as_attachment=True, filename=f"{job.kind}-{job.pk}{path.suffix}")